@@ -0,0 +1,216 @@
+"""Offline stand-ins for the discord.py objects the cogs interact with.
+
+Only the attributes and coroutines actually touched by the cogs are implemented,
+so that the real cog code can be driven without a gateway connection.
+"""
+import asyncio
+from datetime import datetime, timezone
+import itertools
+
+import discord
+
+from utils.cache import UserProfiles
+from utils.store import MemberStore
+from utils.views import ViewManager
+
+_ids = itertools.count(100_000_000_000_000_000)
+
+
+def next_id():
+    return next(_ids)
+
+
+class FakeAsset:
+    def __init__(self, url):
+        self.url = url
+
+
+class FakeUser:
+    def __init__(self, id, accent_color=None):
+        self.id = id
+        self.accent_color = accent_color
+
+
+class FakeRole:
+    def __init__(self, guild, name):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+
+    @property
+    def members(self):
+        return [member for member in self.guild.members if self in member.roles]
+
+    @property
+    def mention(self):
+        return f"<@&{self.id}>"
+
+
+class FakeChannel:
+    def __init__(self, guild, name="general"):
+        self.id = next_id()
+        self.guild = guild
+        self.name = name
+        self.sent = 0
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+
+class FakeMember:
+    def __init__(self, guild, id=None, name=None, bot=False):
+        self.id = id or next_id()
+        self.guild = guild
+        self.name = name or f"member-{self.id}"
+        self.nick = None
+        self.bot = bot
+        self.roles = []
+        self.color = discord.Color.default()
+        self.avatar = FakeAsset(f"https://cdn.example/avatars/{self.id}.png")
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FakeMember)
+            and self.id == other.id
+            and self.guild.id == other.guild.id
+        )
+
+    def __hash__(self):
+        return hash((self.guild.id, self.id))
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def display_name(self):
+        return self.nick or self.name
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def add_roles(self, *roles):
+        self.roles.extend(roles)
+
+    async def edit(self, *, nick=None, **kwargs):
+        self.nick = nick
+
+
+class FakeGuild:
+    def __init__(self, bot_user_id, name="Benchmark Guild"):
+        self.id = next_id()
+        self.name = name
+        self.chunked = True
+        self.me = FakeMember(self, id=bot_user_id, name="bot", bot=True)
+        self.system_channel = FakeChannel(self, "system")
+        self._members = {}
+        self._roles = {}
+        self._channels = {self.system_channel.id: self.system_channel}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def add_member(self, member=None):
+        member = member or FakeMember(self)
+        self._members[member.id] = member
+        return member
+
+    def add_role(self, name):
+        role = FakeRole(self, name)
+        self._roles[role.id] = role
+        return role
+
+    def add_channel(self, name):
+        channel = FakeChannel(self, name)
+        self._channels[channel.id] = channel
+        return channel
+
+    def get_member(self, id):
+        return self._members.get(id)
+
+    def get_role(self, id):
+        return self._roles.get(id)
+
+    def get_channel(self, id):
+        return self._channels.get(id)
+
+
+class FakeMessage:
+    def __init__(self, author, content="", created_at=None, channel=None):
+        self.created_at = created_at or datetime.now(timezone.utc)
+        self.id = discord.utils.time_snowflake(self.created_at) + next(_ids) % 4096
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel or author.guild.system_channel
+        self.content = content
+
+
+class FakeContext:
+    def __init__(self, bot, message, command=None):
+        self.bot = bot
+        self.message = message
+        self.author = message.author
+        self.guild = message.guild
+        self.channel = message.channel
+        self.command = command
+        self.prefix = "!"
+        self.replies = 0
+
+    async def reply(self, content=None, **kwargs):
+        self.replies += 1
+
+    async def send(self, content=None, **kwargs):
+        self.replies += 1
+
+
+class FakeBot:
+    """Minimal bot exposing what the cogs use: `loop`, `db`, `user` and a few
+    lookup helpers.
+    """
+
+    def __init__(self, loop, db):
+        self.loop = loop
+        self.db = db
+        self.user = FakeUser(next_id())
+        self.guilds = []
+        self.cogs = {}
+        self.fetch_user_calls = 0
+        self.profiles = UserProfiles(self.fetch_user)
+        self.views = ViewManager(self)
+        self.member_store = MemberStore()
+
+    def add_cog(self, cog):
+        self.cogs[type(cog).__name__] = cog
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def owns_guild(self, guild_id):
+        return True
+
+    def get_guild(self, guild_id):
+        return discord.utils.get(self.guilds, id=guild_id)
+
+    async def get_guild_members(self, guild):
+        return guild.members
+
+    async def wait_until_ready(self):
+        # the fake bot never connects, background tasks are driven by hand
+        await asyncio.Event().wait()
+
+    def add_guild(self, name="Benchmark Guild"):
+        guild = FakeGuild(self.user.id, name)
+        self.guilds.append(guild)
+        return guild
+
+    async def get_context(self, message):
+        return FakeContext(self, message)
+
+    async def fetch_user(self, user_id):
+        self.fetch_user_calls += 1
+        return FakeUser(user_id)
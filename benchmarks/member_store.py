@@ -0,0 +1,156 @@
+"""Compare the memory and speed of `utils.store.MemberStore` with dicts keyed by
+(guild ID, member ID), for the per-member fields the cogs keep in memory.
+
+Run from the repository root:
+
+    python -m benchmarks.member_store
+    python -m benchmarks.member_store --guilds 100 --members 10000
+
+The dicts hold what the cogs held before the store: the XP cooldown as a datetime
+and the balance as a number. Memory is measured with tracemalloc while the
+structures are built, and the timings are per operation.
+"""
+import argparse
+import bisect
+from collections import Counter
+from datetime import datetime, timezone
+import heapq
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.fakes import next_id
+from utils.store import MemberStore
+
+# XP needed to reach each level, as computed by the Roleplay cog for `rank levels`
+LEVEL_EDGES = np.cumsum([0] + [5 * n**2 + 50 * n + 100 for n in range(99)])
+
+
+def build_dicts(rows):
+    last_message, balances = {}, {}
+    for guild_id, member_id, timestamp, balance in rows:
+        last_message[(guild_id, member_id)] = datetime.fromtimestamp(
+            timestamp, timezone.utc
+        )
+        balances[(guild_id, member_id)] = balance
+    return last_message, balances
+
+
+def build_store(rows):
+    guilds = {}
+    for guild_id, member_id, timestamp, balance in rows:
+        guilds.setdefault(guild_id, []).append((member_id, timestamp, balance))
+
+    store = MemberStore()
+    store.add_column("last_message", "d")
+    store.add_column("balance", "q")
+    for guild_id, members in guilds.items():
+        member_ids, timestamps, balances = zip(*members)
+        store.load(guild_id, "last_message", member_ids, timestamps)
+        store.load(guild_id, "balance", member_ids, balances)
+    return store
+
+
+def measure(build, rows):
+    """Return the structures built from the rows and the memory they hold."""
+
+    tracemalloc.start()
+    try:
+        built = build(rows)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return built, size
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for args in calls:
+        func(*args)
+    return (time.perf_counter() - start) / len(calls)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=10_000, help="per guild")
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    now = time.time()
+
+    guild_ids = [next_id() for _ in range(args.guilds)]
+    rows = [
+        (guild_id, next_id(), now - rng.uniform(0, 86_400), rng.randint(0, 10**6))
+        for guild_id in guild_ids
+        for _ in range(args.members)
+    ]
+    pairs = len(rows)
+
+    (last_message, balances), dict_size = measure(build_dicts, rows)
+    store, store_size = measure(build_store, rows)
+
+    print(f"{pairs} members in {args.guilds} guilds\n")
+    print(f"{'':<24} {'dicts':>12} {'store':>12}")
+    print(
+        f"{'memory':<24} {dict_size / 2**20:>10.1f}MB {store_size / 2**20:>10.1f}MB"
+    )
+    print(
+        f"{'bytes per member':<24} {dict_size / pairs:>12.0f} "
+        f"{store_size / pairs:>12.0f}"
+    )
+
+    keys = [rng.choice(rows)[:2] for _ in range(args.lookups)]
+    timings = {
+        "get": (
+            per_call(lambda g, m: balances.get((g, m), 0), keys),
+            per_call(lambda g, m: store.get(g, m, "balance"), keys),
+        ),
+        "add": (
+            per_call(
+                lambda g, m: balances.__setitem__((g, m), balances[g, m] + 1), keys
+            ),
+            per_call(lambda g, m: store.add(g, m, "balance", 1), keys),
+        ),
+    }
+
+    guild_id = guild_ids[0]
+    guild_balances = {m: b for (g, m), b in balances.items() if g == guild_id}
+    timings["top 10 of a guild"] = (
+        per_call(
+            lambda: heapq.nlargest(10, guild_balances.items(), key=lambda i: i[1]),
+            [()] * 20,
+        ),
+        per_call(lambda: store.top(guild_id, "balance", 10), [()] * 20),
+    )
+    edges = LEVEL_EDGES.tolist()
+    timings["level buckets of a guild"] = (
+        per_call(
+            lambda: Counter(
+                bisect.bisect_right(edges, b) for b in guild_balances.values()
+            ),
+            [()] * 5,
+        ),
+        per_call(
+            lambda: store.histogram(guild_id, "balance", LEVEL_EDGES), [()] * 5
+        ),
+    )
+
+    for name, (dicts, columns) in timings.items():
+        print(f"{name:<24} {dicts * 1e6:>10.2f}us {columns * 1e6:>10.2f}us")
+
+    # both approaches must agree
+    expected = heapq.nlargest(10, guild_balances.values())
+    assert [b for _, b in store.top(guild_id, "balance", 10)] == expected
+    assert len(store) == len(last_message) == pairs
+
+
+if __name__ == "__main__":
+    main()
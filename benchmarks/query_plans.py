@@ -0,0 +1,356 @@
+"""Check the query plan and latency of every registered SQL statement.
+
+Run from the repository root:
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --guilds 50 --members 2000
+
+`tests/test_query_plans.py` runs the same check with the rest of the tests.
+
+The cogs are loaded against a fresh temporary `bot.db` filled with synthetic data,
+then every statement registered with `utils.statements.statement` is explained
+and timed. A statement scanning a whole table, sorting through a temporary B-tree,
+or running over its latency budget fails the check, and the exit status is 1.
+
+Every statement the cogs run is registered: the reads and writes of the commands
+and listeners, the retention batch deletes and the warmup scans, which read whole
+tables on purpose and have a budget of their own. Writes are timed inside a
+transaction rolled back after each run. Two kinds of SQL are left out:
+
+- the schema statements and migrations of `create_tables`, which run once at
+  startup, inside a single transaction, and have no query plan to speak of;
+- the bodies of the triggers, which SQLite cannot explain on their own since they
+  read the NEW row. They run within the writes firing them, so their cost counts
+  in the latency of those writes, e.g. `payroll.run` pays a wage to 100 members
+  and `roleplay.add_experience` updates the daily totals.
+
+The ON DELETE CASCADE of the registry runs no SQL of the cogs either, but deleting
+a member or a guild searches every registered table by its foreign key. Those
+lookups are checked as "cascade.<table>.<scope>" statements. The lookups of one
+member's rows, which also include the member batch deletes of the retention, fail
+unless they search by both the guild and the member IDs: an index on the guild ID
+alone reads all of the guild's rows.
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import discord
+
+from benchmarks.fakes import FakeBot, next_id
+from bot import create_db_connection, create_tables
+from utils import registry
+from utils.statements import FULL_SCAN, STATEMENTS, TEMP_BTREE, Statement
+
+# "SCAN table" alone reads the whole table, "SCAN table USING INDEX" does not
+_FULL_SCAN_PATTERN = re.compile(r"SCAN \w+( AS \w+)?$")
+
+
+async def load_cogs(db):
+    """Load every cog, which registers their statements and creates the tables."""
+
+    bot = FakeBot(asyncio.get_running_loop(), db)
+
+    # imported late so that matplotlib picks up the repository's matplotlibrc
+    from cogs.economy import Economy
+    from cogs.meta import Meta
+    from cogs.payroll import Payroll
+    from cogs.retention import Retention, register_batch_deletes
+    from cogs.roleplay import Roleplay
+    from cogs.stats import Stats
+    from cogs.welcome import Welcome
+
+    for cog in (Meta, Welcome, Economy, Payroll, Roleplay, Stats, Retention):
+        bot.add_cog(cog(bot))
+
+    await create_tables(db, [bot.views, *bot.cogs.values()])
+    # the batch deletes depend on the tables registered by the cogs
+    register_batch_deletes()
+    return bot
+
+
+async def populate(db, args):
+    """Fill the tables with `args.guilds` guilds of `args.members` members, and
+    return sample parameters pointing at the first guild.
+    """
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    guild_ids = [next_id() for _ in range(args.guilds)]
+    members = {
+        guild_id: [next_id() for _ in range(args.members)] for guild_id in guild_ids
+    }
+
+    def moment():
+        return now - timedelta(days=args.days * rng.random())
+
+    await db.executemany(
+        "INSERT INTO economy_transaction VALUES (?, ?, ?, ?, ?)",
+        (
+            (rng.randint(-5000, 10_000), "Income", guild_id, member_id, moment())
+            for guild_id in guild_ids
+            for member_id in members[guild_id]
+            for _ in range(args.rows)
+        ),
+    )
+    await db.executemany(
+        "INSERT INTO roleplay_experience VALUES (?, ?, ?, ?)",
+        (
+            (
+                guild_id,
+                member_id,
+                discord.utils.time_snowflake(moment()) + rng.randrange(4096),
+                rng.randint(15, 25),
+            )
+            for guild_id in guild_ids
+            for member_id in members[guild_id]
+            for _ in range(args.rows)
+        ),
+    )
+    await db.executemany(
+        "INSERT INTO roleplay_season_summary VALUES (?, ?, 1, ?, ?)",
+        (
+            (guild_id, member_id, args.rows, args.rows * 20)
+            for guild_id in guild_ids
+            for member_id in members[guild_id]
+        ),
+    )
+    await db.executemany(
+        "INSERT INTO roleplay_season VALUES (?, 2, ?, NULL, NULL)",
+        ((guild_id, moment()) for guild_id in guild_ids),
+    )
+    await db.executemany(
+        "INSERT INTO meta_prefix VALUES (?, ?)",
+        ((guild_id, prefix) for guild_id in guild_ids for prefix in ("!", "?")),
+    )
+    await db.executemany(
+        "INSERT INTO welcome_data VALUES (?, ?, ?, ?)",
+        ((next_id(), guild_id, next_id(), "Welcome!") for guild_id in guild_ids),
+    )
+    await db.executemany(
+        "INSERT INTO economy_payroll VALUES (NULL, ?, 'wage', 'Wages', ?, 1000, 24, ?)",
+        ((guild_id, next_id(), now + timedelta(hours=1)) for guild_id in guild_ids),
+    )
+    await db.executemany(
+        "INSERT INTO view_registry VALUES (?, ?, ?, 'rname', ?, '', ?)",
+        (
+            (message_id, guild_id, member_id, f"rname:{message_id}", moment())
+            for guild_id in guild_ids
+            for member_id in members[guild_id][:10]
+            for message_id in [next_id()]
+        ),
+    )
+    # a few members left, and one guild
+    await db.executemany(
+        "UPDATE registry_member SET left_at = ? WHERE guild_id = ? AND member_id = ?",
+        (
+            (moment(), guild_id, member_id)
+            for guild_id in guild_ids
+            for member_id in rng.sample(members[guild_id], args.members // 20)
+        ),
+    )
+    await db.execute(
+        "UPDATE registry_guild SET left_at = ? WHERE guild_id = ?",
+        (moment(), guild_ids[-1]),
+    )
+    await db.commit()
+
+    guild_id = guild_ids[0]
+    return dict(
+        guild_id=guild_id,
+        member_id=members[guild_id][0],
+        limit=10,
+        start=(now - timedelta(days=30)).date().isoformat(),
+        now=now,
+        left_before=now - timedelta(days=7),
+        # the parameters of the writes, which are rolled back
+        prefix="$",
+        message_id=next_id(),
+        xp=20,
+        amount=1000,
+        description="Income",
+        time=now,
+        season=1,
+        length_days=30,
+        started_at=now,
+        closed_at=now,
+        left_at=now,
+        batch_size=500,
+        # the first payroll, a wage of the first guild
+        payroll_id=1,
+        kind="wage",
+        role_id=next_id(),
+        interval_hours=24,
+        next_run=now + timedelta(hours=24),
+        run_at=now,
+        members=json.dumps(members[guild_id][:100]),
+        default_role_id=next_id(),
+        welcome_channel_id=next_id(),
+        welcome_message="Welcome!",
+        user_id=members[guild_id][0],
+        custom_id="rname:0",
+        payload="",
+        expires_at=now + timedelta(minutes=10),
+    )
+
+
+def _preceding(name):
+    """Return the statements the bot runs to completion before `name`: the
+    registry entries are purged once the batch deletes emptied the tables.
+    """
+    scope = {"retention.purge_guild": "guild", "retention.purge_member": "member"}
+    if name not in scope:
+        return []
+    return [
+        statement
+        for other, statement in STATEMENTS.items()
+        if other.startswith("retention.delete.") and other.endswith(f".{scope[name]}")
+    ]
+
+
+def cascade_lookups():
+    """Return the lookups of the registered tables run by the ON DELETE CASCADE
+    of their registry rows, by name.
+    """
+    lookups = {}
+    for table, (scope, _) in registry.TABLES.items():
+        columns = ("guild_id", "member_id") if scope == "member" else ("guild_id",)
+        conditions = " AND ".join(f"{column} = :{column}" for column in columns)
+        name = f"cascade.{table}.{scope}"
+        lookups[name] = Statement(
+            name, f"SELECT 1 FROM {table} WHERE {conditions}", allow=(), budget=0.05
+        )
+    return lookups
+
+
+def _member_lookup(name):
+    """Return the table of a lookup of one member's rows, or None."""
+
+    for prefix in ("cascade.", "retention.delete."):
+        if name.startswith(prefix) and name.endswith(".member"):
+            return name[len(prefix) : -len(".member")]
+    return None
+
+
+def check(db, statement, params, repeat):
+    """Return the plan details, the median latency and the failures."""
+
+    plan = [
+        row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {statement.sql}", params)
+    ]
+
+    failures = []
+    for detail in plan:
+        if _FULL_SCAN_PATTERN.match(detail) and FULL_SCAN not in statement.allow:
+            failures.append(f"full scan: {detail}")
+        if detail.startswith(TEMP_BTREE) and TEMP_BTREE not in statement.allow:
+            failures.append(f"temporary sort: {detail}")
+
+    table = _member_lookup(statement.name)
+    if table is not None and not any(
+        re.match(rf"SEARCH {table} .*\(guild_id=\? AND member_id=\?", detail)
+        for detail in plan
+    ):
+        failures.append(f"not searched by member: {table}")
+
+    latencies = []
+    for _ in range(repeat):
+        # writes are rolled back, so every repetition sees the same data
+        db.execute("BEGIN")
+        for preceding in _preceding(statement.name):
+            while db.execute(preceding.sql, params).rowcount:
+                pass
+        start = time.perf_counter()
+        db.execute(statement.sql, params).fetchall()
+        latencies.append(time.perf_counter() - start)
+        db.execute("ROLLBACK")
+
+    latency = statistics.median(latencies)
+    if latency > statement.budget:
+        failures.append(
+            f"over budget: {latency * 1000:.2f}ms > {statement.budget * 1000:.0f}ms"
+        )
+
+    return plan, latency, failures
+
+
+def check_all(path, params, repeat):
+    """Check every registered statement and the cascade lookups against the
+    database at `path`, and return the plan details, the median latency and the
+    failures of each name.
+    """
+    db = sqlite3.connect(path, isolation_level=None)
+    # as in the bot, deletes cascade
+    db.execute("PRAGMA foreign_keys = ON")
+    try:
+        return {
+            name: check(db, statement, params, repeat)
+            for name, statement in sorted({**STATEMENTS, **cascade_lookups()}.items())
+        }
+    finally:
+        db.close()
+
+
+async def build(path, args):
+    db = await create_db_connection(path)
+    try:
+        bot = await load_cogs(db)
+        # stop the background tasks, the fake bot never gets ready
+        for cog in bot.cogs.values():
+            await discord.utils.maybe_coroutine(cog.cog_unload)
+        return await populate(db, args)
+    finally:
+        await db.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--members", type=int, default=1_000, help="per guild")
+    parser.add_argument(
+        "--rows", type=int, default=20, help="transactions and messages per member"
+    )
+    parser.add_argument("--days", type=int, default=365, help="history length")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="print every plan")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bot.db"
+        started = time.perf_counter()
+        params = asyncio.run(build(path, args))
+        print(f"built {path.name} in {time.perf_counter() - started:.1f}s\n")
+
+        results = check_all(path, params, args.repeat)
+
+    width = max(map(len, results))
+    failed = 0
+    for name, (plan, latency, failures) in results.items():
+        status = "FAIL" if failures else "ok"
+        print(f"{status:<4} {name:<{width}} {latency * 1000:>8.2f}ms")
+        for failure in failures:
+            print(f"       {failure}")
+        if args.verbose or failures:
+            for detail in plan:
+                print(f"       | {detail}")
+        failed += bool(failures)
+
+    print(f"\n{len(results) - failed} passed, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+"""Replay synthetic workloads through the real cogs without a Discord connection.
+
+Run from the repository root:
+
+    python -m benchmarks.run --workload all
+    python -m benchmarks.run --workload messages --events 50000 --rate 10000
+
+Every workload runs against a fresh temporary `bot.db` and reports the latency
+percentiles, the database operations issued per event and the memory used.
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import os
+from pathlib import Path
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from benchmarks.fakes import FakeBot, FakeContext, FakeMessage
+from bot import create_db_connection, create_tables, warm_caches
+from utils.members import max_rss_mib
+from utils.money import Money
+
+
+class CountingConnection:
+    """Proxy around an aiosqlite connection counting the operations issued."""
+
+    _counted = (
+        "commit",
+        "execute",
+        "execute_fetchall",
+        "execute_insert",
+        "executemany",
+        "executescript",
+    )
+
+    def __init__(self, db):
+        self._db = db
+        self.ops = Counter()
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name not in self._counted:
+            return attr
+
+        def counted(*args, **kwargs):
+            self.ops[name] += 1
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+class Benchmark:
+    def __init__(self, loop, db, members, seed):
+        self.bot = FakeBot(loop, CountingConnection(db))
+        self.guild = self.bot.add_guild()
+        self.members = [self.guild.add_member() for _ in range(members)]
+        self.random = random.Random(seed)
+
+        # imported late so that matplotlib picks up the repository's matplotlibrc
+        from cogs.economy import Economy
+        from cogs.roleplay import Roleplay
+        from cogs.welcome import Welcome
+
+        for cog in (Economy, Roleplay, Welcome):
+            self.bot.add_cog(cog(self.bot))
+
+        cogs = self.bot.cogs.values()
+        loop.run_until_complete(create_tables(db, cogs))
+        loop.run_until_complete(warm_caches(cogs))
+
+    def cog(self, name):
+        return self.bot.get_cog(name)
+
+    def reset_counters(self):
+        """Mark the end of the workload setup: counters and the clock restart."""
+
+        self.bot.db.ops.clear()
+        self.started = time.perf_counter()
+
+
+async def drive(events, handler, rate=None):
+    """Feed every event to `handler` and return the per-event latencies.
+
+    Without a rate the events are handled one after another as fast as possible.
+    With a rate (events/s) every event is started at its scheduled time as its own
+    task, like the gateway dispatches them, and the latency includes queueing.
+    """
+    latencies = []
+
+    if rate is None:
+        for event in events:
+            start = time.perf_counter()
+            await handler(event)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    async def timed(event, scheduled):
+        await handler(event)
+        latencies.append(time.perf_counter() - scheduled)
+
+    tasks = []
+    origin = time.perf_counter()
+    for index, event in enumerate(events):
+        scheduled = origin + index / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(timed(event, scheduled)))
+
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def workload_messages(bench, args):
+    """Chat messages going through `Roleplay.level_add_xp`."""
+
+    roleplay = bench.cog("Roleplay")
+    origin = datetime.now(timezone.utc)
+    # virtual timestamps follow the requested rate so that the XP cooldown
+    # triggers as it would in production
+    step = 1 / (args.rate or 10_000)
+    messages = [
+        FakeMessage(
+            bench.random.choice(bench.members),
+            content="hello there",
+            created_at=origin + timedelta(seconds=index * step),
+        )
+        for index in range(args.events)
+    ]
+
+    bench.reset_counters()
+    return await drive(messages, roleplay.level_add_xp, args.rate)
+
+
+async def workload_transfers(bench, args):
+    """Bursts of concurrent `send` commands between random members."""
+
+    economy = bench.cog("Economy")
+    for member in bench.members:
+        await economy.grant_money(Money(100_000_000), member)
+
+    ctxs = []
+    for _ in range(args.events):
+        author, to_member = bench.random.sample(bench.members, 2)
+        ctxs.append((FakeContext(bench.bot, FakeMessage(author)), to_member))
+
+    async def send(item):
+        ctx, to_member = item
+        await economy.send.callback(economy, ctx, Money(150), to_member=to_member)
+
+    bench.reset_counters()
+    latencies = []
+    for start in range(0, len(ctxs), args.burst):
+        burst = ctxs[start : start + args.burst]
+        results = await asyncio.gather(*[drive([item], send) for item in burst])
+        latencies.extend(lat for result in results for lat in result)
+
+    return latencies
+
+
+async def workload_joins(bench, args):
+    """Waves of new members going through `Welcome.on_member_join`."""
+
+    welcome = bench.cog("Welcome")
+    flags = SimpleNamespace(
+        role=bench.guild.add_role("Peasant"),
+        channel=bench.guild.add_channel("welcome"),
+        message="Welcome to the kingdom!",
+    )
+    await welcome._update_welcome_data(bench.guild, flags)
+
+    newcomers = [bench.guild.add_member() for _ in range(args.events)]
+
+    bench.reset_counters()
+    latencies = []
+    for start in range(0, len(newcomers), args.burst):
+        wave = newcomers[start : start + args.burst]
+        results = await asyncio.gather(
+            *[drive([member], welcome.on_member_join) for member in wave]
+        )
+        latencies.extend(lat for result in results for lat in result)
+
+    return latencies
+
+
+async def workload_history(bench, args):
+    """`rank history` renders for members with a realistic XP history."""
+
+    roleplay = bench.cog("Roleplay")
+    members = bench.members[: args.renders]
+    origin = datetime.now(timezone.utc) - timedelta(days=90)
+    for member in members:
+        for index in range(args.history):
+            message = FakeMessage(
+                member, created_at=origin + timedelta(minutes=index * 5)
+            )
+            await roleplay._add_experience(message, bench.random.randint(15, 25))
+
+    async def render(member):
+        ctx = FakeContext(bench.bot, FakeMessage(member))
+        await roleplay.rank_history.callback(roleplay, ctx, member=member)
+
+    bench.reset_counters()
+    return await drive(members, render)
+
+
+async def workload_payroll(bench, args):
+    """Full guild payroll rounds: a wage paid to every member, then an interest
+    and a tax on every balance, each round being one scheduler run.
+    """
+    from cogs.payroll import Payroll
+
+    payroll = Payroll(bench.bot)
+    bench.bot.add_cog(payroll)
+    await create_tables(bench.bot.db, [payroll])
+
+    economy = bench.cog("Economy")
+    serf = bench.guild.add_role("Serf")
+    for member in bench.members:
+        member.roles.append(serf)
+        await economy.grant_money(Money(bench.random.randint(100, 100_000)), member)
+
+    ctx = FakeContext(bench.bot, FakeMessage(bench.members[0]))
+    await payroll._add_payroll(
+        ctx, "wage", "Wages (Serf)", Money(1000), 24, role_id=serf.id
+    )
+    await payroll._add_payroll(ctx, "interest", "Interest", 0.01, 24)
+    await payroll._add_payroll(ctx, "tax", "Tax", -0.02, 24)
+
+    # one round per day, starting from the first scheduled run
+    origin = datetime.now(timezone.utc) - timedelta(days=args.payrolls)
+    await bench.bot.db.execute(
+        "UPDATE economy_payroll SET next_run = :origin", dict(origin=origin)
+    )
+    await bench.bot.db.commit()
+    rounds = [origin + timedelta(days=day) for day in range(args.payrolls)]
+
+    bench.reset_counters()
+    try:
+        return await drive(rounds, payroll.run_due)
+    finally:
+        payroll.cog_unload()
+
+
+WORKLOADS = {
+    "messages": workload_messages,
+    "transfers": workload_transfers,
+    "joins": workload_joins,
+    "history": workload_history,
+    "payroll": workload_payroll,
+}
+
+
+def _percentile(latencies, percent):
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method="inclusive")[percent - 1]
+
+
+def run_workload(name, args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = loop.run_until_complete(create_db_connection(Path(tmp) / "bot.db"))
+        try:
+            bench = Benchmark(loop, db, args.members, args.seed)
+
+            if args.tracemalloc:
+                tracemalloc.start()
+            latencies = loop.run_until_complete(WORKLOADS[name](bench, args))
+            elapsed = time.perf_counter() - bench.started
+            peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+            tracemalloc.stop()
+
+            ops = bench.bot.db.ops
+        finally:
+            loop.run_until_complete(db.close())
+            loop.close()
+
+    events = len(latencies)
+    return dict(
+        workload=name,
+        events=events,
+        throughput=events / elapsed if elapsed else 0.0,
+        p50=_percentile(latencies, 50) * 1000,
+        p99=_percentile(latencies, 99) * 1000,
+        ops_per_event=sum(ops.values()) / events if events else 0.0,
+        commits_per_event=ops["commit"] / events if events else 0.0,
+        peak_mib=peak / 2 ** 20 if peak is not None else None,
+    )
+
+
+def print_report(results):
+    header = (
+        f"{'workload':<10} {'events':>8} {'ev/s':>10} {'p50 ms':>9} {'p99 ms':>9} "
+        f"{'db ops/ev':>10} {'commits/ev':>11} {'peak MiB':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        peak = f"{r['peak_mib']:.1f}" if r["peak_mib"] is not None else "-"
+        print(
+            f"{r['workload']:<10} {r['events']:>8} {r['throughput']:>10.0f} "
+            f"{r['p50']:>9.3f} {r['p99']:>9.3f} {r['ops_per_event']:>10.2f} "
+            f"{r['commits_per_event']:>11.2f} {peak:>9}"
+        )
+    print(f"\nmax RSS: {max_rss_mib():.1f} MiB (pid {os.getpid()})")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--workload", choices=[*WORKLOADS, "all"], default=["all"], nargs="+"
+    )
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--members", type=int, default=1_000)
+    parser.add_argument(
+        "--rate", type=float, default=None, help="target events/s (open loop)"
+    )
+    parser.add_argument("--burst", type=int, default=100, help="concurrent events")
+    parser.add_argument(
+        "--renders", type=int, default=50, help="members rendered by `history`"
+    )
+    parser.add_argument(
+        "--history", type=int, default=500, help="XP rows per member for `history`"
+    )
+    parser.add_argument(
+        "--payrolls", type=int, default=20, help="payroll rounds for `payroll`"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--tracemalloc", action="store_true", help="track peak Python allocations"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = list(WORKLOADS) if "all" in args.workload else args.workload
+
+    results = []
+    for name in names:
+        results.append(run_workload(name, args))
+        print(f"finished {name}")
+
+    print()
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main()
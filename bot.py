@@ -1,33 +1,229 @@
+import argparse
+import asyncio
+import contextlib
 import datetime
+import logging
+import time
 
 import aiosqlite
 import discord
 from discord.ext import commands
 
-from private.config import token
+from utils.backup import lock_database
+from utils.cache import UserProfiles
+from utils.loop import LagMonitor
+from utils.members import MemberCachePolicy, max_rss_mib
+from utils.store import MemberStore
+from utils.views import ViewManager
 
+log = logging.getLogger(__name__)
 
-class MedievalBot(commands.Bot):
-    """Subclass of the commands.Bot class.
+
+class MedievalBot(commands.AutoShardedBot):
+    """Subclass of the commands.AutoShardedBot class.
     This class add functionality such as a database connection,
     global event handlers, and other utilities.
+
+    Run on its own it handles every shard. Under the launcher, each worker process
+    receives a subset of the shards through `shard_ids`/`shard_count`.
+
+    With `member_cache="active"` only the active members are cached and guilds
+    are chunked on demand, see MemberCachePolicy. `"full"` caches every member.
     """
 
     def __init__(self, *args, **kwargs):
+        # set by the launcher to signal the coordinator that this worker is ready
+        self._ready_event = kwargs.pop("ready_event", None)
+        loop_lag_budget = kwargs.pop("loop_lag_budget", 0.1)
+        self.initial_extensions = kwargs.pop("initial_extensions", [])
+        member_cache = kwargs.pop("member_cache", "full")
+        if member_cache == "active":
+            kwargs.setdefault("member_cache_flags", MemberCachePolicy.flags)
+            kwargs.setdefault("chunk_guilds_at_startup", False)
+
         super().__init__(*args, **kwargs)
 
-        # Make DB connection
-        self.db = self.loop.run_until_complete(
-            create_db_connection(kwargs.get("db_name", ":memory:"))
+        self.db_name = kwargs.get("db_name", ":memory:")
+        self.db = None
+        # shared lock refusing backup imports while the bot runs, see utils.backup
+        self._db_lock = None
+        self.profiles = UserProfiles(self.fetch_user)
+        self.lag_monitor = LagMonitor(budget=loop_lag_budget)
+        self.views = ViewManager(self)
+        # per-member fields of the cogs, such as the cached balances
+        self.member_store = MemberStore()
+        self.member_cache = (
+            MemberCachePolicy(self) if member_cache == "active" else None
         )
 
+        # startup phase name -> duration in seconds, see the `health` command
+        self.startup_timings = {}
+        self._launched_at = time.perf_counter()
+        self._first_response = False
+
+    def owns_guild(self, guild_id):
+        """Whether the guild is handled by the shards of this process."""
+
+        if self.shard_ids is None or self.shard_count is None:
+            return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def get_guild_members(self, guild):
+        """Return every member of the guild, requesting them from the gateway
+        without caching them when the guild was not chunked.
+        """
+        if guild.chunked:
+            return guild.members
+
+        members = await guild.chunk(cache=False)
+        if self.member_cache is not None:
+            self.member_cache.cache_kept_members(members)
+        return members
+
+    async def start(self, token, *, reconnect=True):
+        """Prepare the database, cogs and caches around the login, then connect."""
+
+        with self._startup_phase("database"):
+            if self.db_name != ":memory:":
+                self._db_lock = lock_database(self.db_name)
+            self.db = await create_db_connection(self.db_name)
+
+        with self._startup_phase("extensions"):
+            self.load_extensions(self.initial_extensions)
+
+        with self._startup_phase("schema"):
+            await create_tables(self.db, [self.views, *self.cogs.values()])
+
+        with self._startup_phase("login"):
+            await self.login(token)
+
+        with self._startup_phase("warmup"):
+            await warm_caches(self.cogs.values())
+            await self.views.restore()
+
+        self.lag_monitor.start()
+        self.views.start()
+        if self.member_cache is not None:
+            self.member_cache.start()
+        await self.connect(reconnect=reconnect)
+
+    def load_extensions(self, names):
+        """Load the extensions one after the other. `load_extension` is synchronous,
+        and the cogs' `setup` only construct them, so there is nothing to run
+        concurrently: importing in threads serializes on the import lock and the
+        GIL. The startup work that does wait, the schema and the cache warmup, is
+        batched after the cogs are loaded.
+        """
+        for name in names:
+            self.load_extension(name)
+
+    async def reload_extensions(self, names):
+        """Reload the extensions, handing the in-memory state of their cogs over.
+        Before the reload, each cog implementing `export_state` returns its warm
+        state (caches, cooldowns...), which the new cog of the same name receives
+        through `import_state`. The new cogs create their new tables, and the cogs
+        without a state to import are warmed from the database like at startup.
+
+        Return the names of the cogs whose state was handed over.
+        """
+        handed_over = []
+        for name in names:
+            states = {
+                cog.qualified_name: cog.export_state()
+                for cog in self._extension_cogs(name)
+                if hasattr(cog, "export_state")
+            }
+            self.reload_extension(name)
+
+            cogs = self._extension_cogs(name)
+            try:
+                await self._create_tables_aside(cogs)
+            finally:
+                # the new cogs are loaded either way, they must not start cold
+                handed_over += await self._import_states(cogs, states)
+
+        return handed_over
+
+    async def _create_tables_aside(self, cogs):
+        """Create the tables of the cogs on a connection of their own, so that
+        the schema transaction never mixes with the statements and commits of the
+        coroutines sharing `self.db`. WAL lets both connections use the file.
+        """
+        db = await create_db_connection(self.db_name)
+        try:
+            await create_tables(db, cogs)
+        finally:
+            await db.close()
+
+    async def _import_states(self, cogs, states):
+        handed_over = []
+        for cog in cogs:
+            state = states.get(cog.qualified_name)
+            if state is not None and hasattr(cog, "import_state"):
+                try:
+                    cog.import_state(state)
+                    handed_over.append(cog.qualified_name)
+                    continue
+                except Exception:
+                    log.exception("Failed to hand the state of %s over", cog)
+            if hasattr(cog, "warm_cache"):
+                await cog.warm_cache()
+
+        return handed_over
+
+    def _extension_cogs(self, name):
+        return [cog for cog in self.cogs.values() if cog.__module__ == name]
+
     async def close(self):
         """Close the necessary connections before closing the bot."""
 
-        await self.db.close()
+        self.lag_monitor.stop()
+        self.views.stop()
+        if self.member_cache is not None:
+            self.member_cache.stop()
+        if self.db is not None:
+            await self.db.close()
+        if self._db_lock is not None:
+            self._db_lock.close()
         await super().close()
 
+    @contextlib.contextmanager
+    def _startup_phase(self, name):
+        start = time.perf_counter()
+        yield
+        elapsed = self.startup_timings[name] = time.perf_counter() - start
+        log.info("Startup phase %r took %.0fms", name, elapsed * 1000)
+
+    async def on_message(self, message):
+        if self.member_cache is not None and message.guild is not None:
+            self.member_cache.touch(message.author)
+
+        await self.process_commands(message)
+
+    async def on_command_completion(self, ctx):
+        if not self._first_response:
+            self._first_response = True
+            self.startup_timings["first response"] = (
+                time.perf_counter() - self._launched_at
+            )
+            log.info(
+                "First command response %.1fs after launch",
+                self.startup_timings["first response"],
+            )
+
     async def on_ready(self):
+        if self._ready_event is not None:
+            self._ready_event.set()
+
+        if "ready" not in self.startup_timings:
+            self.startup_timings["ready"] = time.perf_counter() - self._launched_at
+            log.info(
+                "Ready %.1fs after launch, caching %d users, max RSS %.0f MiB",
+                self.startup_timings["ready"],
+                len(self.users),
+                max_rss_mib(),
+            )
+
         # permissions needed for bot to function, subject to change
         permissions = discord.Permissions(
             add_reactions=True,
@@ -44,8 +240,9 @@ class MedievalBot(commands.Bot):
         url = discord.utils.oauth_url(self.user.id, permissions=permissions)
         print(
             f"Logged in as {self.user.name} (ID:{self.user.id})\n"
+            f"Running shards {sorted(self.shards)} of {self.shard_count}\n"
             f"Connected to {len(self.guilds)} guilds\n"
-            f"Connected to {len(set(self.get_all_members()))} users\n"
+            f"Connected to {len(self.users)} users\n"
             "--------\n"
             f"Current Discord.py Version: {discord.__version__}\n"
             "--------\n"
@@ -66,10 +263,39 @@ async def create_db_connection(db_name):
     db = await aiosqlite.connect(db_name, detect_types=1)  # 1: parse declared types
     db.row_factory = aiosqlite.Row  # allow for name-based access of data columns
     await db.execute("PRAGMA foreign_keys = ON")  # allow for cascade deletion
+    # WAL lets the launcher's worker processes share the file: readers never block
+    # and writers are serialized by SQLite, waiting up to busy_timeout for the lock
+    await db.execute("PRAGMA journal_mode = WAL")
+    await db.execute("PRAGMA busy_timeout = 5000")
 
     return db
 
 
+async def create_tables(db, cogs):
+    """Create the tables of every cog in a single transaction on `db`, which no
+    other coroutine may use meanwhile. Cogs with tables implement a
+    `create_tables(db)` coroutine which must not commit.
+    """
+    await db.execute("BEGIN")
+    try:
+        for cog in cogs:
+            if hasattr(cog, "create_tables"):
+                await cog.create_tables(db)
+    except BaseException:
+        await db.rollback()
+        raise
+
+    await db.commit()
+
+
+async def warm_caches(cogs):
+    """Fill the caches of every cog that implements a `warm_cache` coroutine."""
+
+    await asyncio.gather(
+        *[cog.warm_cache() for cog in cogs if hasattr(cog, "warm_cache")]
+    )
+
+
 async def _prefix_callable(bot, message):
     meta_cog = bot.get_cog("Meta")
     if meta_cog:
@@ -80,30 +306,50 @@ async def _prefix_callable(bot, message):
 
 
 # see https://youtu.be/g_wlZ9IhbTs
-def main():
+def main(shard_ids=None, shard_count=None, ready_event=None, member_cache="full"):
+    """Run the bot. Without arguments, a single process handles every shard."""
+
+    from private.config import token
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
     intents = discord.Intents.default()
     intents.members = True
     allowed_mentions = discord.AllowedMentions.none()
 
-    bot = MedievalBot(
-        command_prefix=_prefix_callable,
-        intents=intents,
-        allowed_mentions=allowed_mentions,
-        db_name="bot.db",
-    )
-
     cogs = [
         "cogs.meta",
         "cogs.plague",
         "cogs.welcome",
         "cogs.economy",
+        "cogs.payroll",
         "cogs.roleplay",
+        "cogs.stats",
+        "cogs.retention",
     ]
-    for cog in cogs:
-        bot.load_extension(cog)
 
+    bot = MedievalBot(
+        command_prefix=_prefix_callable,
+        intents=intents,
+        allowed_mentions=allowed_mentions,
+        db_name="bot.db",
+        member_cache=member_cache,
+        initial_extensions=cogs,
+        loop_lag_budget=0.1,  # seconds, see the `health` command
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        ready_event=ready_event,
+    )
     bot.run(token)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the bot in a single process.")
+    parser.add_argument(
+        "--member-cache",
+        choices=["full", "active"],
+        default="full",
+        help="cache every member, or only the active members",
+    )
+    main(member_cache=parser.parse_args().member_cache)
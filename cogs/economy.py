@@ -1,21 +1,113 @@
+from collections import defaultdict
+import logging
+import re
+
 import discord
 from discord.ext import commands
 
+from utils import registry
+from utils.money import Money, MoneyConverter
+from utils.statements import FULL_SCAN, TEMP_BTREE, statement
+
+log = logging.getLogger(__name__)
+
+
+_BALANCE_SQL = statement(
+    "economy.balance",
+    """
+    SELECT COALESCE(SUM(amount), 0) AS balance
+      FROM economy_transaction
+     WHERE member_id=:member_id
+       AND guild_id=:guild_id
+    """,
+)
+
+_TOP_BALANCES_SQL = statement(
+    "economy.top_balances",
+    """
+    SELECT member_id, COALESCE(SUM(amount), 0) AS balance
+      FROM economy_transaction
+     WHERE guild_id=:guild_id
+     GROUP BY member_id
+     ORDER BY balance DESC, member_id
+     LIMIT :limit
+    """,
+    allow=[TEMP_BTREE],
+)
+
+_TRANSACTIONS_SQL = statement(
+    "economy.transactions",
+    """
+    SELECT amount, description, time
+      FROM economy_transaction
+     WHERE member_id=:member_id
+       AND guild_id=:guild_id
+     ORDER BY time DESC
+     LIMIT :limit
+    """,
+)
+
+_ADD_TRANSACTION_SQL = statement(
+    "economy.add_transaction",
+    """
+    INSERT INTO economy_transaction
+    VALUES (:amount,
+            :description,
+            :guild_id,
+            :member_id,
+            :time)
+    """,
+)
+
+_ALL_BALANCES_SQL = statement(
+    "economy.all_balances",
+    """
+    SELECT guild_id, member_id, SUM(amount) AS balance
+      FROM economy_transaction
+     GROUP BY guild_id, member_id
+    """,
+    allow=[FULL_SCAN],
+    budget=1.0,
+)
+
 
 class InsufficentFundsError(Exception):
     """Exception raised when trying to do a transaction with insufficient funds."""
 
     def __init__(self, funds, amount):
-        amount = amount if amount >= 0 else -amount
-        message = f"Insufficient funds ({funds:.2f}) for amount {amount:.2f}."
+        message = f"Insufficient funds ({funds}) for amount {abs(amount)}."
         super().__init__(message)
 
 
+def format_transactions(rows):
+    """Format the transaction rows into the amount, description and time columns
+    of the history embed. There are at most 10 rows, like the top balances.
+    """
+    amounts = "\n".join([f"{Money(row['amount'])}" for row in rows])
+    descriptions = "\n".join([row["description"] for row in rows])
+    times = "\n".join([discord.utils.format_dt(row["time"], style="D") for row in rows])
+    return amounts, descriptions, times
+
+
+def format_top_balances(balances):
+    """Format the balance rows into the member and balance columns of the
+    leaderboard embed. Members are mentions, most of them are not cached.
+    There are at most 10 rows, which is cheaper to format on the event loop than
+    to hand over to an executor thread.
+    """
+    members = "\n".join([f"<@{bal['member_id']}>" for bal in balances])
+    totals = "\n".join([f"{Money(bal['balance'])}" for bal in balances])
+    return members, totals
+
+
 class Economy(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-
-        self.bot.loop.run_until_complete(self._create_tables())
+        # balance of the members, in minor units, in the store shared by the cogs
+        self._members = bot.member_store
+        self._members.add_column("balance", "q")
+        # once warmed, a member missing from the cache has no transaction
+        self._cache_complete = False
 
     @commands.group(aliases=["bal", "money"], invoke_without_command=True)
     async def balance(self, ctx: commands.Context, *, member: discord.Member = None):
@@ -26,7 +118,7 @@ class Economy(commands.Cog):
             member = ctx.author
 
         balance = await self._get_balance(member)
-        await ctx.reply(f"The balance for {member.mention} is `{balance:.2f}`")
+        await ctx.reply(f"The balance for {member.mention} is `{balance}`")
 
     @balance.command(name="history")
     async def balance_history(self, ctx, *, member: discord.Member = None):
@@ -37,17 +129,13 @@ class Economy(commands.Cog):
             member = ctx.author
 
         rows = await self._get_transactions(member)
-        amounts = "\n".join([f"{row['amount']:.2f}" for row in rows])
-        descriptions = "\n".join([row["description"] for row in rows])
-        times = "\n".join(
-            [discord.utils.format_dt(row["time"], style="D") for row in rows]
-        )
+        amounts, descriptions, times = format_transactions(rows)
         balance = await self._get_balance(member)
 
         embed = (
             discord.Embed(
                 title="Transaction History",
-                description=f"Total Balance: {balance:.2f}",
+                description=f"Total Balance: {balance}",
                 color=discord.Color.yellow(),
             )
             .add_field(name="Amount", value=amounts or "None", inline=True)
@@ -61,10 +149,7 @@ class Economy(commands.Cog):
         """List members by top balance."""
 
         balances = await self._get_top_balances(ctx.guild)
-        members = "\n".join(
-            [f"{ctx.guild.get_member(bal['member_id'])}" for bal in balances]
-        )
-        totals = "\n".join([f"{bal['balance']:.2f}" for bal in balances])
+        members, totals = format_top_balances(balances)
 
         embed = (
             discord.Embed(
@@ -79,7 +164,11 @@ class Economy(commands.Cog):
 
     @commands.command(aliases=["pay"])
     async def send(
-        self, ctx: commands.Context, amount: float, *, to_member: discord.Member
+        self,
+        ctx: commands.Context,
+        amount: MoneyConverter,
+        *,
+        to_member: discord.Member,
     ):
         """Send an amount of money to the specified member.
         The amount must be above 0.
@@ -92,7 +181,7 @@ class Economy(commands.Cog):
             raise commands.UserInputError("Cannot send amounts below on equal to zero.")
 
         await self.transfer_money(amount, to_member, ctx.author)
-        await ctx.reply(f"You sent `{amount:.2f}` to {to_member.mention}!")
+        await ctx.reply(f"You sent `{amount}` to {to_member.mention}!")
 
     @send.error
     async def send_error(self, ctx, error):
@@ -109,8 +198,16 @@ class Economy(commands.Cog):
         else:
             raise error
 
+    @commands.Cog.listener()
+    async def on_guild_purge(self, guild_id):
+        self._members.drop_guild(guild_id)
+
+    @commands.Cog.listener()
+    async def on_member_purge(self, guild_id, member_id):
+        self._members.unset(guild_id, member_id, "balance")
+
     async def grant_money(
-        self, amount: float, member: discord.Member, description="Income"
+        self, amount: Money, member: discord.Member, description="Income"
     ):
         """Helper method to grant an amount of money to a member's account."""
 
@@ -119,7 +216,7 @@ class Economy(commands.Cog):
         )
 
     async def spend_money(
-        self, amount: float, member: discord.Member, description="Spending"
+        self, amount: Money, member: discord.Member, description="Spending"
     ):
         """Helper method to take an amount of money from a member's account."""
 
@@ -129,7 +226,7 @@ class Economy(commands.Cog):
 
     async def transfer_money(
         self,
-        amount: float,
+        amount: Money,
         to_member: discord.Member,
         from_member: discord.Member,
         description="Money transfer",
@@ -144,42 +241,167 @@ class Economy(commands.Cog):
             amount=-amount, member=from_member, description=description
         )
 
-    async def _create_tables(self):
+    async def create_tables(self, db):
         """Create the necessary DB tables if they do not exist."""
 
-        await self.bot.db.execute(
+        await self._migrate_to_minor_units(db)
+        await db.execute(
             """
             CREATE TABLE IF NOT EXISTS economy_transaction(
-                amount      REAL      NOT NULL,
+                amount      INTEGER   NOT NULL,
                 description TEXT      NOT NULL,
                 guild_id    INTEGER   NOT NULL,
                 member_id   INTEGER   NOT NULL,
-                time        TIMESTAMP NOT NULL
+                time        TIMESTAMP NOT NULL,
+                FOREIGN KEY (guild_id, member_id)
+                    REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE
             )
             """
         )
+        await registry.register_table(db, "economy_transaction", "member")
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS economy_transaction_member
+                ON economy_transaction(guild_id, member_id, time)
+            """
+        )
+        # daily rollup of the money flow, maintained by the trigger below
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS economy_flow_daily(
+                guild_id     INTEGER NOT NULL,
+                day          TEXT    NOT NULL,
+                member_id    INTEGER NOT NULL,
+                income       INTEGER NOT NULL,
+                spending     INTEGER NOT NULL,
+                transactions INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, day, member_id),
+                FOREIGN KEY (guild_id, member_id)
+                    REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+            """
+        )
+        await registry.register_table(
+            db,
+            "economy_flow_daily",
+            "member",
+            key="guild_id, day, member_id",
+            derived=True,
+        )
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS economy_flow_daily_member
+                ON economy_flow_daily(guild_id, member_id, day)
+            """
+        )
+        await db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS economy_flow_daily_insert
+            AFTER INSERT ON economy_transaction
+            BEGIN
+                INSERT INTO economy_flow_daily
+                VALUES (NEW.guild_id,
+                        substr(NEW.time, 1, 10),
+                        NEW.member_id,
+                        max(NEW.amount, 0),
+                        max(-NEW.amount, 0),
+                        1)
+                    ON CONFLICT(guild_id, day, member_id) DO
+                UPDATE
+                   SET income = income + excluded.income,
+                       spending = spending + excluded.spending,
+                       transactions = transactions + 1;
+            END
+            """
+        )
+        # backfill the rollup from the ledger the first time it is created
+        await db.execute(
+            """
+            INSERT INTO economy_flow_daily
+            SELECT guild_id,
+                   substr(time, 1, 10) AS day,
+                   member_id,
+                   SUM(max(amount, 0)),
+                   SUM(max(-amount, 0)),
+                   COUNT(*)
+              FROM economy_transaction
+             WHERE NOT EXISTS (SELECT 1 FROM economy_flow_daily)
+             GROUP BY guild_id, day, member_id
+            """
+        )
 
-        await self.bot.db.commit()
+    async def _migrate_to_minor_units(self, db):
+        """Convert the ledger of a database storing the amounts as REAL units to
+        INTEGER minor units. The ledger is rebuilt, and the daily rollup is dropped
+        to be backfilled from it by `create_tables`. The payroll wages are amounts
+        too, and the payroll triggers are recreated with integer rounding.
+        """
+        async with db.execute(
+            "SELECT type FROM pragma_table_info('economy_transaction') "
+            "WHERE name = 'amount'"
+        ) as c:
+            row = await c.fetchone()
+        if row is None or row["type"] != "REAL":
+            return
+
+        log.info("Converting the economy ledger to minor units")
+        async with db.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'economy_transaction'"
+        ) as c:
+            (sql,) = await c.fetchone()
+        sql = re.sub(r"\bamount(\s+)REAL\b", r"amount\1INTEGER", sql)
+        sql = sql.replace("economy_transaction", "economy_transaction_rebuild", 1)
+
+        await db.execute(sql)
+        await db.execute(
+            """
+            INSERT INTO economy_transaction_rebuild
+            SELECT CAST(round(amount * :scale) AS INTEGER),
+                   description,
+                   guild_id,
+                   member_id,
+                   time
+              FROM economy_transaction
+            """,
+            dict(scale=Money.scale),
+        )
+        await db.execute("DROP TABLE economy_transaction")
+        # the payroll triggers insert into the ledger: a modern rename would fail
+        # on their reference to the table that was just dropped
+        await db.execute("PRAGMA legacy_alter_table = ON")
+        await db.execute(
+            "ALTER TABLE economy_transaction_rebuild RENAME TO economy_transaction"
+        )
+        await db.execute("PRAGMA legacy_alter_table = OFF")
+        await db.execute("DROP TABLE IF EXISTS economy_flow_daily")
+
+        async with db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'economy_payroll'"
+        ) as c:
+            has_payroll = await c.fetchone() is not None
+        if has_payroll:
+            await db.execute(
+                """
+                UPDATE economy_payroll
+                   SET amount = round(amount * :scale)
+                 WHERE kind = 'wage'
+                """,
+                dict(scale=Money.scale),
+            )
+            await db.execute("DROP TRIGGER IF EXISTS economy_payroll_wage")
+            await db.execute("DROP TRIGGER IF EXISTS economy_payroll_balance")
 
     async def _add_transaction(
-        self, *, amount: float, description: str, member: discord.Member,
+        self, *, amount: Money, description: str, member: discord.Member,
     ):
         """Add a transaction to the member's account. `amount` can be negative."""
 
-        if amount <= 0:
-            current_balance = await self._get_balance(member)
-            if current_balance < abs(amount):
-                raise InsufficentFundsError(current_balance, amount)
+        current_balance = await self._get_balance(member)
+        if amount <= 0 and current_balance < abs(amount):
+            raise InsufficentFundsError(current_balance, amount)
 
         last_insert_rowid = await self.bot.db.execute_insert(
-            """
-            INSERT INTO economy_transaction
-            VALUES (:amount,
-                    :description,
-                    :guild_id,
-                    :member_id,
-                    :time)
-            """,
+            _ADD_TRANSACTION_SQL,
             dict(
                 amount=amount,
                 description=description,
@@ -190,16 +412,70 @@ class Economy(commands.Cog):
         )
 
         await self.bot.db.commit()
+        # _get_balance above cached the balance
+        self._members.add(member.guild.id, member.id, "balance", amount)
         return last_insert_rowid
 
+    async def warm_cache(self):
+        """Load the balance of every member of the guilds handled by this process."""
+
+        balances = defaultdict(lambda: ([], []))
+        async with self.bot.db.execute(_ALL_BALANCES_SQL) as c:
+            async for row in c:
+                if self.bot.owns_guild(row["guild_id"]):
+                    member_ids, guild_balances = balances[row["guild_id"]]
+                    member_ids.append(row["member_id"])
+                    guild_balances.append(row["balance"])
+
+        # only the members with transactions are in the warm cache, like in the
+        # top balances of the ledger
+        self._members.clear("balance")
+        for guild_id, (member_ids, guild_balances) in balances.items():
+            self._members.load(guild_id, "balance", member_ids, guild_balances)
+        self._cache_complete = True
+
+    def export_state(self):
+        """Tell the reloaded cog whether the balances kept in the bot's store are
+        complete.
+        """
+        return dict(cache_complete=self._cache_complete)
+
+    def import_state(self, state):
+        self._cache_complete = state["cache_complete"]
+
+    def add_to_balances(self, guild_id, rows):
+        """Add the amounts of ledger rows of the guild written without going
+        through `_add_transaction`, such as the payroll's, to the cached balances.
+        """
+        if not self._cache_complete:
+            # the uncached balances are fetched with these rows when first needed
+            rows = [
+                row
+                for row in rows
+                if self._members.has(guild_id, row["member_id"], "balance")
+            ]
+
+        self._members.add_many(
+            guild_id,
+            [row["member_id"] for row in rows],
+            "balance",
+            [row["amount"] for row in rows],
+        )
+
     async def _get_balance(self, member):
+        guild_id, member_id = member.guild.id, member.id
+        if not self._members.has(guild_id, member_id, "balance"):
+            if self._cache_complete:
+                # kept out of the cache until its first transaction, see top
+                return Money(0)
+            balance = await self._fetch_balance(member)
+            self._members.set(guild_id, member_id, balance=balance)
+
+        return Money(self._members.get(guild_id, member_id, "balance"))
+
+    async def _fetch_balance(self, member):
         async with self.bot.db.execute(
-            """
-            SELECT COALESCE(SUM(amount), 0) AS balance
-              FROM economy_transaction
-             WHERE member_id=:member_id
-               AND guild_id=:guild_id
-            """,
+            _BALANCE_SQL,
             dict(member_id=member.id, guild_id=member.guild.id),
         ) as c:
             row = await c.fetchone()
@@ -207,15 +483,16 @@ class Economy(commands.Cog):
         return row["balance"]
 
     async def _get_top_balances(self, guild, limit=10):
+        if self._cache_complete:
+            # every balance of the guild is cached
+            return [
+                dict(member_id=member_id, balance=balance)
+                for member_id, balance in self._members.top(guild.id, "balance", limit)
+            ]
+
         async with self.bot.db.execute(
-            """
-            SELECT member_id, COALESCE(SUM(amount), 0) AS balance
-              FROM economy_transaction
-             WHERE guild_id=:guild_id
-             GROUP BY member_id
-             ORDER BY balance DESC
-            """,
-            dict(guild_id=guild.id),
+            _TOP_BALANCES_SQL,
+            dict(guild_id=guild.id, limit=limit),
         ) as c:
             rows = await c.fetchall()
 
@@ -223,14 +500,7 @@ class Economy(commands.Cog):
 
     async def _get_transactions(self, member, limit=10):
         async with self.bot.db.execute(
-            """
-            SELECT amount, description, time
-              FROM economy_transaction
-             WHERE member_id=:member_id
-               AND guild_id=:guild_id
-             ORDER BY time DESC
-             LIMIT :limit
-            """,
+            _TRANSACTIONS_SQL,
             dict(member_id=member.id, guild_id=member.guild.id, limit=limit),
         ) as c:
             rows = await c.fetchall()
@@ -1,6 +1,56 @@
+from collections import defaultdict
+import io
+import tempfile
+import time
+
 import discord
 from discord.ext import commands  # Again, we need this imported
 
+from utils import registry
+from utils.backup import export_guilds
+from utils.loop import run_blocking
+from utils.members import max_rss_mib
+from utils.profiler import profile_table, run_profile
+from utils.statements import FULL_SCAN, statement
+
+
+_GUILD_PREFIXES_SQL = statement(
+    "meta.guild_prefixes",
+    """
+    SELECT prefix
+      FROM meta_prefix
+     WHERE guild_id=:guild_id
+    """,
+)
+
+_ADD_PREFIX_SQL = statement(
+    "meta.add_prefix",
+    """
+    INSERT INTO meta_prefix
+    VALUES (:guild_id,
+            :prefix)
+    """,
+)
+
+_REMOVE_PREFIX_SQL = statement(
+    "meta.remove_prefix",
+    """
+    DELETE FROM meta_prefix
+     WHERE guild_id=:guild_id
+       AND prefix=:prefix
+    """,
+)
+
+_ALL_PREFIXES_SQL = statement(
+    "meta.all_prefixes",
+    """
+    SELECT guild_id, prefix
+      FROM meta_prefix
+    """,
+    allow=[FULL_SCAN],
+    budget=1.0,
+)
+
 
 class Prefix(commands.Converter):
     async def convert(self, ctx, argument):
@@ -15,8 +65,10 @@ class Meta(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-
-        self.bot.loop.run_until_complete(self._create_tables())
+        # guild ID -> prefixes, the prefixes are needed for every message
+        self._prefixes = {}
+        # once warmed, a guild missing from the cache has no custom prefix
+        self._cache_complete = False
 
     @commands.command(name="ping")
     async def ping(self, ctx: commands.Context):
@@ -25,6 +77,169 @@ class Meta(commands.Cog):
             f"Pong! {round(self.bot.latency * 1000)}ms"
         )  # It's now self.bot.latency
 
+    @commands.command(name="health")
+    @commands.is_owner()
+    async def health(self, ctx: commands.Context):
+        """Report the event loop lag against its budget and the cache sizes.
+
+        Only the bot owner can use this command.
+        """
+        lag = self.bot.lag_monitor.stats()
+        budget = self.bot.lag_monitor.budget
+
+        embed = (
+            discord.Embed(title="Health", colour=discord.Color.blurple())
+            .add_field(name="Websocket", value=f"{self.bot.latency * 1000:.0f}ms")
+            .add_field(
+                name="Loop lag",
+                value=(
+                    f"current {lag['current'] * 1000:.0f}ms\n"
+                    f"p99 {lag['p99'] * 1000:.0f}ms\n"
+                    f"max {lag['max'] * 1000:.0f}ms"
+                ),
+            )
+            .add_field(
+                name="Budget",
+                value=f"{budget * 1000:.0f}ms, exceeded {lag['over_budget']} times",
+            )
+            .add_field(name="Cached profiles", value=len(self.bot.profiles))
+            .add_field(name="Members", value=self._format_member_cache())
+            .add_field(
+                name="Live views",
+                value="{live} ({persisted} persisted), {guilds} guilds, "
+                "{users} users".format(**self.bot.views.stats()),
+            )
+            .add_field(
+                name="Startup",
+                value="\n".join(
+                    f"{phase}: {duration * 1000:.0f}ms"
+                    for phase, duration in self.bot.startup_timings.items()
+                )
+                or "None",
+                inline=False,
+            )
+        )
+        await ctx.send(embed=embed)
+
+    def _format_member_cache(self):
+        if self.bot.member_cache is None:
+            members = "every member cached"
+        else:
+            members = "{cached} of {total} cached, {active} active".format(
+                **self.bot.member_cache.stats()
+            )
+        return f"{members}\nmax RSS {max_rss_mib():.0f} MiB"
+
+    @commands.command(name="profile")
+    @commands.is_owner()
+    @commands.max_concurrency(1)
+    async def profile(
+        self, ctx: commands.Context, seconds: float = 10.0, threshold_ms: float = 100.0
+    ):
+        """Sample the bot process for a few seconds (10 by default), then report
+        the hottest functions and the event loop steps slower than the threshold
+        (100ms by default). The stacks are attached in the collapsed format of
+        flamegraph.pl, which speedscope also opens.
+
+        Only the bot owner can use this command.
+        """
+        if not 0 < seconds <= 120:
+            raise commands.BadArgument("The profile must last between 0 and 120s.")
+
+        async with ctx.typing():
+            profiler, steps = await run_profile(seconds, threshold_ms / 1000)
+
+        report = profile_table(profiler)
+        if steps:
+            report += f"\n\n{len(steps)} steps over {threshold_ms:g}ms:\n"
+            report += "\n".join(steps)
+        files = [
+            discord.File(io.BytesIO(profiler.collapsed().encode()), "profile.folded")
+        ]
+        if len(report) > 1900:
+            files.append(discord.File(io.BytesIO(report.encode()), "profile.txt"))
+            report = report[: report.rfind("\n", 0, 1900)]
+
+        await ctx.reply(f"```\n{report}\n```", files=files)
+
+    @profile.error
+    async def profile_error(self, ctx, error):
+        """Error handler for the profile command."""
+
+        if isinstance(error, (commands.BadArgument, commands.MaxConcurrencyReached)):
+            await ctx.reply(error)
+        else:
+            raise error
+
+    @commands.command(name="reload")
+    @commands.is_owner()
+    async def reload(self, ctx: commands.Context, *extensions: str):
+        """Reload the extensions, e.g. `roleplay` or `cogs.roleplay`, or every
+        extension if none is given, to deploy a code change without a restart.
+        The caches of the cogs are handed over to the new ones.
+
+        Only the bot owner can use this command, and only the process handling
+        this server is reloaded.
+        """
+        loaded = list(self.bot.extensions)
+        names = [
+            name if name in loaded else f"cogs.{name}" for name in extensions
+        ] or loaded
+        unknown = [name for name in names if name not in loaded]
+        if unknown:
+            raise commands.BadArgument(f"Not loaded: {', '.join(unknown)}.")
+
+        start = time.perf_counter()
+        handed_over = await self.bot.reload_extensions(names)
+        await ctx.reply(
+            f"Reloaded {', '.join(names)} in "
+            f"{(time.perf_counter() - start) * 1000:.0f}ms, handed the state of "
+            f"{', '.join(handed_over) or 'no cog'} over."
+        )
+
+    @reload.error
+    async def reload_error(self, ctx, error):
+        """Error handler for the reload command."""
+
+        error = getattr(error, "original", error)
+        if isinstance(error, (commands.BadArgument, commands.ExtensionError)):
+            await ctx.reply(error)
+        else:
+            raise error
+
+    @commands.command(name="export")
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def export(self, ctx: commands.Context):
+        """Export the economy and experience data of the server.
+        The data is sent as compressed NDJSON files, one per table.
+
+        You must have Administrator permissions to use this command.
+        """
+        async with ctx.typing():
+            with tempfile.TemporaryDirectory() as directory:
+                counts = await run_blocking(
+                    export_guilds, self.bot.db_name, directory, [ctx.guild.id]
+                )
+                too_large = [
+                    path.name
+                    for path in counts
+                    if path.stat().st_size > ctx.guild.filesize_limit
+                ]
+                if too_large:
+                    return await ctx.reply(
+                        "The export is too large to be uploaded: "
+                        f"{', '.join(too_large)}."
+                    )
+
+                summary = "\n".join(
+                    f"{path.name}: {count} rows" for path, count in counts.items()
+                )
+                await ctx.reply(
+                    f"```\n{summary}\n```",
+                    files=[discord.File(path) for path in counts],
+                )
+
     @commands.group(invoke_without_command=True)
     async def prefix(self, ctx):
         """Return the bot's prefixes."""
@@ -90,43 +305,75 @@ class Meta(commands.Cog):
         else:
             await ctx.message.add_reaction("\N{CROSS MARK}")
 
+    @commands.Cog.listener()
+    async def on_guild_purge(self, guild_id):
+        self._prefixes.pop(guild_id, None)
+
     async def get_guild_prefixes(self, guild):
+        if guild.id not in self._prefixes:
+            if self._cache_complete:
+                return []
+            await self._cache_guild_prefixes(guild)
+
+        return list(self._prefixes[guild.id])
+
+    async def warm_cache(self):
+        """Load the prefixes of every guild handled by this process."""
+
+        prefixes = defaultdict(list)
+        async with self.bot.db.execute(_ALL_PREFIXES_SQL) as c:
+            async for row in c:
+                if self.bot.owns_guild(row["guild_id"]):
+                    prefixes[row["guild_id"]].append(row["prefix"])
+
+        self._prefixes.update(prefixes)
+        self._cache_complete = True
+
+    def export_state(self):
+        """Hand the cached prefixes over to the reloaded cog."""
+
+        return dict(prefixes=self._prefixes, cache_complete=self._cache_complete)
+
+    def import_state(self, state):
+        self._prefixes = state["prefixes"]
+        self._cache_complete = state["cache_complete"]
+
+    async def _cache_guild_prefixes(self, guild):
         prefixes = await self._get_guild_prefixes(guild)
-        return [p["prefix"] for p in prefixes]
+        self._prefixes[guild.id] = [p["prefix"] for p in prefixes]
 
-    async def _create_tables(self):
+    async def create_tables(self, db):
         """Create the necessary DB tables if they do not exist."""
 
-        await self.bot.db.execute(
+        await db.execute(
             """
             CREATE TABLE IF NOT EXISTS meta_prefix(
                 guild_id INTEGER NOT NULL,
-                prefix   TEXT    NOT NULL
+                prefix   TEXT    NOT NULL,
+                FOREIGN KEY (guild_id)
+                    REFERENCES registry_guild(guild_id) ON DELETE CASCADE
             )
             """
         )
-
-        await self.bot.db.commit()
+        await registry.register_table(db, "meta_prefix", "guild")
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS meta_prefix_guild ON meta_prefix(guild_id)
+            """
+        )
 
     async def _add_prefix(self, guild, prefix):
         await self.bot.db.execute(
-            """
-            INSERT INTO meta_prefix
-            VALUES (:guild_id,
-                    :prefix)
-            """,
+            _ADD_PREFIX_SQL,
             dict(guild_id=guild.id, prefix=prefix),
         )
 
         await self.bot.db.commit()
+        await self._cache_guild_prefixes(guild)
 
     async def _get_guild_prefixes(self, guild):
         async with self.bot.db.execute(
-            """
-            SELECT prefix
-              FROM meta_prefix
-             WHERE guild_id=:guild_id
-            """,
+            _GUILD_PREFIXES_SQL,
             dict(guild_id=guild.id),
         ) as c:
             rows = await c.fetchall()
@@ -135,15 +382,12 @@ class Meta(commands.Cog):
 
     async def _remove_prefix(self, guild, prefix):
         await self.bot.db.execute(
-            """
-            DELETE FROM meta_prefix
-             WHERE guild_id=:guild_id
-               AND prefix=:prefix
-            """,
+            _REMOVE_PREFIX_SQL,
             dict(guild_id=guild.id, prefix=prefix),
         )
 
         await self.bot.db.commit()
+        await self._cache_guild_prefixes(guild)
 
 
 def setup(bot: commands.Bot):
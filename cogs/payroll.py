@@ -0,0 +1,477 @@
+from collections import defaultdict
+from datetime import timedelta
+import json
+import logging
+
+import discord
+from discord.ext import commands, tasks
+
+from utils import registry
+from utils.money import Money, MoneyConverter
+from utils.statements import statement
+
+log = logging.getLogger(__name__)
+
+
+_DUE_SQL = statement(
+    "payroll.due",
+    """
+    SELECT *
+      FROM economy_payroll
+     WHERE next_run <= :now
+     ORDER BY next_run
+    """,
+)
+
+_GUILD_PAYROLLS_SQL = statement(
+    "payroll.guild_payrolls",
+    """
+    SELECT *
+      FROM economy_payroll
+     WHERE guild_id=:guild_id
+     ORDER BY payroll_id
+    """,
+)
+
+_REMOVE_SQL = statement(
+    "payroll.remove",
+    """
+    DELETE FROM economy_payroll
+     WHERE payroll_id=:payroll_id
+       AND guild_id=:guild_id
+    """,
+)
+
+_SET_NEXT_RUN_SQL = statement(
+    "payroll.set_next_run",
+    """
+    UPDATE economy_payroll
+       SET next_run=:next_run
+     WHERE payroll_id=:payroll_id
+    """,
+)
+
+# the ledger rows of a run have rowids above the largest one before the run, and
+# its triggers record the largest one after it
+_RUN_SQL = statement(
+    "payroll.run",
+    """
+    INSERT OR IGNORE INTO economy_payroll_run
+    VALUES (:payroll_id,
+            :run_at,
+            :members,
+            (SELECT COALESCE(MAX(rowid), 0) FROM economy_transaction),
+            NULL)
+    """,
+)
+
+_RUN_LEDGER_SQL = statement(
+    "payroll.run_ledger",
+    """
+    SELECT t.member_id, t.amount
+      FROM economy_payroll_run AS r
+      JOIN economy_transaction AS t
+        ON t.rowid > r.ledger_from
+       AND t.rowid <= r.ledger_to
+     WHERE r.payroll_id=:payroll_id
+       AND r.run_at=:run_at
+    """,
+)
+
+_PRUNE_RUNS_SQL = statement(
+    "payroll.prune_runs",
+    """
+    DELETE FROM economy_payroll_run
+     WHERE payroll_id=:payroll_id
+       AND run_at < :next_run
+    """,
+)
+
+_ADD_SQL = statement(
+    "payroll.add",
+    """
+    INSERT INTO economy_payroll
+    VALUES (NULL,
+            :guild_id,
+            :kind,
+            :description,
+            :role_id,
+            :amount,
+            :interval_hours,
+            :next_run)
+    """,
+)
+
+
+class Payroll(commands.Cog):
+    """Recurring economic events of a guild: wages per role, interest on balances
+    and taxes.
+    Each run of a payroll is a single INSERT into `economy_payroll_run`, whose
+    triggers write the ledger rows of the whole guild with INSERT ... SELECT in the
+    same statement. The run log is keyed by the scheduled time, so a run that was
+    interrupted, or already done before a crash, is safely retried. The runs are
+    pruned once the next run time of their payroll is saved past them.
+    """
+
+    # missed runs older than this many periods are skipped, not paid at once
+    max_catch_up = 7
+    # payrolls run at most once an hour and at least once a year
+    min_interval_hours = 1
+    max_interval_hours = 24 * 365
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.scheduler.start()
+
+    def cog_unload(self):
+        self.scheduler.cancel()
+
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def payroll(self, ctx):
+        """Parent command for the recurring wages, interests and taxes.
+        Invoke without subcommand to list the payrolls of the server.
+
+        You must have the Administrator permission to use this command.
+        """
+        rows = await self._get_payrolls(ctx.guild)
+        if not rows:
+            return await ctx.reply(
+                "There is no payroll yet. Look at "
+                f"`{ctx.prefix}help payroll` for the available ones."
+            )
+
+        lines = [
+            f"`#{row['payroll_id']}` {row['description']}: {self._format_amount(row)} "
+            f"every {row['interval_hours']:g}h, next "
+            f"{discord.utils.format_dt(row['next_run'], style='R')}"
+            for row in rows
+        ]
+        embed = discord.Embed(
+            title="Payrolls", description="\n".join(lines), color=discord.Color.yellow()
+        )
+        await ctx.reply(embed=embed)
+
+    @payroll.command(name="wage")
+    @commands.has_permissions(administrator=True)
+    async def payroll_wage(
+        self, ctx, role: discord.Role, amount: MoneyConverter, hours: float = 24.0
+    ):
+        """Pay an amount to every member with the role, every few hours (24 by
+        default).
+        """
+        if amount <= 0:
+            raise commands.BadArgument("The wage must be above 0.")
+
+        await self._add_payroll(
+            ctx, "wage", f"Wages ({role.name})", amount, hours, role_id=role.id
+        )
+
+    @payroll.command(name="interest")
+    @commands.has_permissions(administrator=True)
+    async def payroll_interest(self, ctx, percent: float, hours: float = 24.0):
+        """Pay an interest, in percent of their balance, to every member with a
+        positive balance, every few hours (24 by default).
+        """
+        if not 0 < percent <= 100:
+            raise commands.BadArgument("The interest must be between 0 and 100%.")
+
+        await self._add_payroll(ctx, "interest", "Interest", percent / 100, hours)
+
+    @payroll.command(name="tax")
+    @commands.has_permissions(administrator=True)
+    async def payroll_tax(self, ctx, percent: float, hours: float = 24.0):
+        """Collect a tax, in percent of their balance, from every member with a
+        positive balance, every few hours (24 by default).
+        """
+        if not 0 < percent <= 100:
+            raise commands.BadArgument("The tax must be between 0 and 100%.")
+
+        await self._add_payroll(ctx, "tax", "Tax", -percent / 100, hours)
+
+    @payroll.command(name="remove")
+    @commands.has_permissions(administrator=True)
+    async def payroll_remove(self, ctx, payroll_id: int):
+        """Remove a payroll by its number, as listed by the payroll command."""
+
+        async with self.bot.db.execute(
+            _REMOVE_SQL,
+            dict(payroll_id=payroll_id, guild_id=ctx.guild.id),
+        ) as c:
+            removed = c.rowcount
+        await self.bot.db.commit()
+
+        if removed:
+            await ctx.reply(f"Removed the payroll `#{payroll_id}`.")
+        else:
+            await ctx.reply(f"There is no payroll `#{payroll_id}` in this server.")
+
+    @payroll_wage.error
+    @payroll_interest.error
+    @payroll_tax.error
+    @payroll_remove.error
+    async def payroll_error(self, ctx, error):
+        """Error handler for the payroll commands."""
+
+        if isinstance(error, (commands.BadArgument, commands.UserInputError)):
+            await ctx.reply(error)
+
+        else:
+            raise error
+
+    @tasks.loop(minutes=1)
+    async def scheduler(self):
+        await self.run_due(discord.utils.utcnow())
+
+    @scheduler.before_loop
+    async def before_scheduler(self):
+        await self.bot.wait_until_ready()
+
+    @scheduler.error
+    async def scheduler_error(self, error):
+        log.exception("Payroll scheduler failed", exc_info=error)
+
+    async def run_due(self, now):
+        """Run every payroll due at `now`, oldest scheduled run first."""
+        async with self.bot.db.execute(_DUE_SQL, dict(now=now)) as c:
+            rows = await c.fetchall()
+
+        by_guild = defaultdict(list)
+        for row in rows:
+            if self.bot.owns_guild(row["guild_id"]):
+                by_guild[row["guild_id"]].append(row)
+
+        for guild_id, payrolls in by_guild.items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:  # unavailable, or left and waiting for the purge
+                continue
+
+            for payroll in payrolls:
+                await self._run_until(payroll, guild, now)
+
+    async def _run_until(self, payroll, guild, now):
+        interval = timedelta(hours=payroll["interval_hours"])
+        run_at = payroll["next_run"]
+        if now - run_at > interval * self.max_catch_up:
+            missed = (now - run_at) // interval
+            run_at += interval * (missed - self.max_catch_up + 1)
+            log.info("Skipping %d runs of payroll %d", missed, payroll["payroll_id"])
+
+        while run_at <= now:
+            await self._run(payroll, guild, run_at)
+            run_at += interval
+
+        params = dict(next_run=run_at, payroll_id=payroll["payroll_id"])
+        await self.bot.db.execute(_SET_NEXT_RUN_SQL, params)
+        # the runs before the next one are never retried anymore
+        await self.bot.db.execute(_PRUNE_RUNS_SQL, params)
+        await self.bot.db.commit()
+
+    async def _run(self, payroll, guild, run_at):
+        """Run the payroll once, for the run scheduled at `run_at`, and add the
+        ledger rows it wrote to the cached balances.
+        """
+
+        members = None
+        if payroll["kind"] == "wage":
+            role = guild.get_role(payroll["role_id"])
+            member_ids = []
+            if role is not None:
+                # the member cache may only hold the active members
+                member_ids = [
+                    m.id
+                    for m in await self.bot.get_guild_members(guild)
+                    if not m.bot and role in m.roles
+                ]
+            members = json.dumps(member_ids)
+
+        # a single statement: its triggers write every ledger row, or none
+        params = dict(payroll_id=payroll["payroll_id"], run_at=run_at, members=members)
+        async with self.bot.db.execute(_RUN_SQL, params) as c:
+            done = c.rowcount == 1  # 0 when the run was already done
+        await self.bot.db.commit()
+
+        economy = self.bot.get_cog("Economy")
+        if done and economy is not None:
+            async with self.bot.db.execute(_RUN_LEDGER_SQL, params) as c:
+                rows = await c.fetchall()
+            economy.add_to_balances(guild.id, rows)
+
+    async def create_tables(self, db):
+        """Create the necessary DB tables if they do not exist."""
+
+        # `amount` is the wage in minor units, or the rate of the balance paid as
+        # interest, negative for a tax
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS economy_payroll(
+                payroll_id     INTEGER   PRIMARY KEY,
+                guild_id       INTEGER   NOT NULL,
+                kind           TEXT      NOT NULL,
+                description    TEXT      NOT NULL,
+                role_id        INTEGER,
+                amount         REAL      NOT NULL,
+                interval_hours REAL      NOT NULL,
+                next_run       TIMESTAMP NOT NULL,
+                FOREIGN KEY (guild_id)
+                    REFERENCES registry_guild(guild_id) ON DELETE CASCADE
+            )
+            """
+        )
+        await registry.register_table(db, "economy_payroll", "guild")
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS economy_payroll_next_run
+                ON economy_payroll(next_run)
+            """
+        )
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS economy_payroll_guild
+                ON economy_payroll(guild_id)
+            """
+        )
+        # `members` holds the JSON array of the member IDs to pay a wage to, it
+        # is cleared once the run is done; the ledger rows of the run are those
+        # with a rowid above `ledger_from`, up to `ledger_to`
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS economy_payroll_run(
+                payroll_id  INTEGER   NOT NULL,
+                run_at      TIMESTAMP NOT NULL,
+                members     TEXT,
+                ledger_from INTEGER,
+                ledger_to   INTEGER,
+                PRIMARY KEY (payroll_id, run_at),
+                FOREIGN KEY (payroll_id)
+                    REFERENCES economy_payroll(payroll_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+            """
+        )
+        async with db.execute(
+            "SELECT 1 FROM pragma_table_info('economy_payroll_run') "
+            "WHERE name = 'ledger_from'"
+        ) as c:
+            has_ledger_range = await c.fetchone() is not None
+        if not has_ledger_range:
+            await db.execute(
+                "ALTER TABLE economy_payroll_run ADD COLUMN ledger_from INTEGER"
+            )
+            await db.execute(
+                "ALTER TABLE economy_payroll_run ADD COLUMN ledger_to INTEGER"
+            )
+
+        # the triggers are recreated, so that their bodies follow the code
+        await db.execute("DROP TRIGGER IF EXISTS economy_payroll_wage")
+        await db.execute("DROP TRIGGER IF EXISTS economy_payroll_balance")
+        await db.execute(
+            """
+            CREATE TRIGGER economy_payroll_wage
+            AFTER INSERT ON economy_payroll_run
+            WHEN NEW.members IS NOT NULL
+            BEGIN
+                INSERT INTO economy_transaction
+                SELECT CAST(p.amount AS INTEGER),
+                       p.description,
+                       p.guild_id,
+                       m.value,
+                       NEW.run_at
+                  FROM economy_payroll AS p, json_each(NEW.members) AS m
+                 WHERE p.payroll_id = NEW.payroll_id;
+
+                UPDATE economy_payroll_run
+                   SET members = NULL,
+                       ledger_to = (SELECT COALESCE(MAX(rowid), 0)
+                                      FROM economy_transaction)
+                 WHERE payroll_id = NEW.payroll_id
+                   AND run_at = NEW.run_at;
+            END
+            """
+        )
+        # interest and tax, as a rate of the positive balance of the current
+        # members; the balances come from the daily rollup, which has far fewer rows
+        await db.execute(
+            """
+            CREATE TRIGGER economy_payroll_balance
+            AFTER INSERT ON economy_payroll_run
+            WHEN NEW.members IS NULL
+            BEGIN
+                INSERT INTO economy_transaction
+                SELECT CAST(round(b.balance * p.amount) AS INTEGER),
+                       p.description,
+                       p.guild_id,
+                       b.member_id,
+                       NEW.run_at
+                  FROM economy_payroll AS p
+                  JOIN (SELECT guild_id,
+                               member_id,
+                               SUM(income) - SUM(spending) AS balance
+                          FROM economy_flow_daily
+                         WHERE guild_id = (SELECT guild_id
+                                             FROM economy_payroll
+                                            WHERE payroll_id = NEW.payroll_id)
+                         GROUP BY member_id) AS b
+                    ON b.guild_id = p.guild_id
+                  JOIN registry_member AS r
+                    ON r.guild_id = b.guild_id
+                   AND r.member_id = b.member_id
+                 WHERE p.payroll_id = NEW.payroll_id
+                   AND r.left_at IS NULL
+                   AND b.balance > 0
+                   AND round(b.balance * p.amount) != 0;
+
+                UPDATE economy_payroll_run
+                   SET ledger_to = (SELECT COALESCE(MAX(rowid), 0)
+                                      FROM economy_transaction)
+                 WHERE payroll_id = NEW.payroll_id
+                   AND run_at = NEW.run_at;
+            END
+            """
+        )
+
+    async def _add_payroll(self, ctx, kind, description, amount, hours, role_id=None):
+        # also false for NaN
+        if not self.min_interval_hours <= hours <= self.max_interval_hours:
+            raise commands.BadArgument(
+                "Payrolls must run between once an hour and once a year."
+            )
+
+        next_run = discord.utils.utcnow() + timedelta(hours=hours)
+        payroll_id = await self.bot.db.execute_insert(
+            _ADD_SQL,
+            dict(
+                guild_id=ctx.guild.id,
+                kind=kind,
+                description=description,
+                role_id=role_id,
+                amount=amount,
+                interval_hours=hours,
+                next_run=next_run,
+            ),
+        )
+        await self.bot.db.commit()
+
+        await ctx.reply(
+            f"Added the payroll `#{payroll_id[0]}`, first run "
+            f"{discord.utils.format_dt(next_run, style='R')}."
+        )
+
+    async def _get_payrolls(self, guild):
+        async with self.bot.db.execute(
+            _GUILD_PAYROLLS_SQL,
+            dict(guild_id=guild.id),
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    @staticmethod
+    def _format_amount(row):
+        if row["kind"] == "wage":
+            return f"{Money(row['amount'])}"
+        return f"{abs(row['amount']) * 100:g}% of the balance"
+
+
+def setup(bot):
+    bot.add_cog(Payroll(bot))
@@ -0,0 +1,255 @@
+import asyncio
+from datetime import timedelta
+import logging
+
+import discord
+from discord.ext import commands, tasks
+
+from utils import registry
+from utils.statements import statement
+
+log = logging.getLogger(__name__)
+
+
+_EXPIRED_GUILDS_SQL = statement(
+    "retention.expired_guilds",
+    """
+    SELECT guild_id
+      FROM registry_guild
+     WHERE left_at IS NOT NULL
+       AND left_at <= :left_before
+    """,
+)
+
+_EXPIRED_MEMBERS_SQL = statement(
+    "retention.expired_members",
+    """
+    SELECT guild_id, member_id
+      FROM registry_member
+     WHERE left_at IS NOT NULL
+       AND left_at <= :left_before
+    """,
+)
+
+_PURGE_MEMBER_SQL = statement(
+    "retention.purge_member",
+    """
+    DELETE FROM registry_member
+     WHERE guild_id = :guild_id
+       AND member_id = :member_id
+    """,
+)
+
+_SET_GUILD_LEFT_AT_SQL = statement(
+    "retention.set_guild_left_at",
+    """
+    UPDATE registry_guild
+       SET left_at = :left_at
+     WHERE guild_id = :guild_id
+    """,
+)
+
+_SET_MEMBER_LEFT_AT_SQL = statement(
+    "retention.set_member_left_at",
+    """
+    UPDATE registry_member
+       SET left_at = :left_at
+     WHERE guild_id = :guild_id
+       AND member_id = :member_id
+    """,
+)
+
+_PURGE_GUILD_SQL = statement(
+    "retention.purge_guild",
+    """
+    DELETE FROM registry_guild WHERE guild_id = :guild_id
+    """,
+)
+
+
+def batch_delete_sql(table, scope):
+    """Return the statement deleting a batch of the rows of a guild, or of a
+    member, from a registered table, registered as "retention.delete.<table>.<scope>".
+    """
+    _, key = registry.TABLES[table]
+    columns = ("guild_id", "member_id") if scope == "member" else ("guild_id",)
+    conditions = " AND ".join(f"{column} = :{column}" for column in columns)
+    return statement(
+        f"retention.delete.{table}.{scope}",
+        f"""
+    DELETE FROM {table}
+     WHERE ({key}) IN (SELECT {key}
+                         FROM {table}
+                        WHERE {conditions}
+                        LIMIT :batch_size)
+    """,
+    )
+
+
+def register_batch_deletes():
+    """Register the batch deletes of every registered table. They depend on the
+    tables of the loaded cogs, so they are only registered once these exist.
+    """
+    for table, (scope, _) in registry.TABLES.items():
+        batch_delete_sql(table, "guild")
+        if scope == "member":
+            batch_delete_sql(table, "member")
+
+
+class Retention(commands.Cog):
+    """Purge the data of the guilds the bot left and of the members who left, once
+    a grace period has passed.
+    Rows are deleted in small batches, each in its own transaction, so that other
+    writers are never blocked for long.
+    """
+
+    guild_grace = timedelta(days=7)
+    member_grace = timedelta(days=30)
+    batch_size = 500
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.purge.start()
+
+    def cog_unload(self):
+        self.purge.cancel()
+
+    async def create_tables(self, db):
+        """Create the necessary DB tables if they do not exist."""
+
+        await registry.create_tables(db)
+
+    @commands.Cog.listener("on_guild_join")
+    async def mark_guild_joined(self, guild: discord.Guild):
+        await self._set_guild_left_at(guild.id, None)
+
+    @commands.Cog.listener("on_guild_remove")
+    async def mark_guild_left(self, guild: discord.Guild):
+        await self._set_guild_left_at(guild.id, discord.utils.utcnow())
+
+    @commands.Cog.listener("on_member_join")
+    async def mark_member_joined(self, member: discord.Member):
+        await self._set_member_left_at(member.guild.id, member.id, None)
+
+    @commands.Cog.listener("on_raw_member_remove")
+    async def mark_member_left(self, payload):
+        # the raw event, as the member cache may only hold the active members
+        await self._set_member_left_at(
+            payload.guild_id, payload.user.id, discord.utils.utcnow()
+        )
+
+    @tasks.loop(minutes=10)
+    async def purge(self):
+        """Purge the guilds and members whose grace period is over."""
+
+        now = discord.utils.utcnow()
+        for guild_id in await self._get_expired_guilds(now - self.guild_grace):
+            if self.bot.owns_guild(guild_id):
+                await self.purge_guild(guild_id)
+
+        for guild_id, member_id in await self._get_expired_members(
+            now - self.member_grace
+        ):
+            if self.bot.owns_guild(guild_id):
+                await self.purge_member(guild_id, member_id)
+
+    @purge.before_loop
+    async def before_purge(self):
+        await self.bot.wait_until_ready()
+
+    @purge.error
+    async def purge_error(self, error):
+        log.exception("Retention purge failed", exc_info=error)
+
+    async def purge_guild(self, guild_id):
+        """Delete every row of the guild, then its registry entry."""
+
+        deleted = 0
+        for table in registry.TABLES:
+            deleted += await self._delete_in_batches(table, dict(guild_id=guild_id))
+
+        # cascades to the registered members and any row written meanwhile
+        await self.bot.db.execute(
+            _PURGE_GUILD_SQL,
+            dict(guild_id=guild_id),
+        )
+        await self.bot.db.commit()
+
+        log.info("Purged %d rows of guild %d", deleted, guild_id)
+        self.bot.dispatch("guild_purge", guild_id)
+
+    async def purge_member(self, guild_id, member_id):
+        """Delete every row of the member, then its registry entry."""
+
+        deleted = 0
+        for table, (scope, _) in registry.TABLES.items():
+            if scope == "member":
+                deleted += await self._delete_in_batches(
+                    table, dict(guild_id=guild_id, member_id=member_id)
+                )
+
+        await self.bot.db.execute(
+            _PURGE_MEMBER_SQL,
+            dict(guild_id=guild_id, member_id=member_id),
+        )
+        await self.bot.db.commit()
+
+        log.info(
+            "Purged %d rows of member %d in guild %d", deleted, member_id, guild_id
+        )
+        self.bot.dispatch("member_purge", guild_id, member_id)
+
+    async def _delete_in_batches(self, table, where):
+        sql = batch_delete_sql(table, "member" if "member_id" in where else "guild")
+
+        deleted = 0
+        while True:
+            async with self.bot.db.execute(
+                sql,
+                dict(where, batch_size=self.batch_size),
+            ) as c:
+                count = c.rowcount
+            await self.bot.db.commit()
+
+            deleted += count
+            if count < self.batch_size:
+                return deleted
+
+            # let the other events, and their writes, go first
+            await asyncio.sleep(0)
+
+    async def _set_guild_left_at(self, guild_id, left_at):
+        await self.bot.db.execute(
+            _SET_GUILD_LEFT_AT_SQL,
+            dict(guild_id=guild_id, left_at=left_at),
+        )
+        await self.bot.db.commit()
+
+    async def _set_member_left_at(self, guild_id, member_id, left_at):
+        await self.bot.db.execute(
+            _SET_MEMBER_LEFT_AT_SQL,
+            dict(guild_id=guild_id, member_id=member_id, left_at=left_at),
+        )
+        await self.bot.db.commit()
+
+    async def _get_expired_guilds(self, left_before):
+        async with self.bot.db.execute(
+            _EXPIRED_GUILDS_SQL,
+            dict(left_before=left_before),
+        ) as c:
+            rows = await c.fetchall()
+
+        return [row["guild_id"] for row in rows]
+
+    async def _get_expired_members(self, left_before):
+        async with self.bot.db.execute(
+            _EXPIRED_MEMBERS_SQL,
+            dict(left_before=left_before),
+        ) as c:
+            rows = await c.fetchall()
+
+        return [(row["guild_id"], row["member_id"]) for row in rows]
+
+
+def setup(bot):
+    bot.add_cog(Retention(bot))
@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 import io
@@ -10,9 +11,135 @@ from discord.ext import commands
 import matplotlib.pyplot as plt
 import numpy as np
 
-from utils.views import Confirm
+from utils import registry
+from utils.loop import run_blocking
+from utils.nicknames import NicknameIndex
+from utils.ranking import Ranking
+from utils.statements import FULL_SCAN, statement
+from utils.views import Confirm, ViewLimitReached
 
 ASSETS = Path("assets")
+# longest nickname Discord accepts
+MAX_NICKNAME_LENGTH = 32
+
+# UTC day of a snowflake, in SQL: the upper bits are milliseconds since the
+# Discord epoch (2015-01-01)
+_SNOWFLAKE_DAY_SQL = "date((({column} >> 22) + 1420070400000) / 1000, 'unixepoch')"
+
+
+_EXPERIENCE_SQL = statement(
+    "roleplay.experience",
+    """
+    SELECT message_id, xp
+      FROM roleplay_experience
+     WHERE member_id=:member_id
+       AND guild_id=:guild_id
+    """,
+)
+
+_GUILD_EXPERIENCE_SQL = statement(
+    "roleplay.guild_experience",
+    """
+    SELECT member_id, SUM(xp) AS experience
+      FROM roleplay_experience
+     WHERE guild_id=:guild_id
+     GROUP BY member_id
+    """,
+)
+
+_PAST_EXPERIENCE_SQL = statement(
+    "roleplay.past_experience",
+    """
+    SELECT COALESCE(SUM(xp), 0) AS experience
+      FROM roleplay_season_summary
+     WHERE guild_id=:guild_id
+       AND member_id=:member_id
+    """,
+)
+
+_CURRENT_SEASON_SQL = statement(
+    "roleplay.current_season",
+    """
+    SELECT *
+      FROM roleplay_season
+     WHERE guild_id=:guild_id
+       AND closed_at IS NULL
+    """,
+)
+
+_SET_SEASON_LENGTH_SQL = statement(
+    "roleplay.set_season_length",
+    """
+    UPDATE roleplay_season
+       SET length_days=:length_days
+     WHERE guild_id=:guild_id
+       AND season=:season
+    """,
+)
+
+_PRUNE_SEASON_SQL = statement(
+    "roleplay.prune_season",
+    """
+    DELETE FROM roleplay_experience_archive
+     WHERE guild_id=:guild_id
+       AND season=:season
+    """,
+)
+
+_ADD_EXPERIENCE_SQL = statement(
+    "roleplay.add_experience",
+    """
+    INSERT INTO roleplay_experience
+    VALUES (:guild_id,
+            :member_id,
+            :message_id,
+            :xp)
+    """,
+)
+
+_ALL_EXPERIENCE_SQL = statement(
+    "roleplay.all_experience",
+    """
+    SELECT guild_id,
+           member_id,
+           SUM(xp) AS experience,
+           MAX(message_id) AS last_message_id
+      FROM roleplay_experience
+     GROUP BY guild_id, member_id
+    """,
+    allow=[FULL_SCAN],
+    budget=1.0,
+)
+
+_START_SEASON_SQL = statement(
+    "roleplay.start_season",
+    """
+    INSERT OR IGNORE INTO roleplay_season
+    VALUES (:guild_id, 1, :started_at, NULL, NULL)
+    """,
+)
+
+_CLOSE_SEASON_SQL = statement(
+    "roleplay.close_season",
+    """
+    UPDATE roleplay_season
+       SET closed_at=:closed_at
+     WHERE guild_id=:guild_id
+       AND season=:season
+       AND closed_at IS NULL
+    """,
+)
+
+_OPEN_SEASONS_SQL = statement(
+    "roleplay.open_seasons",
+    """
+    SELECT *
+      FROM roleplay_season
+     WHERE closed_at IS NULL
+    """,
+    allow=[FULL_SCAN],
+    budget=1.0,
+)
 
 
 def load_text_list(path):
@@ -35,6 +162,21 @@ def _get_level_from_xp(xp):
     return level, remaining_xp
 
 
+def _get_level_edges(max_level):
+    """Return the experience reaching each level, up to `max_level`."""
+
+    edges = [0]
+    for level in range(max_level):
+        edges.append(edges[-1] + _get_next_level_xp(level))
+    return edges
+
+
+def _get_season_end(season):
+    if season["length_days"] is None:
+        return None
+    return season["started_at"] + timedelta(days=season["length_days"])
+
+
 def make_rank_history_graph(history):
     data = [[snowflake_time(row["message_id"]), row["xp"]] for row in history]
     data.sort(key=lambda x: x[0])
@@ -48,17 +190,27 @@ def make_rank_history_graph(history):
 
     graph = io.BytesIO()
     fig.savefig(graph, format="png")
+    plt.close(fig)  # pyplot keeps every figure alive until closed
     graph.seek(0)
 
     return graph
 
 
+class NamesExhausted(Exception):
+    """Raised when there are not enough unused names to draw from."""
+
+
 class RandomMedievalNameGenerator:
     _assets_path = ASSETS / "names"
     _female_names = load_text_list(_assets_path / "female.txt")
     _male_names = load_text_list(_assets_path / "male.txt")
     _surnames = load_text_list(_assets_path / "surname.txt")
     _titles = load_text_list(_assets_path / "title.txt")
+    _names = _female_names + _male_names
+
+    # the distinct parts of the full names with a title, the digits of an index
+    # in the mixed-radix space names x surnames x titles
+    _name_parts = (sorted(set(_names)), sorted(set(_surnames)), sorted(set(_titles)))
 
     @classmethod
     def female_name(cls):
@@ -70,7 +222,7 @@ class RandomMedievalNameGenerator:
 
     @classmethod
     def name(cls):
-        return random.choice(cls._female_names + cls._male_names)
+        return random.choice(cls._names)
 
     @classmethod
     def surname(cls):
@@ -88,43 +240,171 @@ class RandomMedievalNameGenerator:
     def full_name_with_title(cls):
         return f"{cls.full_name()}, {cls.title()}"
 
+    @classmethod
+    def unique_full_names_with_title(cls, count, taken=frozenset()):
+        """Return `count` distinct full names with a title, none of them in `taken`,
+        which holds casefolded names, and none longer than a nickname can be.
+        Names are drawn as indices without replacement, so no list of candidates
+        is built and the cost only depends on `count` while the space is mostly
+        free.
+        """
+        names, surnames, titles = cls._name_parts
+        space = len(names) * len(surnames) * len(titles)
+
+        drawn, seen = [], set()
+        while len(drawn) < count:
+            if len(seen) >= space:
+                raise NamesExhausted(f"Cannot draw {count} unused names.")
+
+            needed = count - len(drawn)
+            for index in random.sample(range(space), min(space, 2 * needed)):
+                if index in seen:
+                    continue
+                seen.add(index)
+
+                rest, title = divmod(index, len(titles))
+                name, surname = divmod(rest, len(surnames))
+                full_name = f"{names[name]} of {surnames[surname]}, {titles[title]}"
+                if (
+                    len(full_name) <= MAX_NICKNAME_LENGTH
+                    and full_name.casefold() not in taken
+                ):
+                    drawn.append(full_name)
+                    if len(drawn) == count:
+                        break
+
+        return drawn
+
+    @classmethod
+    def unique_full_name_with_title(cls, taken=frozenset()):
+        return cls.unique_full_names_with_title(1, taken)[0]
+
+
+class RenameConfirm(Confirm):
+    """Confirmation prompt applying a random name to the member who asked for it."""
+
+    def __init__(self, name, *, author_id, custom_id):
+        super().__init__(author_id=author_id, custom_id=custom_id)
+        self.name = name
+
+    async def on_confirm(self, interaction: discord.Interaction):
+        try:
+            await interaction.user.edit(nick=self.name)
+
+        except discord.Forbidden:
+            # ignore if author's top role is above the bot's
+            pass
+
 
 class Roleplay(commands.Cog):
     """Collections of commands and utilities for medieval roleplay features."""
 
     def __init__(self, bot):
         self.bot = bot
-        self._last_message = defaultdict(
-            lambda: datetime.min.replace(tzinfo=timezone.utc)
-        )
-
-        self.bot.loop.run_until_complete(self._create_tables())
+        # in the store shared by the cogs: the POSIX time of the last message
+        # earning experience, for the cooldown, and the experience of the season
+        self._members = bot.member_store
+        self._members.add_column("last_message", "d")
+        self._members.add_column("experience", "q")
+        # guild ID -> Ranking of the members by experience in the current season,
+        # holding the experience column of the guild
+        self._rankings = {}
+        # guild ID -> roleplay_season row of the current season
+        self._seasons = {}
+        # guild ID -> lock held while checking and closing the current season
+        self._season_locks = defaultdict(asyncio.Lock)
+        self._nicknames = NicknameIndex()
+        # once warmed, a guild missing from the cache has no experience
+        self._cache_complete = False
+
+        self.bot.views.register_factory("rname", self._restore_rename_view)
 
     def get_last_message(self, member):
-        return self._last_message[(member.guild.id, member.id)]
+        timestamp = self._members.get(member.guild.id, member.id, "last_message")
+        return datetime.fromtimestamp(timestamp, timezone.utc)
 
     def set_last_message(self, message):
-        self._last_message[(message.guild.id, message.author.id)] = message.created_at
+        self._members.set(
+            message.guild.id,
+            message.author.id,
+            last_message=message.created_at.timestamp(),
+        )
 
-    @commands.command()
+    @commands.group(invoke_without_command=True)
     async def rname(self, ctx):
-        """Generate a random medieval name that you can apply to yourself."""
-
-        random_name = RandomMedievalNameGenerator.full_name_with_title()
-        view = Confirm()
+        """Generate a random medieval name, that nobody in the server has, which
+        you can apply to yourself.
+        """
+        taken = await self._get_taken_names(ctx.guild)
+        random_name = RandomMedievalNameGenerator.unique_full_name_with_title(taken)
+        view = RenameConfirm(
+            random_name,
+            author_id=ctx.author.id,
+            custom_id=f"rname:{ctx.message.id}",
+        )
+        self.bot.views.add(
+            view, guild_id=ctx.guild and ctx.guild.id, user_id=ctx.author.id
+        )
 
-        await ctx.reply(
+        message = await ctx.reply(
             f"Do you want to change your name to __{random_name}__?", view=view
         )
-        await view.wait()
+        await self.bot.views.persist(view, message, "rname", random_name)
+
+    @rname.command(name="all")
+    @commands.guild_only()
+    @commands.has_permissions(administrator=True)
+    async def rname_all(self, ctx):
+        """Give a distinct random medieval name to every member of the server.
+
+        You must have the Administrator permission to use this command.
+        """
+        all_members = await self.bot.get_guild_members(ctx.guild)
+        members = [m for m in all_members if not m.bot]
+        # the members were just fetched, reindex them rather than trust the index
+        self._nicknames.build(ctx.guild.id, all_members)
+        taken = self._nicknames.taken(ctx.guild.id)
+        names = await run_blocking(
+            RandomMedievalNameGenerator.unique_full_names_with_title,
+            len(members),
+            taken,
+        )
 
-        if view.value:
+        await ctx.reply(f"Renaming {len(members)} members, this may take a while.")
+        renamed = 0
+        for member, name in zip(members, names):
             try:
-                await ctx.author.edit(nick=random_name)
+                await member.edit(nick=name)
+            except discord.HTTPException:
+                # e.g. Forbidden for the members above the bot's top role, the
+                # others are still renamed
+                continue
+            renamed += 1
+
+            # on_member_update only fires for the cached members
+            self._nicknames.set(ctx.guild.id, member.id, name)
+
+        await ctx.reply(f"Renamed {renamed} of {len(members)} members.")
+
+    @rname.error
+    @rname_all.error
+    async def rname_error(self, ctx, error):
+        """Error handler for the rname commands."""
+
+        error = getattr(error, "original", error)
 
-            except discord.Forbidden:
-                # ignore if author's top role is above the bot's
-                pass
+        if isinstance(error, (ViewLimitReached, NamesExhausted)):
+            await ctx.reply(error)
+
+        else:
+            raise error
+
+    def _restore_rename_view(self, row):
+        return RenameConfirm(
+            row["payload"],
+            author_id=row["user_id"],
+            custom_id=row["custom_id"],
+        )
 
     @commands.Cog.listener(name="on_message")
     async def level_add_xp(self, message):
@@ -138,6 +418,9 @@ class Roleplay(commands.Cog):
             # do not count the bot
             return
 
+        # members outside the member cache are renamed without an event
+        self._nicknames.set(guild.id, member.id, member.display_name)
+
         ctx = await self.bot.get_context(message)
         if ctx.command:
             # do not count command invocations
@@ -148,8 +431,14 @@ class Roleplay(commands.Cog):
             # message experience cooldown
             return
 
+        # the check and the close must not interleave with another message's
+        async with self._season_locks[guild.id]:
+            season = await self._get_season(guild)
+            while (end := _get_season_end(season)) and message.created_at >= end:
+                season = await self._close_season(guild, season, end)
+
         # if all checks, add experience to member
-        experience = await self._get_experience(member)
+        experience = await self._get_total_experience(member)
         level, _ = _get_level_from_xp(experience)
         xp = random.randint(15, 25)
         # print(f"Adding {xp} xp to member {member} in guild {guild}")
@@ -161,6 +450,33 @@ class Roleplay(commands.Cog):
         if new_level != level:
             print("Level up!")
 
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        self._nicknames.set(member.guild.id, member.id, member.display_name)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.display_name != after.display_name:
+            self._nicknames.set(after.guild.id, after.id, after.display_name)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload):
+        self._nicknames.discard(payload.guild_id, payload.user.id)
+
+    @commands.Cog.listener()
+    async def on_guild_purge(self, guild_id):
+        self._rankings.pop(guild_id, None)
+        self._nicknames.drop(guild_id)
+        self._seasons.pop(guild_id, None)
+        self._season_locks.pop(guild_id, None)
+        self._members.drop_guild(guild_id)
+
+    @commands.Cog.listener()
+    async def on_member_purge(self, guild_id, member_id):
+        if guild_id in self._rankings:
+            self._rankings[guild_id].set(member_id, 0)
+        self._members.unset(guild_id, member_id, "last_message")
+
     @commands.group(aliases=["level", "lvl"], invoke_without_command=True)
     async def rank(self, ctx, *, member: discord.Member = None):
         """Show the level and progress of the member."""
@@ -181,18 +497,185 @@ class Roleplay(commands.Cog):
 
         rows = await self._get_experience(member)
         embed = await self._rank_embed(member, rows)
+        if not rows:
+            # nothing to plot, e.g. right after a season rollover
+            embed.description = "No experience this season yet."
+            return await ctx.reply(embed=embed)
+
         filename = "rank_history.png"
         embed.set_image(url=f"attachment://{filename}")
 
-        graph = await self.bot.loop.run_in_executor(None, make_rank_history_graph, rows)
+        graph = await run_blocking(make_rank_history_graph, rows)
 
         await ctx.reply(embed=embed, file=discord.File(graph, filename=filename))
 
+    @rank.command(name="top")
+    @commands.guild_only()
+    async def rank_top(self, ctx, page: int = 1):
+        """List the members with the most experience, 10 per page."""
+
+        ranking = await self._get_ranking(ctx.guild)
+        per_page = 10
+        page = max(page, 1)
+        offset = (page - 1) * per_page
+
+        lines = []
+        for position, (member_id, experience) in enumerate(
+            ranking.top(per_page, offset), offset + 1
+        ):
+            level, _ = _get_level_from_xp(experience)
+            lines.append(
+                f"**#{position}** <@{member_id}> - Level {level} ({experience} xp)"
+            )
+
+        embed = discord.Embed(
+            title="Top Ranks",
+            description="\n".join(lines) or "Nobody earned experience yet.",
+            color=discord.Color.yellow(),
+        ).set_footer(
+            text=f"Page {page} of {max(1, -(-len(ranking) // per_page))}, "
+            f"{len(ranking)} ranked members"
+        )
+        await ctx.reply(embed=embed)
+
+    @rank.command(name="levels")
+    @commands.guild_only()
+    async def rank_levels(self, ctx):
+        """Show how many members reached each level this season."""
+
+        ranking = await self._get_ranking(ctx.guild)
+        top = ranking.top(1)
+        max_level = _get_level_from_xp(top[0][1])[0] if top else 0
+        counts = self._members.histogram(
+            ctx.guild.id, "experience", _get_level_edges(max_level)
+        )
+
+        lines = [
+            f"**Level {level}** - {count} members"
+            for level, count in enumerate(counts)
+            if count
+        ]
+        embed = discord.Embed(
+            title="Levels",
+            description="\n".join(reversed(lines)) or "Nobody earned experience yet.",
+            color=discord.Color.yellow(),
+        )
+        await ctx.reply(embed=embed)
+
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def season(self, ctx):
+        """Show the current experience season of the server.
+        Levels and ranks are per season, lifetime totals add up every season.
+        """
+        season = await self._get_season(ctx.guild)
+        ranking = await self._get_ranking(ctx.guild)
+        end = _get_season_end(season)
+
+        embed = (
+            discord.Embed(
+                title=f"Season {season['season']}",
+                color=discord.Color.yellow(),
+            )
+            .add_field(
+                name="Started",
+                value=discord.utils.format_dt(season["started_at"], style="D"),
+            )
+            .add_field(
+                name="Ends",
+                value=discord.utils.format_dt(end, style="R")
+                if end
+                else "When an administrator ends it",
+            )
+            .add_field(name="Ranked members", value=len(ranking))
+        )
+        await ctx.reply(embed=embed)
+
+    @season.command(name="end")
+    @commands.has_permissions(administrator=True)
+    async def season_end(self, ctx):
+        """End the current season now and start the next one.
+        The experience of the season is frozen into the lifetime totals.
+
+        You must have the Administrator permission to use this command.
+        """
+        async with self._season_locks[ctx.guild.id]:
+            season = await self._get_season(ctx.guild)
+            season = await self._close_season(
+                ctx.guild, season, discord.utils.utcnow()
+            )
+        await ctx.reply(
+            f"Season {season['season'] - 1} ended, season {season['season']} started!"
+        )
+
+    @season.command(name="length")
+    @commands.has_permissions(administrator=True)
+    async def season_length(self, ctx, days: int):
+        """Set the length in days of the current and next seasons, use 0 to only
+        end seasons with the `season end` command.
+
+        You must have the Administrator permission to use this command.
+        """
+        if days < 0:
+            raise commands.BadArgument("The season length cannot be negative.")
+
+        async with self._season_locks[ctx.guild.id]:
+            season = await self._get_season(ctx.guild)
+            await self.bot.db.execute(
+                _SET_SEASON_LENGTH_SQL,
+                dict(
+                    length_days=days or None,
+                    guild_id=ctx.guild.id,
+                    season=season["season"],
+                ),
+            )
+            await self.bot.db.commit()
+            self._seasons.pop(ctx.guild.id, None)
+
+        if days:
+            await ctx.reply(f"Seasons now last {days} days.")
+        else:
+            await ctx.reply("Seasons now last until they are ended.")
+
+    @season.command(name="prune")
+    @commands.has_permissions(administrator=True)
+    async def season_prune(self, ctx, season: int):
+        """Delete the message experience archived for a past season, which is only
+        kept for the data exports. Its totals are kept in the lifetime experience.
+
+        You must have the Administrator permission to use this command.
+        """
+        current = await self._get_season(ctx.guild)
+        if season >= current["season"]:
+            raise commands.BadArgument("Only past seasons can be pruned.")
+
+        async with self.bot.db.execute(
+            _PRUNE_SEASON_SQL,
+            dict(guild_id=ctx.guild.id, season=season),
+        ) as c:
+            deleted = c.rowcount
+        await self.bot.db.commit()
+
+        await ctx.reply(f"Pruned {deleted} archived messages of season {season}.")
+
+    @season_length.error
+    @season_prune.error
+    async def season_error(self, ctx, error):
+        """Error handler for the season commands."""
+
+        if isinstance(error, commands.BadArgument):
+            await ctx.reply(error)
+
+        else:
+            raise error
+
     async def _rank_embed(self, member, rows=None):
         if rows is None:
-            rows = await self._get_experience(member)
+            experience = await self._get_total_experience(member)
+        else:
+            experience = sum([row["xp"] for row in rows])
+        lifetime = experience + await self._get_past_experience(member)
 
-        experience = sum([row["xp"] for row in rows])
         level, remaining_xp = _get_level_from_xp(experience)
         next_level_xp = _get_next_level_xp(level)
         # xp_until_next_level = next_level_xp - remaining_xp
@@ -213,45 +696,220 @@ class Roleplay(commands.Cog):
         # add zero-width-space so it renders fine on mobile
         progress = "\u200B" + filled * progress_10 + "⬛" * (10 - progress_10)
 
-        _user = await self.bot.fetch_user(member.id)
+        ranking = await self._get_ranking(member.guild)
+        position = ranking.rank(member.id)
+        position = f"#{position} of {len(ranking)}" if position else "Unranked"
+
+        _user = await self.bot.profiles.get(member.id)
         embed = (
             discord.Embed(
                 title=f"Rank for {member.display_name}",
                 color=_user.accent_color or member.color,
             )
             .add_field(name=f"Level {level}", value=f"{remaining_xp}/{next_level_xp}")
-            .add_field(name="Total experience", value=experience)
+            .add_field(name="Season experience", value=experience)
+            .add_field(name="Lifetime experience", value=lifetime)
+            .add_field(name="Position", value=position)
             .add_field(name="Progress", value=progress, inline=False)
             .set_thumbnail(url=member.avatar.url)
         )
 
         return embed
 
-    async def _create_tables(self):
+    async def create_tables(self, db):
         """Create the necessary DB tables if they do not exist."""
 
-        await self.bot.db.execute(
+        await db.execute(
             """
             CREATE TABLE IF NOT EXISTS roleplay_experience(
                 guild_id    INTEGER NOT NULL,
                 member_id   INTEGER NOT NULL,
                 message_id  INTEGER NOT NULL,
-                xp          INTEGER NOT NULL
+                xp          INTEGER NOT NULL,
+                FOREIGN KEY (guild_id, member_id)
+                    REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE
             )
             """
         )
+        await registry.register_table(db, "roleplay_experience", "member")
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS roleplay_experience_guild_member
+                ON roleplay_experience(guild_id, member_id, xp)
+            """
+        )
+        # daily rollup of the rewarded messages, maintained by the trigger below
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS roleplay_activity_daily(
+                guild_id  INTEGER NOT NULL,
+                day       TEXT    NOT NULL,
+                member_id INTEGER NOT NULL,
+                messages  INTEGER NOT NULL,
+                xp        INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, day, member_id),
+                FOREIGN KEY (guild_id, member_id)
+                    REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+            """
+        )
+        await registry.register_table(
+            db,
+            "roleplay_activity_daily",
+            "member",
+            key="guild_id, day, member_id",
+            derived=True,
+        )
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS roleplay_activity_daily_member
+                ON roleplay_activity_daily(guild_id, member_id, day)
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS roleplay_activity_daily_insert
+            AFTER INSERT ON roleplay_experience
+            BEGIN
+                INSERT INTO roleplay_activity_daily
+                VALUES (NEW.guild_id,
+                        {_SNOWFLAKE_DAY_SQL.format(column="NEW.message_id")},
+                        NEW.member_id,
+                        1,
+                        NEW.xp)
+                    ON CONFLICT(guild_id, day, member_id) DO
+                UPDATE
+                   SET messages = messages + 1,
+                       xp = xp + excluded.xp;
+            END
+            """
+        )
+        # backfill the rollup from the raw experience the first time it is created
+        await db.execute(
+            f"""
+            INSERT INTO roleplay_activity_daily
+            SELECT guild_id,
+                   {_SNOWFLAKE_DAY_SQL.format(column="message_id")} AS day,
+                   member_id,
+                   COUNT(*),
+                   SUM(xp)
+              FROM roleplay_experience
+             WHERE NOT EXISTS (SELECT 1 FROM roleplay_activity_daily)
+             GROUP BY guild_id, day, member_id
+            """
+        )
 
-        await self.bot.db.commit()
+        # seasons: roleplay_experience only holds the current season of each guild,
+        # ending a season freezes it into per-member summaries and archives its
+        # rows, all within the UPDATE statement setting `closed_at`
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS roleplay_season(
+                guild_id    INTEGER   NOT NULL,
+                season      INTEGER   NOT NULL,
+                started_at  TIMESTAMP NOT NULL,
+                length_days INTEGER,
+                closed_at   TIMESTAMP,
+                PRIMARY KEY (guild_id, season),
+                FOREIGN KEY (guild_id)
+                    REFERENCES registry_guild(guild_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+            """
+        )
+        await registry.register_table(
+            db, "roleplay_season", "guild", key="guild_id, season"
+        )
+        await db.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS roleplay_season_current
+                ON roleplay_season(guild_id)
+             WHERE closed_at IS NULL
+            """
+        )
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS roleplay_season_summary(
+                guild_id  INTEGER NOT NULL,
+                member_id INTEGER NOT NULL,
+                season    INTEGER NOT NULL,
+                messages  INTEGER NOT NULL,
+                xp        INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, member_id, season),
+                FOREIGN KEY (guild_id, member_id)
+                    REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE
+            ) WITHOUT ROWID
+            """
+        )
+        await registry.register_table(
+            db,
+            "roleplay_season_summary",
+            "member",
+            key="guild_id, member_id, season",
+        )
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS roleplay_experience_archive(
+                guild_id   INTEGER NOT NULL,
+                season     INTEGER NOT NULL,
+                member_id  INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                xp         INTEGER NOT NULL,
+                FOREIGN KEY (guild_id, member_id)
+                    REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE
+            )
+            """
+        )
+        await registry.register_table(
+            db, "roleplay_experience_archive", "member", derived=True
+        )
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS roleplay_experience_archive_season
+                ON roleplay_experience_archive(guild_id, season, member_id)
+            """
+        )
+        # the rows of a member, deleted by the registry cascade and the retention
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS roleplay_experience_archive_member
+                ON roleplay_experience_archive(guild_id, member_id)
+            """
+        )
+        await db.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS roleplay_season_close
+            AFTER UPDATE OF closed_at ON roleplay_season
+            WHEN OLD.closed_at IS NULL AND NEW.closed_at IS NOT NULL
+            BEGIN
+                INSERT INTO roleplay_season_summary
+                SELECT guild_id, member_id, NEW.season, COUNT(*), SUM(xp)
+                  FROM roleplay_experience
+                 WHERE guild_id = NEW.guild_id
+                 GROUP BY member_id;
+
+                INSERT INTO roleplay_experience_archive
+                SELECT guild_id, NEW.season, member_id, message_id, xp
+                  FROM roleplay_experience
+                 WHERE guild_id = NEW.guild_id;
+
+                DELETE FROM roleplay_experience WHERE guild_id = NEW.guild_id;
+
+                INSERT INTO roleplay_season
+                VALUES (NEW.guild_id,
+                        NEW.season + 1,
+                        NEW.closed_at,
+                        NEW.length_days,
+                        NULL);
+            END
+            """
+        )
 
     async def _add_experience(self, message, xp):
+        # before the insert, so a ranking loaded from the DB does not count it twice
+        ranking = await self._get_ranking(message.guild)
+
         await self.bot.db.execute(
-            """
-            INSERT INTO roleplay_experience
-            VALUES (:guild_id,
-                    :member_id,
-                    :message_id,
-                    :xp)
-            """,
+            _ADD_EXPERIENCE_SQL,
             dict(
                 guild_id=message.guild.id,
                 member_id=message.author.id,
@@ -261,21 +919,168 @@ class Roleplay(commands.Cog):
         )
 
         await self.bot.db.commit()
+        ranking.add(message.author.id, xp)
 
     async def _get_experience(self, member):
         async with self.bot.db.execute(
-            """
-            SELECT message_id, xp
-              FROM roleplay_experience
-             WHERE member_id=:member_id
-               AND guild_id=:guild_id
-            """,
+            _EXPERIENCE_SQL,
             dict(guild_id=member.guild.id, member_id=member.id,),
         ) as c:
             rows = await c.fetchall()
 
         return rows
 
+    async def warm_cache(self):
+        """Load the experience rankings and the XP cooldowns of every guild
+        handled by this process.
+        """
+        scores = defaultdict(dict)
+        last_messages = defaultdict(dict)
+        async with self.bot.db.execute(_ALL_EXPERIENCE_SQL) as c:
+            async for row in c:
+                if self.bot.owns_guild(row["guild_id"]):
+                    guild_id, member_id = row["guild_id"], row["member_id"]
+                    scores[guild_id][member_id] = row["experience"]
+                    last_messages[guild_id][member_id] = snowflake_time(
+                        row["last_message_id"]
+                    ).timestamp()
+
+        self._members.clear("experience")
+        self._members.clear("last_message")
+        self._rankings = {}
+        for guild_id, guild_scores in scores.items():
+            self._members.load(
+                guild_id, "experience", list(guild_scores), list(guild_scores.values())
+            )
+            self._members.load(
+                guild_id,
+                "last_message",
+                list(last_messages[guild_id]),
+                list(last_messages[guild_id].values()),
+            )
+            self._rankings[guild_id] = self._new_ranking(guild_id)
+
+        async with self.bot.db.execute(_OPEN_SEASONS_SQL) as c:
+            async for row in c:
+                if self.bot.owns_guild(row["guild_id"]):
+                    self._seasons[row["guild_id"]] = row
+
+        self._cache_complete = True
+
+    def export_state(self):
+        """Hand the rankings, seasons, season locks and nickname index over to the
+        reloaded cog, so that a deploy does not rebuild the rankings from the whole
+        experience table. The XP cooldowns and the experience stay in the bot's
+        store. The season locks of a rollover in progress keep serializing it.
+        """
+        return dict(
+            rankings=self._rankings,
+            seasons=self._seasons,
+            season_locks=self._season_locks,
+            nicknames=self._nicknames,
+            cache_complete=self._cache_complete,
+        )
+
+    def import_state(self, state):
+        self._rankings = state["rankings"]
+        self._seasons = state["seasons"]
+        self._season_locks = state["season_locks"]
+        self._nicknames = state["nicknames"]
+        self._cache_complete = state["cache_complete"]
+
+    async def _get_total_experience(self, member):
+        ranking = await self._get_ranking(member.guild)
+        return ranking.score(member.id)
+
+    async def _get_ranking(self, guild):
+        if guild.id not in self._rankings:
+            if self._cache_complete:
+                self._members.clear("experience", [guild.id])
+                self._rankings[guild.id] = self._new_ranking(guild.id)
+            else:
+                scores = await self._fetch_guild_experience(guild)
+                # the column is shared by the ranking of a concurrent fetch
+                if guild.id not in self._rankings:
+                    self._members.load(
+                        guild.id, "experience", list(scores), list(scores.values())
+                    )
+                    self._rankings[guild.id] = self._new_ranking(guild.id)
+
+        return self._rankings[guild.id]
+
+    def _new_ranking(self, guild_id):
+        """Return a Ranking of the experience loaded in the guild's column."""
+
+        return Ranking(self._members.column(guild_id, "experience"))
+
+    async def _fetch_guild_experience(self, guild):
+        async with self.bot.db.execute(
+            _GUILD_EXPERIENCE_SQL,
+            dict(guild_id=guild.id),
+        ) as c:
+            rows = await c.fetchall()
+
+        return {row["member_id"]: row["experience"] for row in rows}
+
+    async def _get_taken_names(self, guild):
+        if guild is None:
+            return frozenset()
+
+        if guild.id not in self._nicknames:
+            self._nicknames.build(guild.id, await self.bot.get_guild_members(guild))
+        return self._nicknames.taken(guild.id)
+
+    async def _get_past_experience(self, member):
+        """Return the experience of the member in the closed seasons."""
+
+        async with self.bot.db.execute(
+            _PAST_EXPERIENCE_SQL,
+            dict(guild_id=member.guild.id, member_id=member.id),
+        ) as c:
+            row = await c.fetchone()
+
+        return row["experience"]
+
+    async def _get_season(self, guild):
+        if guild.id not in self._seasons:
+            self._seasons[guild.id] = await self._fetch_season(guild)
+
+        return self._seasons[guild.id]
+
+    async def _fetch_season(self, guild):
+        # the first season of a guild starts the first time it is needed
+        await self.bot.db.execute(
+            _START_SEASON_SQL,
+            dict(guild_id=guild.id, started_at=discord.utils.utcnow()),
+        )
+        await self.bot.db.commit()
+
+        async with self.bot.db.execute(
+            _CURRENT_SEASON_SQL,
+            dict(guild_id=guild.id),
+        ) as c:
+            row = await c.fetchone()
+
+        return row
+
+    async def _close_season(self, guild, season, closed_at):
+        """Close `season` at `closed_at` and return the next season. The caller
+        holds the season lock of the guild.
+        """
+        async with self.bot.db.execute(
+            _CLOSE_SEASON_SQL,
+            dict(closed_at=closed_at, guild_id=guild.id, season=season["season"]),
+        ) as c:
+            closed = c.rowcount == 1
+        await self.bot.db.commit()
+
+        # a season closed by someone else already has its own ranking
+        if closed:
+            self._members.clear("experience", [guild.id])
+            self._rankings[guild.id] = self._new_ranking(guild.id)
+        self._seasons.pop(guild.id, None)
+        return await self._get_season(guild)
+
 
 def setup(bot):
     bot.add_cog(Roleplay(bot))
@@ -0,0 +1,217 @@
+from datetime import date, timedelta
+import io
+from typing import Optional
+
+import discord
+from discord.ext import commands
+import matplotlib.pyplot as plt
+import numpy as np
+
+from utils.loop import run_blocking
+from utils.money import Money
+from utils.statements import TEMP_BTREE, statement
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# the member filter is a constant, the values are bound parameters
+_MEMBER_CLAUSE = "AND member_id=:member_id"
+
+_ACTIVITY_SQL = """
+    SELECT day, SUM(messages) AS messages, SUM(xp) AS xp
+      FROM roleplay_activity_daily
+     WHERE guild_id=:guild_id
+       AND day >= :start
+       {member_clause}
+     GROUP BY day
+    """
+_GUILD_ACTIVITY_SQL = statement(
+    "stats.guild_activity", _ACTIVITY_SQL.format(member_clause="")
+)
+_MEMBER_ACTIVITY_SQL = statement(
+    "stats.member_activity", _ACTIVITY_SQL.format(member_clause=_MEMBER_CLAUSE)
+)
+
+_FLOW_SQL = """
+    SELECT day, SUM(income) AS income, SUM(spending) AS spending
+      FROM economy_flow_daily
+     WHERE guild_id=:guild_id
+       AND day >= :start
+       {member_clause}
+     GROUP BY day
+    """
+_GUILD_FLOW_SQL = statement("stats.guild_flow", _FLOW_SQL.format(member_clause=""))
+_MEMBER_FLOW_SQL = statement(
+    "stats.member_flow", _FLOW_SQL.format(member_clause=_MEMBER_CLAUSE)
+)
+
+_ACTIVE_MEMBERS_SQL = statement(
+    "stats.active_members",
+    """
+    SELECT COUNT(DISTINCT member_id) AS members
+      FROM roleplay_activity_daily
+     WHERE guild_id=:guild_id
+       AND day >= :start
+    """,
+    allow=[TEMP_BTREE],
+)
+
+
+def make_activity_graph(days, activity, flow):
+    """Render a weekday/week heatmap of the messages, and the daily trends of
+    messages and money flow.
+    `activity` maps ISO days to message counts, `flow` maps them to
+    (income, spending) pairs.
+    """
+    messages = np.array([activity.get(day.isoformat(), 0) for day in days])
+    income = np.array([flow.get(day.isoformat(), (0, 0))[0] for day in days])
+    spending = np.array([flow.get(day.isoformat(), (0, 0))[1] for day in days])
+    # the flow is in minor units
+    income, spending = income / Money.scale, spending / Money.scale
+
+    # one column per week, starting on the Monday of the first week
+    offset = days[0].weekday()
+    weeks = (offset + len(days) + 6) // 7
+    heatmap = np.full(7 * weeks, np.nan)
+    heatmap[offset : offset + len(days)] = messages
+    heatmap = heatmap.reshape(weeks, 7).T
+
+    fig, (ax_heat, ax_messages, ax_money) = plt.subplots(
+        3, 1, figsize=(8, 10), gridspec_kw=dict(height_ratios=[1, 1.2, 1.2])
+    )
+
+    image = ax_heat.imshow(heatmap, aspect="auto", cmap="viridis")
+    ax_heat.set_yticks(range(7))
+    ax_heat.set_yticklabels(WEEKDAYS)
+    ax_heat.set_xlabel("Week")
+    ax_heat.set_title("Messages per day")
+    fig.colorbar(image, ax=ax_heat)
+
+    ax_messages.plot(days, messages)
+    ax_messages.set_ylabel("Messages")
+    ax_messages.tick_params(axis="x", rotation=45)
+
+    ax_money.plot(days, income, label="Income")
+    ax_money.plot(days, spending, label="Spending")
+    ax_money.set_ylabel("Money")
+    ax_money.tick_params(axis="x", rotation=45)
+    ax_money.legend()
+
+    fig.tight_layout()
+    graph = io.BytesIO()
+    fig.savefig(graph, format="png")
+    plt.close(fig)
+    graph.seek(0)
+
+    return graph
+
+
+class Stats(commands.Cog):
+    """Server statistics, computed from the daily rollup tables only."""
+
+    max_days = 366
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def stats(self, ctx):
+        """Parent command for the server statistics."""
+
+        await ctx.send_help(ctx.command)
+
+    @stats.command(name="activity")
+    async def stats_activity(
+        self, ctx, days: Optional[int] = 30, *, member: discord.Member = None
+    ):
+        """Show the activity and money flow of the server, or of a member, over
+        the last days (30 by default, up to a year).
+        """
+        days = min(max(days, 1), self.max_days)
+        end = discord.utils.utcnow().date()
+        period = [end - timedelta(days=n) for n in reversed(range(days))]
+
+        activity = await self._get_activity(ctx.guild, period[0], member)
+        flow = await self._get_flow(ctx.guild, period[0], member)
+
+        filename = "activity.png"
+        graph = await run_blocking(
+            make_activity_graph,
+            period,
+            {row["day"]: row["messages"] for row in activity},
+            {row["day"]: (row["income"], row["spending"]) for row in flow},
+        )
+
+        subject = member.display_name if member else ctx.guild.name
+        embed = (
+            discord.Embed(
+                title=f"Activity of {subject}",
+                description=f"Last {days} days",
+                color=discord.Color.yellow(),
+            )
+            .add_field(name="Messages", value=sum(r["messages"] for r in activity))
+            .add_field(name="Experience", value=sum(r["xp"] for r in activity))
+            .add_field(
+                name="Money flow",
+                value=(
+                    f"+{Money(sum(r['income'] for r in flow))} / "
+                    f"-{Money(sum(r['spending'] for r in flow))}"
+                ),
+            )
+            .set_image(url=f"attachment://{filename}")
+        )
+        if member is None:
+            embed.add_field(
+                name="Active members",
+                value=await self._count_active_members(ctx.guild, period[0]),
+            )
+
+        await ctx.reply(embed=embed, file=discord.File(graph, filename=filename))
+
+    @stats_activity.error
+    async def stats_activity_error(self, ctx, error):
+        """Error handler for the stats activity command."""
+
+        if isinstance(error, commands.MemberNotFound):
+            await ctx.reply(error)
+
+        else:
+            raise error
+
+    async def _get_activity(self, guild, start: date, member=None):
+        async with self.bot.db.execute(
+            _MEMBER_ACTIVITY_SQL if member else _GUILD_ACTIVITY_SQL,
+            dict(
+                guild_id=guild.id,
+                start=start.isoformat(),
+                member_id=member.id if member else None,
+            ),
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    async def _get_flow(self, guild, start: date, member=None):
+        async with self.bot.db.execute(
+            _MEMBER_FLOW_SQL if member else _GUILD_FLOW_SQL,
+            dict(
+                guild_id=guild.id,
+                start=start.isoformat(),
+                member_id=member.id if member else None,
+            ),
+        ) as c:
+            rows = await c.fetchall()
+
+        return rows
+
+    async def _count_active_members(self, guild, start: date):
+        async with self.bot.db.execute(
+            _ACTIVE_MEMBERS_SQL, dict(guild_id=guild.id, start=start.isoformat())
+        ) as c:
+            row = await c.fetchone()
+
+        return row["members"]
+
+
+def setup(bot):
+    bot.add_cog(Stats(bot))
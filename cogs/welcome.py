@@ -3,6 +3,55 @@ from typing import Optional
 import discord
 from discord.ext import commands
 
+from utils import registry
+from utils.statements import FULL_SCAN, statement
+
+
+_GUILD_DATA_SQL = statement(
+    "welcome.guild_data",
+    """
+    SELECT *
+      FROM welcome_data
+     WHERE guild_id = :guild_id
+    """,
+)
+
+_UPDATE_SQL = statement(
+    "welcome.update",
+    """
+    INSERT INTO welcome_data
+    VALUES (:default_role_id,
+            :guild_id,
+            :welcome_channel_id,
+            :welcome_message)
+        ON CONFLICT(guild_id) DO
+    UPDATE
+       SET default_role_id = COALESCE(:default_role_id, default_role_id),
+           welcome_channel_id = COALESCE(:welcome_channel_id,
+                welcome_channel_id),
+           welcome_message = COALESCE(:welcome_message, welcome_message)
+     WHERE guild_id = :guild_id
+    """,
+)
+
+_REMOVE_SQL = statement(
+    "welcome.remove",
+    """
+    DELETE FROM welcome_data
+     WHERE guild_id = :guild_id
+    """,
+)
+
+_ALL_DATA_SQL = statement(
+    "welcome.all_data",
+    """
+    SELECT *
+      FROM welcome_data
+    """,
+    allow=[FULL_SCAN],
+    budget=1.0,
+)
+
 
 class WelcomeSetupFlags(commands.FlagConverter):
     channel: Optional[discord.TextChannel]
@@ -15,8 +64,10 @@ class Welcome(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-
-        self.bot.loop.run_until_complete(self._create_tables())
+        # guild ID -> welcome_data row, or None when the guild has no configuration
+        self._welcome_data = {}
+        # once warmed, a guild missing from the cache has no configuration
+        self._cache_complete = False
 
     @commands.Cog.listener("on_guild_join")
     async def send_setup_request(self, guild: discord.Guild):
@@ -44,6 +95,9 @@ class Welcome(commands.Cog):
         guild = member.guild
         # get role and message from DB
         data = await self._get_welcome_data(guild)
+        if data is None:
+            return
+
         role_id = data["default_role_id"]
         channel_id = data["welcome_channel_id"]
         message = data["welcome_message"]
@@ -57,6 +111,10 @@ class Welcome(commands.Cog):
         if role:
             await self.add_default_role(member, role)
 
+    @commands.Cog.listener()
+    async def on_guild_purge(self, guild_id):
+        self._welcome_data.pop(guild_id, None)
+
     async def send_welcome_message(
         self, member: discord.Member, channel: discord.TextChannel, message: str
     ):
@@ -158,53 +216,61 @@ class Welcome(commands.Cog):
 
         return content
 
-    async def _create_tables(self):
+    async def create_tables(self, db):
         """Create the necessary DB tables if they do not exist."""
 
-        await self.bot.db.execute(
+        await db.execute(
             """
             CREATE TABLE IF NOT EXISTS welcome_data(
                 default_role_id    INTEGER,
                 guild_id           INTEGER NOT NULL UNIQUE,
                 welcome_channel_id INTEGER,
-                welcome_message    TEXT
+                welcome_message    TEXT,
+                FOREIGN KEY (guild_id)
+                    REFERENCES registry_guild(guild_id) ON DELETE CASCADE
             )
             """
         )
+        await registry.register_table(db, "welcome_data", "guild")
 
-        await self.bot.db.commit()
+    async def warm_cache(self):
+        """Load the welcome configuration of every guild handled by this process."""
+
+        async with self.bot.db.execute(_ALL_DATA_SQL) as c:
+            async for row in c:
+                if self.bot.owns_guild(row["guild_id"]):
+                    self._welcome_data[row["guild_id"]] = row
+
+        self._cache_complete = True
+
+    def export_state(self):
+        """Hand the cached configurations over to the reloaded cog."""
+
+        return dict(
+            welcome_data=self._welcome_data, cache_complete=self._cache_complete
+        )
+
+    def import_state(self, state):
+        self._welcome_data = state["welcome_data"]
+        self._cache_complete = state["cache_complete"]
 
     async def _get_welcome_data(self, guild):
-        """Get the welcome message and default role from the database."""
+        """Get the welcome message and default role, from the cache if possible."""
 
-        async with self.bot.db.execute(
-            """
-            SELECT *
-              FROM welcome_data
-             WHERE guild_id = :guild_id
-            """,
-            dict(guild_id=guild.id),
-        ) as c:
-            row = await c.fetchone()
+        if guild.id not in self._welcome_data:
+            if self._cache_complete:
+                return None
+            await self._cache_welcome_data(guild)
+
+        return self._welcome_data[guild.id]
 
-        return row
+    async def _cache_welcome_data(self, guild):
+        async with self.bot.db.execute(_GUILD_DATA_SQL, dict(guild_id=guild.id)) as c:
+            self._welcome_data[guild.id] = await c.fetchone()
 
     async def _update_welcome_data(self, guild, flags):
         await self.bot.db.execute(
-            """
-            INSERT INTO welcome_data
-            VALUES (:default_role_id,
-                    :guild_id,
-                    :welcome_channel_id,
-                    :welcome_message)
-                ON CONFLICT(guild_id) DO
-            UPDATE
-               SET default_role_id = COALESCE(:default_role_id, default_role_id),
-                   welcome_channel_id = COALESCE(:welcome_channel_id,
-                        welcome_channel_id),
-                   welcome_message = COALESCE(:welcome_message, welcome_message)
-             WHERE guild_id = :guild_id
-            """,
+            _UPDATE_SQL,
             dict(
                 guild_id=guild.id,
                 default_role_id=flags.role.id if flags.role else None,
@@ -214,17 +280,16 @@ class Welcome(commands.Cog):
         )
 
         await self.bot.db.commit()
+        await self._cache_welcome_data(guild)
 
     async def _remove_welcome_data(self, guild):
         await self.bot.db.execute(
-            """
-            DELETE FROM welcome_data
-             WHERE guild_id = :guild_id
-            """,
+            _REMOVE_SQL,
             dict(guild_id=guild.id),
         )
 
         await self.bot.db.commit()
+        await self._cache_welcome_data(guild)
 
 
 def setup(bot):
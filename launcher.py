@@ -0,0 +1,221 @@
+"""Run the bot as several worker processes, each handling a subset of the shards.
+
+    python launcher.py --processes 4 --shard-count 8
+
+The coordinator starts the workers one after another, waiting for each to be
+ready so that gateway identifies stay within Discord's rate limits, restarts
+workers that crash and performs a rolling restart on SIGHUP.
+
+Shared state: the shards partition the guilds, and every cache in the cogs is
+keyed by guild, so each cache entry only ever lives in one worker. The workers
+share `bot.db` in WAL mode (see `create_db_connection`), where SQLite serializes
+the writers and readers never block.
+"""
+import argparse
+import logging
+import multiprocessing
+import signal
+import time
+
+log = logging.getLogger("launcher")
+
+
+def split_shards(shard_count, processes):
+    """Split the shard IDs into `processes` contiguous chunks."""
+
+    chunk, extra = divmod(shard_count, processes)
+    chunks, start = [], 0
+    for index in range(processes):
+        end = start + chunk + (index < extra)
+        chunks.append(list(range(start, end)))
+        start = end
+    return chunks
+
+
+def _run_worker(shard_ids, shard_count, ready_event, member_cache):
+    # the coordinator owns SIGINT and SIGHUP, workers are stopped with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    import bot
+
+    bot.main(
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        ready_event=ready_event,
+        member_cache=member_cache,
+    )
+
+
+class Worker:
+    def __init__(self, context, index, shard_ids, shard_count, member_cache):
+        self.context = context
+        self.index = index
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.member_cache = member_cache
+        self.process = None
+        self.ready = None
+        self.started_at = None
+        # crashes in a row, reset once the worker stayed up long enough
+        self.restarts = 0
+
+    def __str__(self):
+        return f"worker {self.index} (shards {self.shard_ids})"
+
+    def start(self):
+        self.ready = self.context.Event()
+        self.process = self.context.Process(
+            target=_run_worker,
+            args=(self.shard_ids, self.shard_count, self.ready, self.member_cache),
+            name=f"medieval-worker-{self.index}",
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        log.info("Started %s as pid %s", self, self.process.pid)
+
+    def wait_ready(self, timeout):
+        if self.ready.wait(timeout):
+            log.info("%s is ready", self)
+        else:
+            log.warning("%s not ready after %ss, moving on", self, timeout)
+
+    def stop(self, timeout):
+        if self.process is None or not self.process.is_alive():
+            return
+
+        self.process.terminate()  # SIGTERM: discord.py closes the bot cleanly
+        self.process.join(timeout)
+        if self.process.is_alive():
+            log.warning("%s did not stop after %ss, killing it", self, timeout)
+            self.process.kill()
+            self.process.join()
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def uptime(self):
+        return time.monotonic() - self.started_at
+
+
+class Coordinator:
+    def __init__(
+        self,
+        processes,
+        shard_count,
+        ready_timeout=60,
+        stop_timeout=30,
+        member_cache="full",
+        stable_uptime=600,
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.workers = [
+            Worker(context, index, shard_ids, shard_count, member_cache)
+            for index, shard_ids in enumerate(split_shards(shard_count, processes))
+        ]
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        # seconds after which a worker that exits counts as a first crash again
+        self.stable_uptime = stable_uptime
+        self._running = False
+        self._restart_requested = False
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._request_rolling_restart)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGTERM, self._request_stop)
+
+        self._running = True
+        for worker in self.workers:
+            worker.start()
+            worker.wait_ready(self.ready_timeout)
+
+        try:
+            self._supervise()
+        finally:
+            log.info("Stopping all workers")
+            for worker in self.workers:
+                worker.stop(self.stop_timeout)
+
+    def rolling_restart(self):
+        """Restart the workers one at a time, so only a slice of the guilds is
+        offline at any moment.
+        """
+        for worker in self.workers:
+            if not self._running:
+                return
+            log.info("Rolling restart of %s", worker)
+            worker.stop(self.stop_timeout)
+            worker.start()
+            worker.wait_ready(self.ready_timeout)
+
+    def _supervise(self):
+        while self._running:
+            if self._restart_requested:
+                self._restart_requested = False
+                self.rolling_restart()
+
+            for worker in self.workers:
+                if self._running and not worker.is_alive():
+                    if worker.uptime() >= self.stable_uptime:
+                        worker.restarts = 0
+                    worker.restarts += 1
+                    # back off on repeated crashes, up to a minute
+                    delay = min(60, 2 ** min(worker.restarts, 6))
+                    log.warning(
+                        "%s exited with code %s, restarting in %ss",
+                        worker,
+                        worker.process.exitcode,
+                        delay,
+                    )
+                    time.sleep(delay)
+                    worker.start()
+                    worker.wait_ready(self.ready_timeout)
+
+            time.sleep(1)
+
+    def _request_rolling_restart(self, signum, frame):
+        self._restart_requested = True
+
+    def _request_stop(self, signum, frame):
+        self._running = False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bot over several processes.")
+    parser.add_argument(
+        "-p", "--processes", type=int, default=multiprocessing.cpu_count()
+    )
+    parser.add_argument(
+        "-s",
+        "--shard-count",
+        type=int,
+        default=None,
+        help="total number of shards, defaults to the number of processes",
+    )
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    parser.add_argument(
+        "--member-cache",
+        choices=["full", "active"],
+        default="full",
+        help="cache every member, or only the active members",
+    )
+    args = parser.parse_args(argv)
+
+    shard_count = args.shard_count or args.processes
+    if shard_count < args.processes:
+        parser.error("--shard-count cannot be lower than --processes")
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    Coordinator(
+        args.processes,
+        shard_count,
+        ready_timeout=args.ready_timeout,
+        member_cache=args.member_cache,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import asyncio
+
+import discord
+import pytest
+
+from benchmarks.query_plans import load_cogs
+from bot import create_db_connection
+
+
+async def create_schema(path):
+    """Create the tables of every cog in a new database at `path`."""
+
+    db = await create_db_connection(path)
+    try:
+        bot = await load_cogs(db)
+        # stop the background tasks, the fake bot never gets ready
+        for cog in bot.cogs.values():
+            await discord.utils.maybe_coroutine(cog.cog_unload)
+    finally:
+        await db.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Path of a database with the tables of every cog."""
+
+    path = tmp_path / "bot.db"
+    asyncio.run(create_schema(path))
+    return path
@@ -0,0 +1,121 @@
+import asyncio
+from datetime import datetime, timezone
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from tests.conftest import create_schema
+from utils.backup import (
+    SchemaMissing,
+    export_guilds,
+    export_path,
+    import_files,
+)
+
+GUILD_ID = 1
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def insert_rows(path, guild_id=GUILD_ID, members=(10, 11)):
+    db = sqlite3.connect(path)
+    with db:
+        db.executemany(
+            "INSERT INTO economy_transaction VALUES (?, 'Income', ?, ?, ?)",
+            [(150 * m, guild_id, m, NOW) for m in members],
+        )
+        db.executemany(
+            "INSERT INTO roleplay_experience VALUES (?, ?, ?, 20)",
+            [(guild_id, m, 1000 + m) for m in members],
+        )
+    db.close()
+
+
+def select(path, sql):
+    db = sqlite3.connect(path)
+    try:
+        return sorted(db.execute(sql).fetchall())
+    finally:
+        db.close()
+
+
+def test_round_trip(database, tmp_path):
+    insert_rows(database)
+    written = export_guilds(database, tmp_path / "export")
+    assert written[export_path(tmp_path / "export", "economy_transaction", 1)] == 2
+
+    target = tmp_path / "target.db"
+    asyncio.run(create_schema(target))
+    counts = import_files(target, written)
+    assert sum(counts.values()) == 4
+    assert select(target, "SELECT amount, member_id FROM economy_transaction") == [
+        (1500, 10),
+        (1650, 11),
+    ]
+    assert select(target, "SELECT member_id, xp FROM roleplay_experience") == [
+        (10, 20),
+        (11, 20),
+    ]
+
+
+def test_import_scales_whole_units(database, tmp_path):
+    path = export_path(tmp_path, "economy_transaction", GUILD_ID)
+    with gzip.open(path, "wt") as f:
+        # written before the header, amounts were whole units
+        row = dict(
+            amount=1.5,
+            description="Income",
+            guild_id=GUILD_ID,
+            member_id=10,
+            time=str(NOW),
+        )
+        f.write(json.dumps(row) + "\n")
+
+    import_files(database, [path])
+    assert select(database, "SELECT amount FROM economy_transaction") == [(150,)]
+
+
+def test_import_requires_schema(tmp_path):
+    path = export_path(tmp_path, "economy_transaction", GUILD_ID)
+    target = tmp_path / "new.db"
+
+    with pytest.raises(SchemaMissing):
+        import_files(target, [path])
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_import_rolls_back_the_file(database, tmp_path):
+    insert_rows(database, members=[10])
+    path = export_path(tmp_path, "economy_transaction", GUILD_ID)
+    row = dict(
+        amount=100, description="Income", guild_id=GUILD_ID, member_id=11, time=str(NOW)
+    )
+    with gzip.open(path, "wt") as f:
+        f.write(json.dumps(row) + "\n")
+        f.write(json.dumps({**row, "member_id": None}) + "\n")
+
+    with pytest.raises(sqlite3.IntegrityError):
+        import_files(database, [path], replace=True, batch_size=1)
+    assert select(database, "SELECT member_id FROM economy_transaction") == [(10,)]
+
+
+def test_replace_keeps_the_rollups(database, tmp_path):
+    insert_rows(database)
+    insert_rows(database, members=[10])
+    written = export_guilds(database, tmp_path / "export")
+
+    import_files(database, written, replace=True)
+    import_files(database, written, replace=True)
+
+    # the balances the payroll interest and tax are computed from
+    assert select(
+        database,
+        "SELECT member_id, SUM(income) - SUM(spending), SUM(transactions) "
+        "FROM economy_flow_daily GROUP BY member_id",
+    ) == [(10, 3000, 2), (11, 1650, 1)]
+    assert select(
+        database,
+        "SELECT member_id, SUM(messages), SUM(xp) "
+        "FROM roleplay_activity_daily GROUP BY member_id",
+    ) == [(10, 2, 40), (11, 1, 20)]
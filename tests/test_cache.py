@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from utils.cache import TTLCache, UserProfiles
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_entries():
+    timer = FakeTimer()
+    cache = TTLCache(ttl=10, timer=timer)
+    cache.set("a", 1)
+
+    timer.now = 9.9
+    assert cache.get("a") == 1
+    timer.now = 10
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_ttl_cache_pop():
+    cache = TTLCache()
+    cache.set("a", 1)
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a", 2) == 2
+
+
+class Fetcher:
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, user_id):
+        self.calls += 1
+        await self.release.wait()
+        if user_id < 0:
+            raise LookupError(user_id)
+        return f"user {user_id}"
+
+
+def test_user_profiles_share_concurrent_fetches():
+    async def run():
+        fetch = Fetcher()
+        profiles = UserProfiles(fetch)
+        tasks = [asyncio.ensure_future(profiles.get(1)) for _ in range(3)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+
+        assert await asyncio.gather(*tasks) == ["user 1"] * 3
+        assert await profiles.get(1) == "user 1"
+        assert fetch.calls == 1
+
+        profiles.invalidate(1)
+        assert await profiles.get(1) == "user 1"
+        assert fetch.calls == 2
+
+    asyncio.run(run())
+
+
+def test_user_profiles_cancelled_caller_keeps_fetch():
+    async def run():
+        fetch = Fetcher()
+        profiles = UserProfiles(fetch)
+        cancelled = asyncio.ensure_future(profiles.get(1))
+        waiting = asyncio.ensure_future(profiles.get(1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        fetch.release.set()
+
+        assert await waiting == "user 1"
+        assert fetch.calls == 1
+
+    asyncio.run(run())
+
+
+def test_user_profiles_do_not_cache_errors():
+    async def run():
+        fetch = Fetcher()
+        fetch.release.set()
+        profiles = UserProfiles(fetch)
+
+        with pytest.raises(LookupError):
+            await profiles.get(-1)
+        with pytest.raises(LookupError):
+            await profiles.get(-1)
+        assert fetch.calls == 2
+        assert len(profiles) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,63 @@
+import asyncio
+
+from discord.ext import commands
+import pytest
+
+from utils.money import Money, MoneyConverter
+
+
+@pytest.mark.parametrize(
+    "text, minor",
+    [
+        ("12", 1200),
+        ("12.5", 1250),
+        ("-0.05", -5),
+        ("1,250.75", 125075),
+        ("1e2", 10000),
+        ("92233720368547758.07", Money.max),
+    ],
+)
+def test_parse(text, minor):
+    amount = Money.parse(text)
+    assert amount == minor
+    assert isinstance(amount, Money)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "twelve",
+        "nan",
+        "-inf",
+        "0.001",
+        "1.00000000000000000000000000001",
+        "1e-999999999999",
+        "1e999999999999",
+        "92233720368547758.08",
+    ],
+)
+def test_parse_rejects(text):
+    with pytest.raises(ValueError):
+        Money.parse(text)
+
+
+def test_converter_raises_bad_argument():
+    with pytest.raises(commands.BadArgument):
+        asyncio.run(MoneyConverter().convert(None, "1e999999999999"))
+
+
+def test_arithmetic_keeps_money():
+    total = Money(150) + Money(25) - 5
+    assert total == 170
+    assert isinstance(total, Money)
+    assert isinstance(10 - Money(5), Money)
+    assert isinstance(-Money(5), Money)
+    assert isinstance(abs(Money(-5)), Money)
+
+
+def test_format():
+    assert str(Money(150)) == "1.50"
+    assert str(Money(-5)) == "-0.05"
+    assert f"{Money(100000):>10}" == "   1000.00"
+    assert repr(Money(7)) == "Money(7)"
@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from benchmarks.fakes import FakeContext, FakeMessage
+from benchmarks.query_plans import load_cogs
+from bot import create_db_connection
+from cogs.roleplay import (
+    MAX_NICKNAME_LENGTH,
+    NamesExhausted,
+    RandomMedievalNameGenerator,
+)
+from utils.nicknames import NicknameIndex
+
+
+def member(id, name):
+    return SimpleNamespace(id=id, display_name=name)
+
+
+def test_index_tracks_names_case_insensitively():
+    index = NicknameIndex()
+    assert 1 not in index
+    index.set(1, 10, "Ignored")
+
+    index.build(1, [member(10, "Alice"), member(11, "ALICE"), member(12, "Bob")])
+    assert 1 in index
+    assert "alice" in index.taken(1)
+    assert "ignored" not in index.taken(1)
+
+    # a name stays taken until every member holding it is renamed
+    index.set(1, 10, "Carol")
+    assert "alice" in index.taken(1)
+    index.discard(1, 11)
+    assert "alice" not in index.taken(1)
+    assert "carol" in index.taken(1)
+
+    index.set(1, 12, "bob")
+    assert index.taken(1)["bob"] == 1
+
+    index.drop(1)
+    assert 1 not in index
+    assert "carol" not in index.taken(1)
+
+
+def test_unique_names_avoid_taken_names():
+    taken = {
+        name.casefold()
+        for name in RandomMedievalNameGenerator.unique_full_names_with_title(500)
+    }
+    names = RandomMedievalNameGenerator.unique_full_names_with_title(500, taken)
+
+    assert len(set(names)) == 500
+    assert not taken & {name.casefold() for name in names}
+    assert max(map(len, names)) <= MAX_NICKNAME_LENGTH
+
+
+def test_unique_names_exhausted(monkeypatch):
+    parts = (["Anne", "Bert"], ["York"], ["the Bold"])
+    monkeypatch.setattr(RandomMedievalNameGenerator, "_name_parts", parts)
+
+    assert sorted(RandomMedievalNameGenerator.unique_full_names_with_title(2)) == [
+        "Anne of York, the Bold",
+        "Bert of York, the Bold",
+    ]
+    with pytest.raises(NamesExhausted):
+        RandomMedievalNameGenerator.unique_full_names_with_title(
+            1, {"anne of york, the bold", "bert of york, the bold"}
+        )
+
+
+def test_unique_names_skip_names_too_long(monkeypatch):
+    parts = (["Anne", "Bartholomew"], ["York"], ["the Bold", "the Magnificent"])
+    monkeypatch.setattr(RandomMedievalNameGenerator, "_name_parts", parts)
+
+    # "Bartholomew of York, the Magnificent" is 36 characters long
+    assert sorted(RandomMedievalNameGenerator.unique_full_names_with_title(3)) == [
+        "Anne of York, the Bold",
+        "Anne of York, the Magnificent",
+        "Bartholomew of York, the Bold",
+    ]
+    with pytest.raises(NamesExhausted):
+        RandomMedievalNameGenerator.unique_full_names_with_title(4)
+
+
+async def rename_all(path):
+    db = await create_db_connection(path)
+    try:
+        bot = await load_cogs(db)
+        # stop the background tasks, the fake bot never gets ready
+        for cog in bot.cogs.values():
+            await discord.utils.maybe_coroutine(cog.cog_unload)
+        roleplay = bot.get_cog("Roleplay")
+        guild = bot.add_guild()
+        members = [guild.add_member() for _ in range(3)]
+
+        async def fail(**kwargs):
+            response = SimpleNamespace(status=400, reason="Bad Request")
+            raise discord.HTTPException(response, "Invalid Form Body")
+
+        members[1].edit = fail
+        ctx = FakeContext(bot, FakeMessage(members[0]))
+        await roleplay.rname_all.callback(roleplay, ctx)
+    finally:
+        await db.close()
+
+    return [member.nick for member in members]
+
+
+def test_rename_all_skips_failed_members(tmp_path):
+    nicks = asyncio.run(rename_all(tmp_path / "bot.db"))
+
+    assert nicks[0] and nicks[2]
+    assert nicks[1] is None
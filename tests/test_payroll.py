@@ -0,0 +1,112 @@
+import asyncio
+from datetime import timedelta
+
+import discord
+
+from benchmarks.fakes import FakeContext, FakeMessage
+from benchmarks.query_plans import load_cogs
+from bot import create_db_connection
+from utils.money import Money
+
+
+async def fetch(db, sql, params=()):
+    async with db.execute(sql, params) as c:
+        return [tuple(row) for row in await c.fetchall()]
+
+
+async def run_payrolls(path):
+    db = await create_db_connection(path)
+    try:
+        bot = await load_cogs(db)
+        economy, payroll = bot.get_cog("Economy"), bot.get_cog("Payroll")
+        payroll.cog_unload()
+
+        guild = bot.add_guild()
+        members = rich, poor, serf = [guild.add_member() for _ in range(3)]
+        role = guild.add_role("Serf")
+        serf.roles.append(role)
+        now = discord.utils.utcnow()
+        # a debt, which neither the interest nor the tax touch
+        await db.execute(
+            "INSERT INTO economy_transaction VALUES (-500, 'Debt', ?, ?, ?)",
+            (guild.id, poor.id, now),
+        )
+        await db.commit()
+        await economy.warm_cache()
+        await economy.grant_money(Money(10_000), rich)
+
+        ctx = FakeContext(bot, FakeMessage(rich))
+        await payroll._add_payroll(ctx, "wage", "Wages", Money(1_000), 24, role.id)
+        await payroll._add_payroll(ctx, "interest", "Interest", 0.1, 24)
+        await payroll._add_payroll(ctx, "tax", "Tax", -0.5, 24)
+
+        first_run = now - timedelta(hours=36)
+        await db.execute("UPDATE economy_payroll SET next_run = ?", (first_run,))
+        await db.commit()
+        # the first wage was paid right before a crash, it is not paid twice
+        (wage, *_) = await fetch(db, "SELECT * FROM economy_payroll")
+        wage = dict(payroll_id=wage[0], kind="wage", role_id=role.id)
+        await payroll._run(wage, guild, first_run)
+        await payroll.run_due(now)
+
+        cached = [await economy._get_balance(member) for member in members]
+        ledger = [
+            (
+                await fetch(
+                    db,
+                    "SELECT SUM(amount) FROM economy_transaction WHERE member_id = ?",
+                    (member.id,),
+                )
+            )[0][0]
+            for member in members
+        ]
+        runs = await fetch(db, "SELECT * FROM economy_payroll_run")
+    finally:
+        await db.close()
+
+    return cached, ledger, runs
+
+
+def test_payroll_runs(tmp_path):
+    cached, ledger, runs = asyncio.run(run_payrolls(tmp_path / "bot.db"))
+
+    # two runs of each payroll, the wages, the interests then the taxes:
+    # 10000 * 1.1 ** 2 * 0.5 ** 2 and 2000 * 1.1 ** 2 * 0.5 ** 2
+    assert ledger == [3_025, -500, 605]
+    assert cached == ledger
+    # the runs before the next ones are pruned
+    assert runs == []
+
+
+async def run_empty_wage(path):
+    db = await create_db_connection(path)
+    try:
+        bot = await load_cogs(db)
+        economy, payroll = bot.get_cog("Economy"), bot.get_cog("Payroll")
+        payroll.cog_unload()
+        await economy.warm_cache()
+
+        # a guild without ledger rows, and a role nobody has
+        guild = bot.add_guild()
+        owner = guild.add_member()
+        role = guild.add_role("Deserted")
+        ctx = FakeContext(bot, FakeMessage(owner))
+        await payroll._add_payroll(ctx, "wage", "Wages", Money(1_000), 24, role.id)
+
+        (wage, *_) = await fetch(db, "SELECT * FROM economy_payroll")
+        wage = dict(payroll_id=wage[0], kind="wage", role_id=role.id)
+        await payroll._run(wage, guild, discord.utils.utcnow())
+
+        balance = await economy._get_balance(owner)
+        runs = await fetch(db, "SELECT payroll_id FROM economy_payroll_run")
+    finally:
+        await db.close()
+
+    return balance, runs
+
+
+def test_wage_run_paying_nobody(tmp_path):
+    balance, runs = asyncio.run(run_empty_wage(tmp_path / "bot.db"))
+
+    assert balance == 0
+    assert len(runs) == 1
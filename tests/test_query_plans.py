@@ -0,0 +1,23 @@
+import asyncio
+
+from benchmarks.query_plans import build, check_all, parse_args
+
+
+def test_query_plans(tmp_path):
+    """Every registered statement uses its indexes and stays within its budget
+    on the synthetic database of `python -m benchmarks.query_plans`.
+    """
+    args = parse_args(["--repeat", "5"])
+    path = tmp_path / "bot.db"
+    params = asyncio.run(build(path, args))
+
+    results = check_all(path, params, args.repeat)
+    failures = {
+        name: failures + [f"| {detail}" for detail in plan]
+        for name, (plan, latency, failures) in results.items()
+        if failures
+    }
+    assert "economy.transactions" in results
+    assert any(name.startswith("retention.delete.") for name in results)
+    assert "cascade.roleplay_experience_archive.member" in results
+    assert failures == {}
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+from utils.ranking import IndexableSkipList, Ranking
+from utils.store import MemberStore
+
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(0)
+    # the values are tuples, like the (-score, member ID) keys of Ranking
+    values = [(value,) for value in rng.sample(range(10_000), 500)]
+    skip_list = IndexableSkipList(values[:250])
+    expected = sorted(values[:250])
+
+    for value in values[250:]:
+        skip_list.insert(value)
+        expected.append(value)
+    for value in rng.sample(values, 200):
+        skip_list.remove(value)
+        expected.remove(value)
+    expected.sort()
+
+    assert len(skip_list) == len(expected)
+    assert list(skip_list) == expected
+    assert list(skip_list.iter_from(100)) == expected[100:]
+    for index in rng.sample(range(len(expected)), 50):
+        assert skip_list[index] == expected[index]
+        assert skip_list.index(expected[index]) == index
+
+
+def test_skip_list_missing_values():
+    skip_list = IndexableSkipList([(1,), (2,), (3,)])
+
+    with pytest.raises(ValueError):
+        skip_list.index((4,))
+    with pytest.raises(ValueError):
+        skip_list.remove((4,))
+    with pytest.raises(IndexError):
+        skip_list[3]
+    assert list(skip_list.iter_from(3)) == []
+
+
+def test_ranking_orders_by_score_then_member():
+    ranking = Ranking({1: 50, 2: 80, 3: 50, 4: 0})
+
+    assert len(ranking) == 3
+    assert ranking.top() == [(2, 80), (1, 50), (3, 50)]
+    assert ranking.top(limit=1, offset=1) == [(1, 50)]
+    assert [ranking.rank(m) for m in (1, 2, 3, 4)] == [2, 1, 3, None]
+
+
+def test_ranking_updates():
+    ranking = Ranking({1: 50, 2: 80})
+
+    ranking.add(1, 40)
+    ranking.add(3, 10)
+    assert ranking.top() == [(1, 90), (2, 80), (3, 10)]
+    assert ranking.score(1) == 90
+
+    # members without a positive score are not ranked
+    ranking.set(2, 0)
+    assert ranking.rank(2) is None
+    assert ranking.score(2) == 0
+    assert ranking.top() == [(1, 90), (3, 10)]
+
+
+def test_ranking_matches_a_sort():
+    rng = random.Random(0)
+    ranking = Ranking()
+    scores = {}
+    for _ in range(2_000):
+        member_id = rng.randrange(200)
+        amount = rng.randint(-20, 50)
+        ranking.add(member_id, amount)
+        scores[member_id] = max(scores.get(member_id, 0) + amount, 0)
+
+    expected = sorted(
+        ((m, s) for m, s in scores.items() if s > 0), key=lambda p: (-p[1], p[0])
+    )
+    assert ranking.top(len(expected)) == expected
+    for position, (member_id, _) in enumerate(expected, 1):
+        assert ranking.rank(member_id) == position
+
+
+def test_ranking_keeps_its_scores_in_a_store_column():
+    store = MemberStore()
+    store.add_column("experience", "q")
+    store.load(1, "experience", [10, 20, 30], [50, 80, 0])
+    ranking = Ranking(store.column(1, "experience"))
+
+    ranking.add(10, 40)
+    ranking.add(40, 5)
+    ranking.set(20, 0)
+
+    assert ranking.top() == [(10, 90), (40, 5)]
+    assert store.items(1, "experience") == [(10, 90), (40, 5)]
+    # the members without a field left are removed
+    assert len(store) == 2
@@ -0,0 +1,51 @@
+import asyncio
+
+from bot import create_db_connection
+from utils import registry
+
+
+async def fetch(db, sql):
+    async with db.execute(sql) as c:
+        return sorted(tuple(row) for row in await c.fetchall())
+
+
+async def rebuild(path):
+    db = await create_db_connection(path)
+    try:
+        # a table created before the registry existed, without a foreign key
+        await db.execute(
+            "CREATE TABLE legacy(guild_id INTEGER, member_id INTEGER, value TEXT)"
+        )
+        await db.executemany(
+            "INSERT INTO legacy VALUES (?, ?, ?)",
+            [(1, 10, "a"), (1, 11, "b"), (2, 10, "c")],
+        )
+        await registry.register_table(db, "legacy", "member")
+        await db.commit()
+
+        foreign_keys = await fetch(db, "PRAGMA foreign_key_list(legacy)")
+        rows = await fetch(db, "SELECT * FROM legacy")
+        members = await fetch(db, "SELECT guild_id, member_id FROM registry_member")
+
+        # new rows are registered, and purged rows cascade
+        await db.execute("INSERT INTO legacy VALUES (3, 12, 'd')")
+        await db.execute("DELETE FROM registry_member WHERE member_id = 10")
+        await db.execute("DELETE FROM registry_guild WHERE guild_id = 3")
+        await db.commit()
+        remaining = await fetch(db, "SELECT * FROM legacy")
+    finally:
+        await db.close()
+
+    return foreign_keys, rows, members, remaining
+
+
+def test_register_table_rebuilds_with_foreign_key(tmp_path, monkeypatch):
+    # the retention purge deletes from every registered table
+    monkeypatch.setattr(registry, "TABLES", {})
+    foreign_keys, rows, members, remaining = asyncio.run(rebuild(tmp_path / "bot.db"))
+
+    assert {key[2] for key in foreign_keys} == {"registry_member"}
+    assert rows == [(1, 10, "a"), (1, 11, "b"), (2, 10, "c")]
+    assert members == [(1, 10), (1, 11), (2, 10)]
+    assert remaining == [(1, 11, "b")]
+    assert registry.TABLES["legacy"] == ("member", "rowid")
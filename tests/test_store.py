@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+from utils.store import MemberStore
+
+
+@pytest.fixture
+def store():
+    store = MemberStore()
+    store.add_column("balance", "q")
+    store.add_column("last_message", "d")
+    return store
+
+
+def test_get_set_add(store):
+    assert store.get(1, 10, "balance") == 0
+    assert store.get(1, 10, "balance", None) is None
+
+    store.set(1, 30, balance=5)
+    store.set(1, 10, balance=7, last_message=1.5)
+    assert store.add(1, 20, "balance", 3) == 3
+    assert store.add(1, 10, "balance", -2) == 5
+
+    assert store.get(1, 10, "balance") == 5
+    assert store.get(1, 10, "last_message") == 1.5
+    assert store.has(1, 30, "balance")
+    assert not store.has(1, 30, "last_message")
+    assert not store.has(2, 30, "balance")
+    assert store.items(1, "balance") == [(10, 5), (20, 3), (30, 5)]
+    assert len(store) == 3
+
+
+def test_unset_removes_members_without_fields(store):
+    store.set(1, 10, balance=7, last_message=1.5)
+
+    store.unset(1, 10, "balance")
+    assert not store.has(1, 10, "balance")
+    assert store.get(1, 10, "last_message") == 1.5
+    assert len(store) == 1
+
+    store.unset(1, 10, "last_message")
+    store.unset(1, 20, "balance")
+    assert len(store) == 0
+
+
+def test_add_column_keeps_values(store):
+    store.set(1, 10, balance=7)
+    store.add_column("balance", "q")
+    store.add_column("experience", "q")
+
+    assert store.get(1, 10, "balance") == 7
+    assert not store.has(1, 10, "experience")
+    with pytest.raises(ValueError):
+        store.add_column("balance", "d")
+
+
+def test_add_many(store):
+    store.set(1, 20, balance=5)
+
+    # a member listed twice gets both amounts
+    store.add_many(1, [30, 20, 10, 30], "balance", [1, 2, 3, 4])
+
+    assert store.items(1, "balance") == [(10, 3), (20, 7), (30, 5)]
+
+
+def test_add_many_nobody_in_a_new_guild(store):
+    store.add_many(1, [], "balance", [])
+
+    assert store.items(1, "balance") == []
+    assert len(store) == 0
+
+
+def test_load_replaces_the_field_of_the_guild(store):
+    store.set(1, 10, balance=7, last_message=1.5)
+    store.set(1, 20, balance=3)
+    store.set(2, 10, balance=9)
+
+    store.load(1, "balance", [30, 10], [4, 8])
+
+    assert store.items(1, "balance") == [(10, 8), (30, 4)]
+    assert store.get(1, 10, "last_message") == 1.5
+    # member 20 had no other field
+    assert len(store) == 3
+    assert store.items(2, "balance") == [(10, 9)]
+
+
+def test_clear(store):
+    store.set(1, 10, balance=7, last_message=1.5)
+    store.set(2, 20, balance=3)
+
+    store.clear("balance", [1, 3])
+    assert store.items(1, "balance") == []
+    assert store.get(1, 10, "last_message") == 1.5
+    assert store.items(2, "balance") == [(20, 3)]
+
+    store.clear("balance")
+    assert len(store) == 1
+
+
+def test_top_orders_by_value_then_member(store):
+    store.load(1, "balance", [40, 10, 30, 20], [5, 8, 5, 5])
+    store.set(1, 50, last_message=1.5)
+
+    assert store.top(1, "balance", 3) == [(10, 8), (20, 5), (30, 5)]
+    assert store.top(1, "balance", 10) == [(10, 8), (20, 5), (30, 5), (40, 5)]
+    assert store.top(1, "balance", 0) == []
+    assert store.top(2, "balance") == []
+
+
+def test_top_matches_a_sort(store):
+    rng = np.random.default_rng(0)
+    member_ids = rng.choice(10_000, 1_000, replace=False)
+    balances = rng.integers(0, 50, 1_000)
+    store.load(1, "balance", member_ids, balances)
+
+    pairs = zip(member_ids.tolist(), balances.tolist())
+    expected = sorted(pairs, key=lambda pair: (-pair[1], pair[0]))
+    assert store.top(1, "balance", 25) == expected[:25]
+
+
+def test_histogram(store):
+    store.load(1, "balance", [10, 20, 30, 40, 50], [-1, 0, 99, 100, 1_000])
+    store.set(1, 60, last_message=1.5)
+
+    assert store.histogram(1, "balance", [0, 100, 220]).tolist() == [2, 1, 1]
+    assert store.histogram(2, "balance", [0, 100]).tolist() == [0, 0]
+
+
+def test_column_view(store):
+    column = store.column(1, "balance")
+    column[10] = 4
+    store.set(1, 20, last_message=1.5)
+
+    assert 10 in column and 20 not in column
+    assert column[10] == 4 and column.get(20) is None
+    with pytest.raises(KeyError):
+        column[20]
+    assert len(column) == 1
+    assert column.pop(10) == 4 and column.pop(10) is None
+    assert len(store) == 1
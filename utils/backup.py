@@ -0,0 +1,367 @@
+"""Stream the economy and experience data in and out of the database.
+
+Exports are written per guild and table as gzip-compressed NDJSON, one row per
+line, and read the database through a read-only connection. In WAL mode this
+never blocks the bot, and the export sees a consistent snapshot of the tables.
+The first line of a file is a header with the format version and the unit of the
+amounts of money, which are scaled to the unit of the database on import. Files
+without a header predate it, and their amounts are whole units.
+
+    python -m utils.backup export bot.db backups/ [--guild ID ...]
+    python -m utils.backup import bot.db backups/*.ndjson.gz [--replace]
+
+Exports run without downtime, imports do not. The cogs cache balances,
+experience totals and rankings, which rows imported behind their back would
+contradict, and reloading those caches while the bot keeps writing would race
+with its own updates. So importing into the database of a running bot is refused:
+stop the bot, import, then start it again. To keep the downtime short, import
+into a new database while the bot still runs on the old one, then restart the bot
+on the new database. The rows written after the export are not carried over. The
+tables are created
+by the bot, so a new database must have been opened by the bot once before an
+import. Each file is imported in a single transaction, a failed file leaves the
+database as it was. With `--replace`, the daily rollups of the replaced rows are
+updated in the same transaction.
+"""
+import argparse
+import fcntl
+import gzip
+import itertools
+import json
+from pathlib import Path
+import sqlite3
+import time
+
+from utils.money import Money
+
+# in import order: the archive has no registration trigger, its members are
+# registered by the summary rows of the same seasons
+EXPORT_TABLES = (
+    "economy_transaction",
+    "roleplay_experience",
+    "roleplay_season",
+    "roleplay_season_summary",
+    "roleplay_experience_archive",
+)
+SUFFIX = ".ndjson.gz"
+FORMAT_VERSION = 2
+# columns holding amounts of money, in minor units of `Money.scale` per unit
+MONEY_COLUMNS = {"economy_transaction": ("amount",)}
+# daily rollups kept by the insert triggers of the cogs, which do not handle
+# deletes: a season rollover deletes the experience of the season but keeps its
+# activity. A replace first subtracts the guild's rows from them, or the rows
+# inserted again would count twice. The days are computed like in the triggers.
+ROLLUP_UNDO_SQL = {
+    "economy_transaction": (
+        """
+        UPDATE economy_flow_daily AS f
+           SET income = f.income - d.income,
+               spending = f.spending - d.spending,
+               transactions = f.transactions - d.transactions
+          FROM (SELECT substr(time, 1, 10) AS day,
+                       member_id,
+                       SUM(max(amount, 0)) AS income,
+                       SUM(max(-amount, 0)) AS spending,
+                       COUNT(*) AS transactions
+                  FROM economy_transaction
+                 WHERE guild_id = :guild_id
+                 GROUP BY day, member_id) AS d
+         WHERE f.guild_id = :guild_id
+           AND f.day = d.day
+           AND f.member_id = d.member_id
+        """,
+        """
+        DELETE FROM economy_flow_daily
+         WHERE guild_id = :guild_id
+           AND transactions <= 0
+        """,
+    ),
+    "roleplay_experience": (
+        # the UTC day of the message ID, see `_SNOWFLAKE_DAY_SQL` in cogs.roleplay
+        """
+        UPDATE roleplay_activity_daily AS a
+           SET messages = a.messages - d.messages,
+               xp = a.xp - d.xp
+          FROM (SELECT date(((message_id >> 22) + 1420070400000) / 1000,
+                            'unixepoch') AS day,
+                       member_id,
+                       COUNT(*) AS messages,
+                       SUM(xp) AS xp
+                  FROM roleplay_experience
+                 WHERE guild_id = :guild_id
+                 GROUP BY day, member_id) AS d
+         WHERE a.guild_id = :guild_id
+           AND a.day = d.day
+           AND a.member_id = d.member_id
+        """,
+        """
+        DELETE FROM roleplay_activity_daily
+         WHERE guild_id = :guild_id
+           AND messages <= 0
+        """,
+    ),
+}
+
+
+class DatabaseInUse(Exception):
+    """Raised when the database is locked in a conflicting mode."""
+
+
+class SchemaMissing(Exception):
+    """Raised when importing into a database without the tables of the bot."""
+
+
+def lock_database(db_path, shared=True):
+    """Lock the database against imports and return the lock file, closing it
+    releases the lock. Each bot process holds a shared lock while it runs and an
+    import holds an exclusive one, so neither starts while the other runs.
+    """
+    lock = open(f"{Path(db_path).resolve()}.lock", "a")
+    try:
+        fcntl.flock(lock, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise DatabaseInUse(
+            f"{db_path} is in use by "
+            + ("an import" if shared else "a running bot, stop it before importing")
+        ) from None
+    return lock
+
+
+def connect_read_only(db_path):
+    return sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+
+
+def export_path(directory, table, guild_id):
+    return Path(directory) / f"{table}-{guild_id}{SUFFIX}"
+
+
+def parse_export_path(path):
+    """Return the table and guild ID encoded in an export file name."""
+
+    table, _, guild_id = Path(path).name[: -len(SUFFIX)].rpartition("-")
+    if table not in EXPORT_TABLES or not guild_id.isdigit():
+        raise ValueError(f"{path} is not an export file")
+    return table, int(guild_id)
+
+
+def export_guilds(db_path, directory, guild_ids=None, chunk_size=10_000):
+    """Export the tables of the given guilds, or of every guild, to `directory`.
+    Return the written paths with their row counts.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    db = connect_read_only(db_path)
+    try:
+        # one read transaction, so every file comes from the same snapshot
+        db.execute("BEGIN")
+        if guild_ids is None:
+            guild_ids = sorted(
+                {
+                    row[0]
+                    for table in EXPORT_TABLES
+                    for row in db.execute(f"SELECT DISTINCT guild_id FROM {table}")
+                }
+            )
+
+        written = {}
+        for guild_id in guild_ids:
+            for table in EXPORT_TABLES:
+                path = export_path(directory, table, guild_id)
+                written[path] = _export_table(db, table, guild_id, path, chunk_size)
+    finally:
+        db.close()
+
+    return written
+
+
+def _export_table(db, table, guild_id, path, chunk_size):
+    cursor = db.execute(f"SELECT * FROM {table} WHERE guild_id = ?", (guild_id,))
+    columns = [column[0] for column in cursor.description]
+
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        header = {"version": FORMAT_VERSION, "money_scale": Money.scale}
+        f.write(json.dumps({"_export": header}) + "\n")
+        while rows := cursor.fetchmany(chunk_size):
+            f.writelines(
+                json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n"
+                for row in rows
+            )
+            count += len(rows)
+
+    return count
+
+
+def import_files(db_path, paths, replace=False, batch_size=100_000):
+    """Bulk insert export files into the database, one transaction per file,
+    inserted `batch_size` rows at a time. With `replace`, the guild's existing
+    rows are deleted in the same transaction.
+    Return the imported row count per path.
+
+    Raise SchemaMissing if the bot never created its tables in the database, and
+    DatabaseInUse if a bot is running on the database.
+    """
+    paths = sorted(
+        map(Path, paths),
+        key=lambda path: EXPORT_TABLES.index(parse_export_path(path)[0]),
+    )
+    # checked before the lock, so that a wrong path leaves no file behind
+    _check_schema(db_path, {parse_export_path(path)[0] for path in paths})
+
+    lock = lock_database(db_path, shared=False)
+    db = sqlite3.connect(db_path, isolation_level=None)
+    db.execute("PRAGMA busy_timeout = 5000")
+    db.execute("PRAGMA foreign_keys = ON")
+    try:
+        return {path: _import_file(db, path, replace, batch_size) for path in paths}
+    finally:
+        db.close()
+        lock.close()
+
+
+def _check_schema(db_path, tables):
+    message = (
+        f"{db_path} does not have the tables of the bot, start the bot on it once "
+        "to create them"
+    )
+    if not Path(db_path).is_file():
+        raise SchemaMissing(message)
+
+    db = connect_read_only(db_path)
+    try:
+        existing = {
+            row[0]
+            for row in db.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        }
+    finally:
+        db.close()
+    if not tables <= existing:
+        raise SchemaMissing(message)
+
+
+def _import_file(db, path, replace, batch_size):
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        count = _insert_file(db, path, replace, batch_size)
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+
+    db.execute("COMMIT")
+    return count
+
+
+def _insert_file(db, path, replace, batch_size):
+    table, guild_id = parse_export_path(path)
+    table_columns = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+    count = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        f, money_scale = _read_header(f, path)
+        batch, statement = [], None
+        if replace:
+            for sql in ROLLUP_UNDO_SQL.get(table, ()):
+                db.execute(sql, dict(guild_id=guild_id))
+            db.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,))
+
+        for line in f:
+            record = json.loads(line)
+            if statement is None:
+                columns = list(record)
+                unknown = set(columns) - table_columns
+                if unknown:
+                    raise ValueError(f"{path}: unknown columns {sorted(unknown)}")
+                values = [
+                    _money_value(c, money_scale)
+                    if c in MONEY_COLUMNS.get(table, ())
+                    else f":{c}"
+                    for c in columns
+                ]
+                statement = (
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(values)})"
+                )
+
+            batch.append(record)
+            if len(batch) >= batch_size:
+                db.executemany(statement, batch)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            db.executemany(statement, batch)
+            count += len(batch)
+
+    return count
+
+
+def _read_header(f, path):
+    """Return the lines of the file after its header, and the minor units per
+    unit of its amounts of money.
+    """
+    first = f.readline()
+    header = json.loads(first).get("_export") if first else None
+    if header is None:
+        # written before the header, when amounts were REAL whole units
+        return itertools.chain([first] if first else [], f), 1
+
+    if header["version"] > FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported format version {header['version']}")
+    money_scale = header["money_scale"]
+    if not isinstance(money_scale, int) or money_scale <= 0:
+        raise ValueError(f"{path}: invalid money scale {money_scale!r}")
+    return f, money_scale
+
+
+def _money_value(column, money_scale):
+    """Return the SQL expression inserting an amount of the export's unit."""
+
+    if money_scale == Money.scale:
+        return f":{column}"
+    # rounded like the REAL to INTEGER migration of the ledger
+    return f"CAST(round(:{column} * {Money.scale} / {money_scale}.0) AS INTEGER)"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import bot data.")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    export = subparsers.add_parser("export")
+    export.add_argument("database")
+    export.add_argument("directory")
+    export.add_argument("--guild", type=int, action="append", dest="guild_ids")
+    export.add_argument("--chunk-size", type=int, default=10_000)
+
+    import_ = subparsers.add_parser("import")
+    import_.add_argument("database")
+    import_.add_argument("files", nargs="+")
+    import_.add_argument("--replace", action="store_true")
+    import_.add_argument("--batch-size", type=int, default=100_000)
+
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.action == "export":
+        counts = export_guilds(
+            args.database, args.directory, args.guild_ids, args.chunk_size
+        )
+    else:
+        try:
+            counts = import_files(
+                args.database, args.files, args.replace, args.batch_size
+            )
+        except (DatabaseInUse, SchemaMissing) as error:
+            parser.exit(1, f"{error}\n")
+
+    for path, count in counts.items():
+        print(f"{path}: {count} rows")
+    print(
+        f"{sum(counts.values())} rows in {len(counts)} files, "
+        f"{time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
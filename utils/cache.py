@@ -0,0 +1,88 @@
+import asyncio
+from collections import OrderedDict
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Mapping whose entries expire `ttl` seconds after being set.
+    When full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        try:
+            expires_at, value = self._data[key]
+        except KeyError:
+            return default
+
+        if expires_at <= self._timer():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (self._timer() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        expires_at, value = self._data.pop(key, (None, default))
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+
+class UserProfiles:
+    """Cache of `fetch_user` results.
+    `fetch_user` is an API round-trip, but the profile fields it is used for, like
+    `accent_color`, rarely change. Concurrent lookups of the same user share a
+    single request.
+    """
+
+    def __init__(self, fetch_user, *, ttl=600.0, maxsize=10_000):
+        self._fetch_user = fetch_user
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._cache)
+
+    async def get(self, user_id):
+        user = self._cache.get(user_id)
+        if user is not None:
+            return user
+
+        task = self._pending.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(user_id))
+            self._pending[user_id] = task
+        # a cancelled caller must not cancel the request for the others
+        return await asyncio.shield(task)
+
+    async def _fetch(self, user_id):
+        try:
+            user = await self._fetch_user(user_id)
+        finally:
+            del self._pending[user_id]
+        self._cache.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id)
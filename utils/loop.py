@@ -0,0 +1,124 @@
+import asyncio
+from collections import deque
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+
+log = logging.getLogger(__name__)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run CPU-bound work such as formatting, aggregation or rendering in the
+    default executor, so the event loop keeps serving other events meanwhile.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class LagMonitor:
+    """Measure how late the event loop wakes up from a sleep.
+    Any delay is time the loop spent running other callbacks without yielding.
+    Samples above `budget` seconds are counted and logged.
+
+    A running callback cannot be interrupted, so the budget is enforced by
+    catching its offenders: a watchdog thread notices when the loop is blocked
+    for longer than the budget, and logs the stack of the code blocking it while
+    it still runs, which is the code to move to `run_blocking`.
+    """
+
+    def __init__(self, budget=0.1, interval=0.5, window=240):
+        self.budget = budget
+        self.interval = interval
+        self._samples = deque(maxlen=window)
+        self.over_budget = 0
+        self._task = None
+        self._last_warning = 0.0
+        # monotonic time the loop last went to sleep in `_run`
+        self._heartbeat = None
+        self._loop_thread = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+        self._last_stack = 0.0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+        if self._watchdog is None:
+            self._loop_thread = threading.get_ident()
+            self._stopped.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, name="lag-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._stopped.set()
+            self._watchdog.join()
+            self._watchdog = None
+            self._heartbeat = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.record(loop.time() - start - self.interval)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.budget / 2):
+            heartbeat = self._heartbeat
+            if heartbeat is None or heartbeat == reported:
+                continue
+            if time.monotonic() - heartbeat <= self.interval + self.budget:
+                continue
+
+            # the loop should have woken up by now: report this stall once
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            now = time.monotonic()
+            if frame is None or now - self._last_stack <= 60:
+                continue
+            self._last_stack = now
+            log.warning(
+                "Event loop blocked over its %.0fms budget in:\n%s",
+                self.budget * 1000,
+                "".join(traceback.format_stack(frame)),
+            )
+
+    def record(self, lag):
+        self._samples.append(lag)
+        if lag <= self.budget:
+            return
+
+        self.over_budget += 1
+        now = time.monotonic()
+        if now - self._last_warning > 60:  # at most one warning per minute
+            self._last_warning = now
+            log.warning(
+                "Event loop lag of %.0fms exceeds the %.0fms budget "
+                "(%d times so far)",
+                lag * 1000,
+                self.budget * 1000,
+                self.over_budget,
+            )
+
+    def stats(self):
+        samples = sorted(self._samples)
+        if not samples:
+            return dict(current=0.0, p99=0.0, max=0.0, over_budget=0)
+
+        return dict(
+            current=self._samples[-1],
+            p99=samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            max=samples[-1],
+            over_budget=self.over_budget,
+        )
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import resource
+import time
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+def max_rss_mib():
+    """Peak resident memory of this process, ru_maxrss is in KiB on Linux."""
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _set_cached(member, cached):
+    """Add the member to the member cache of its guild, or remove it from it.
+    discord.py has no public API to cache a member it already has, such as the
+    author of a message, or to evict one. These private Guild methods are the ones
+    the library's own member events use, and this is their only caller.
+    """
+    if cached:
+        member.guild._add_member(member)
+    else:
+        member.guild._remove_member(member)
+
+
+class MemberCachePolicy:
+    """Keep only the active members in the member cache.
+    Members in a voice channel are cached by the library, members who send a
+    message are cached until they are idle for `max_idle` seconds, and members with
+    one of `keep_roles` stay cached while they hold the role. Guilds are not
+    chunked at startup, use `MedievalBot.get_guild_members` when every member is
+    needed: the role holders of a guild are cached from the member lists it
+    fetches, so nothing is requested for them before a guild's members are needed.
+    """
+
+    # the library's own cache policy, passed to the bot as `member_cache_flags`
+    flags = discord.MemberCacheFlags(voice=True, joined=False)
+
+    def __init__(
+        self, bot, *, max_idle=3600.0, keep_roles=("Plague",), interval=300.0
+    ):
+        self.bot = bot
+        self.max_idle = max_idle
+        self.keep_roles = frozenset(keep_roles)
+        self.interval = interval
+
+        # (guild ID, member ID) -> monotonic time of the last activity
+        self._last_seen = {}
+        self._task = None
+
+    def touch(self, member: discord.Member):
+        """Record the activity of the member and make sure it is cached."""
+
+        guild = member.guild
+        if guild.get_member(member.id) is None:
+            _set_cached(member, True)
+        self._last_seen[(guild.id, member.id)] = time.monotonic()
+
+    def cache_kept_members(self, members):
+        """Cache the members of a fetched member list holding one of
+        `keep_roles`.
+        """
+        for member in members:
+            if member.guild.get_member(member.id) is None and self._keeps(member):
+                _set_cached(member, True)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._sweep_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return dict(
+            cached=sum(len(guild.members) for guild in self.bot.guilds),
+            total=sum(guild.member_count or 0 for guild in self.bot.guilds),
+            active=len(self._last_seen),
+        )
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("Failed to sweep the member cache")
+
+    def sweep(self):
+        """Evict the members idle for more than `max_idle` seconds."""
+
+        deadline = time.monotonic() - self.max_idle
+        idle = [key for key, seen in self._last_seen.items() if seen <= deadline]
+        evicted = 0
+        for guild_id, member_id in idle:
+            del self._last_seen[(guild_id, member_id)]
+            guild = self.bot.get_guild(guild_id)
+            member = guild and guild.get_member(member_id)
+            if member is None or not self._evictable(member):
+                continue
+
+            _set_cached(member, False)
+            evicted += 1
+
+        if evicted:
+            log.info("Evicted %d idle members from the cache", evicted)
+        return evicted
+
+    def _evictable(self, member):
+        return not (
+            member.id == member.guild.me.id
+            or member.voice is not None
+            or self._keeps(member)
+        )
+
+    def _keeps(self, member):
+        return any(role.name in self.keep_roles for role in member.roles)
@@ -0,0 +1,96 @@
+"""Amounts of money as exact integers of minor units.
+
+The ledger stores amounts as INTEGER cents, so balances are integer sums in SQLite
+and in Python alike, and never drift like sums of floats.
+"""
+from decimal import Decimal, DecimalException, Inexact, InvalidOperation, localcontext
+
+from discord.ext import commands
+
+
+class Money(int):
+    """An amount of money, in minor units: `Money(150)` is 1.50.
+    Sums and differences of Money are Money, and it formats as a decimal amount.
+    Being an int, it is bound to SQLite queries as an INTEGER.
+    """
+
+    __slots__ = ()
+
+    # minor units per unit, and their number of decimal digits
+    scale = 100
+    digits = 2
+    # largest amount in minor units, SQLite integers are 64-bit
+    max = 2**63 - 1
+
+    @classmethod
+    def parse(cls, text):
+        """Parse a decimal amount such as "12", "12.5" or "1,250.75"."""
+
+        try:
+            value = Decimal(text.replace(",", ""))
+        except InvalidOperation:
+            raise ValueError(f"{text!r} is not an amount of money.") from None
+
+        # NaN and infinities would raise or poison the arithmetic below
+        if not value.is_finite():
+            raise ValueError(f"{text!r} is not an amount of money.")
+        # checked before any arithmetic, which a huge exponent would overflow
+        if value.adjusted() >= len(str(cls.max)):
+            raise ValueError(f"{text!r} is too large an amount of money.")
+
+        try:
+            with localcontext() as context:
+                # rounding would drop decimals, e.g. of a tiny exponent
+                context.traps[Inexact] = True
+                minor = value.scaleb(cls.digits)
+        except DecimalException:
+            minor = None
+        if minor is None or minor != minor.to_integral_value():
+            raise ValueError(
+                f"{text!r} is not an amount of money with up to {cls.digits} decimals."
+            )
+        if abs(minor) > cls.max:
+            raise ValueError(f"{text!r} is too large an amount of money.")
+        return cls(minor)
+
+    def __add__(self, other):
+        result = int.__add__(self, other)
+        return result if result is NotImplemented else Money(result)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        result = int.__sub__(self, other)
+        return result if result is NotImplemented else Money(result)
+
+    def __rsub__(self, other):
+        result = int.__rsub__(self, other)
+        return result if result is NotImplemented else Money(result)
+
+    def __neg__(self):
+        return Money(-int(self))
+
+    def __abs__(self):
+        return Money(abs(int(self)))
+
+    def __str__(self):
+        units, minor = divmod(abs(int(self)), self.scale)
+        sign = "-" if self < 0 else ""
+        return f"{sign}{units}.{minor:0{self.digits}}"
+
+    def __format__(self, spec):
+        # alignment and width only, the decimals are fixed
+        return format(str(self), spec)
+
+    def __repr__(self):
+        return f"Money({int(self)})"
+
+
+class MoneyConverter(commands.Converter):
+    """Convert a command argument such as "12.50" to Money."""
+
+    async def convert(self, ctx, argument):
+        try:
+            return Money.parse(argument)
+        except ValueError as error:
+            raise commands.BadArgument(str(error)) from None
@@ -0,0 +1,65 @@
+from collections import Counter
+
+
+class NicknameIndex:
+    """Display names in use per guild, compared case-insensitively.
+    A guild is indexed from its members the first time it is needed, then kept up
+    to date from the member events, so checking a name is a dict lookup whatever
+    the size of the guild. Names are indexed by member ID, so that an event only
+    needs the member ID to forget a name, whether the member was cached or not.
+
+    Members outside the member cache are renamed without any event, their name is
+    recorded again when they send a message. Until then the index holds their
+    previous name, which can only let a drawn name collide with their new one.
+    """
+
+    def __init__(self):
+        # guild ID -> member ID -> casefolded display name
+        self._members = {}
+        # guild ID -> Counter of the casefolded display names, members can share one
+        self._names = {}
+
+    def __contains__(self, guild_id):
+        return guild_id in self._members
+
+    def build(self, guild_id, members):
+        names = {member.id: member.display_name.casefold() for member in members}
+        self._members[guild_id] = names
+        self._names[guild_id] = Counter(names.values())
+
+    def taken(self, guild_id):
+        """Return the casefolded names in use in the guild, supporting `in`."""
+
+        return self._names.get(guild_id, frozenset())
+
+    def set(self, guild_id, member_id, name):
+        """Record the current display name of the member."""
+
+        members = self._members.get(guild_id)
+        if members is None:
+            return
+
+        name = name.casefold()
+        if members.get(member_id) == name:
+            return
+        self.discard(guild_id, member_id)
+        members[member_id] = name
+        self._names[guild_id][name] += 1
+
+    def discard(self, guild_id, member_id):
+        members = self._members.get(guild_id)
+        if members is None:
+            return
+
+        name = members.pop(member_id, None)
+        if name is None:
+            return
+
+        names = self._names[guild_id]
+        names[name] -= 1
+        if names[name] <= 0:
+            del names[name]
+
+    def drop(self, guild_id):
+        self._members.pop(guild_id, None)
+        self._names.pop(guild_id, None)
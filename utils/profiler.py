@@ -0,0 +1,177 @@
+"""Sampling profiler for the live bot process, see the `profile` command.
+
+Nothing runs until a profile is started: the sampler is a thread reading the
+stacks of the other threads with `sys._current_frames`, which covers the event
+loop, the aiosqlite thread and the `run_blocking` executor threads alike.
+"""
+import asyncio
+from collections import Counter
+import contextlib
+from pathlib import Path
+import sys
+import threading
+import time
+
+# leaf frames of a thread waiting for work, left out of the samples
+_IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _label(code):
+    path = Path(code.co_filename)
+    try:
+        path = path.relative_to(Path.cwd())
+    except ValueError:
+        # library code: the package directory and file are enough
+        path = Path(path.parent.name, path.name)
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ",")
+
+
+class SamplingProfiler:
+    """Record the stacks of every thread each `interval` seconds."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        # (thread name, *frame labels from the root) -> samples
+        self.stacks = Counter()
+        self.ticks = 0
+        self.idle = Counter()  # thread name -> idle samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        labels = {}  # code object -> label, computed once per function
+
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+
+                name = names.get(ident, str(ident))
+                code = frame.f_code
+                if (Path(code.co_filename).name, code.co_name) in _IDLE_FRAMES:
+                    self.idle[name] += 1
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    if code not in labels:
+                        labels[code] = _label(code)
+                    stack.append(labels[code])
+                    frame = frame.f_back
+                self.stacks[(name, *reversed(stack))] += 1
+            self.ticks += 1
+
+    def collapsed(self):
+        """Return the samples in the collapsed format read by flamegraph.pl and
+        speedscope: one `thread;root;...;leaf count` line per stack.
+        """
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def hottest(self, limit=15):
+        """Return the (function, self samples, total samples) of the functions
+        with the most samples, counting each function once per stack for totals.
+        """
+        own, total = Counter(), Counter()
+        for (_, *frames), count in self.stacks.items():
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+
+        return [
+            (label, own[label], count) for label, count in total.most_common(limit)
+        ]
+
+    def busy(self, thread_name):
+        """Return the ratio of samples where the thread was not waiting."""
+
+        busy = sum(c for (name, *_), c in self.stacks.items() if name == thread_name)
+        samples = busy + self.idle[thread_name]
+        return busy / samples if samples else 0.0
+
+
+def _describe(handle):
+    # `_callback` is private, but Handle has no public accessor for it; a task
+    # step is a bound method of the task, named after its coroutine instead
+    callback = handle._callback
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return f"{owner.get_name()} {getattr(coro, '__qualname__', coro)!r}"
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+@contextlib.contextmanager
+def slow_steps(threshold):
+    """Collect the coroutine steps and callbacks of the event loops running for
+    more than `threshold` seconds, within this block.
+    Every step of a loop is a `Handle` run, so `Handle._run` is wrapped with a
+    timer for the block. The asyncio debug mode would report them too, but it
+    also tracks the creation of every coroutine and handle, which would slow
+    down the very code being profiled.
+    """
+    steps = []
+    run = asyncio.Handle._run
+
+    def timed_run(handle):
+        start = time.perf_counter()
+        try:
+            return run(handle)
+        finally:
+            duration = time.perf_counter() - start
+            if duration > threshold:
+                steps.append(f"{_describe(handle)} took {duration * 1000:.0f}ms")
+
+    asyncio.Handle._run = timed_run
+    try:
+        yield steps
+    finally:
+        asyncio.Handle._run = run
+
+
+def profile_table(profiler, limit=15):
+    """Format the hottest functions of the profile as a text table."""
+
+    lines = [
+        f"{profiler.ticks} samples every {profiler.interval * 1000:g}ms, "
+        f"event loop busy {profiler.busy(threading.main_thread().name):.0%}",
+        "",
+        f"{'self':>6} {'total':>6}  function",
+    ]
+    ticks = profiler.ticks or 1
+    for label, own, total in profiler.hottest(limit):
+        lines.append(f"{own / ticks:>6.1%} {total / ticks:>6.1%}  {label}")
+    return "\n".join(lines)
+
+
+async def run_profile(seconds, threshold, interval=0.005):
+    """Sample the process for `seconds`, and return the profiler with the event
+    loop steps that ran for more than `threshold` seconds meanwhile.
+    """
+    profiler = SamplingProfiler(interval)
+    with slow_steps(threshold) as steps:
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+
+    return profiler, steps
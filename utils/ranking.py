@@ -0,0 +1,204 @@
+import random
+
+_MAX_LEVELS = 24  # plenty for 2**24 (~16M) elements
+_END = (float("inf"),)  # compares above every (-score, member ID) key
+
+
+def _random_levels():
+    levels = 1
+    while levels < _MAX_LEVELS and random.random() < 0.5:
+        levels += 1
+    return levels
+
+
+class _Node:
+    __slots__ = ("value", "next", "width")
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [None] * levels
+
+
+class IndexableSkipList:
+    """Sorted sequence with O(log n) insertion, removal, and lookup by value
+    (`index`) or by position (`[]`).
+    Based on https://code.activestate.com/recipes/576930/.
+    """
+
+    def __init__(self, values=()):
+        self.size = 0
+        self._nil = _Node(_END, 0)
+        self._head = _Node(None, _MAX_LEVELS)
+        self._head.next = [self._nil] * _MAX_LEVELS
+        self._head.width = [1] * _MAX_LEVELS
+
+        if values:
+            self._build(sorted(values))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        return self._node_at(index).value
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, index):
+        """Iterate over the values starting at position `index`."""
+
+        if index >= self.size:
+            return
+        node = self._node_at(index)
+        while node is not self._nil:
+            yield node.value
+            node = node.next[0]
+
+    def index(self, value):
+        """Return the position of `value`, raise ValueError if it is missing."""
+
+        node, position = self._head, 0
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+
+        if node.next[0].value != value:
+            raise ValueError(f"{value!r} is not in the list")
+        return position
+
+    def insert(self, value):
+        chain = [None] * _MAX_LEVELS
+        steps_at_level = [0] * _MAX_LEVELS
+        node = self._head
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        new_node = _Node(value, _random_levels())
+        steps = 0
+        levels = len(new_node.next)
+        for level in range(levels):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, _MAX_LEVELS):
+            chain[level].width[level] += 1
+
+        self.size += 1
+
+    def remove(self, value):
+        chain = [None] * _MAX_LEVELS
+        node = self._head
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target.value != value:
+            raise ValueError(f"{value!r} is not in the list")
+
+        levels = len(target.next)
+        for level in range(levels):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(levels, _MAX_LEVELS):
+            chain[level].width[level] -= 1
+
+        self.size -= 1
+
+    def _build(self, values):
+        """Link the sorted `values` in O(n), instead of n insertions."""
+
+        last = [self._head] * _MAX_LEVELS
+        last_position = [0] * _MAX_LEVELS
+        for position, value in enumerate(values, 1):
+            node = _Node(value, _random_levels())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level], last_position[level] = node, position
+
+        self.size = len(values)
+        for level in range(_MAX_LEVELS):
+            last[level].next[level] = self._nil
+            last[level].width[level] = self.size + 1 - last_position[level]
+
+    def _node_at(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError("skip list index out of range")
+
+        node, remaining = self._head, index + 1
+        for level in reversed(range(_MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        return node
+
+
+class Ranking:
+    """Members of a guild ordered by a score, such as their experience.
+    Updating a score, the rank of a member and the top-N are O(log n). Members
+    without a positive score are not ranked.
+    """
+
+    def __init__(self, scores=None):
+        """`scores` optionally maps member IDs to their initial score. The mapping
+        is kept and updated with the scores, a dict by default or e.g. a column of
+        a MemberStore, and its scores that are not positive are removed.
+        """
+        self._scores = {} if scores is None else scores
+        for member_id, score in list(self._scores.items()):
+            if score <= 0:
+                self._scores.pop(member_id)
+        self._order = IndexableSkipList(
+            [(-score, member_id) for member_id, score in self._scores.items()]
+        )
+
+    def __len__(self):
+        return len(self._order)
+
+    def score(self, member_id):
+        return self._scores.get(member_id, 0)
+
+    def set(self, member_id, score):
+        old = self._scores.get(member_id)
+        if old is not None:
+            self._order.remove((-old, member_id))
+
+        # overwritten rather than removed then added, which for a MemberStore
+        # column would shift its arrays twice
+        if score > 0:
+            self._scores[member_id] = score
+            self._order.insert((-score, member_id))
+        elif old is not None:
+            self._scores.pop(member_id)
+
+    def add(self, member_id, amount):
+        self.set(member_id, self.score(member_id) + amount)
+
+    def rank(self, member_id):
+        """Return the 1-based rank of the member, or None if unranked."""
+
+        score = self._scores.get(member_id)
+        if score is None:
+            return None
+        return self._order.index((-score, member_id)) + 1
+
+    def top(self, limit=10, offset=0):
+        """Return up to `limit` (member ID, score) pairs starting at `offset`."""
+
+        pairs = []
+        for negative_score, member_id in self._order.iter_from(offset):
+            if len(pairs) >= limit:
+                break
+            pairs.append((member_id, -negative_score))
+        return pairs
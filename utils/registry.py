@@ -0,0 +1,143 @@
+"""Registry of the guilds and members the stored data belongs to.
+
+Every table holding guild or member data references `registry_guild` or
+`registry_member` with ON DELETE CASCADE, and a trigger registers the guild and
+member of each inserted row. The Retention cog marks the registry rows when the
+bot leaves a guild or a member leaves, and purges their data after a grace period.
+"""
+import re
+
+GUILD_FOREIGN_KEY = (
+    "FOREIGN KEY (guild_id) REFERENCES registry_guild(guild_id) ON DELETE CASCADE"
+)
+MEMBER_FOREIGN_KEY = (
+    "FOREIGN KEY (guild_id, member_id) "
+    "REFERENCES registry_member(guild_id, member_id) ON DELETE CASCADE"
+)
+
+# table -> (scope, key): the scope is "guild" or "member", the key identifies
+# the rows of the table for the batched purge deletes
+TABLES = {}
+
+
+async def create_tables(db):
+    """Create the registry tables if they do not exist."""
+
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS registry_guild(
+            guild_id INTEGER PRIMARY KEY,
+            left_at  TIMESTAMP
+        )
+        """
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS registry_member(
+            guild_id  INTEGER NOT NULL,
+            member_id INTEGER NOT NULL,
+            left_at   TIMESTAMP,
+            PRIMARY KEY (guild_id, member_id),
+            FOREIGN KEY (guild_id) REFERENCES registry_guild(guild_id)
+                ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """
+    )
+    await db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS registry_guild_left_at
+            ON registry_guild(left_at)
+         WHERE left_at IS NOT NULL
+        """
+    )
+    await db.execute(
+        """
+        CREATE INDEX IF NOT EXISTS registry_member_left_at
+            ON registry_member(left_at)
+         WHERE left_at IS NOT NULL
+        """
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS registry_member_guild
+        BEFORE INSERT ON registry_member
+        BEGIN
+            INSERT OR IGNORE INTO registry_guild(guild_id) VALUES (NEW.guild_id);
+        END
+        """
+    )
+
+
+async def register_table(db, table, scope, *, key="rowid", derived=False):
+    """Attach a data table, created with the foreign key of its scope, to the
+    registry.
+
+    Tables created before the registry existed are rebuilt with the foreign key.
+    The rebuild drops the table's indexes and triggers, so call this right after
+    the CREATE TABLE statement. `key` lists the primary key columns of WITHOUT
+    ROWID tables. `derived` tables, whose rows are only written by triggers on
+    another registered table, skip the registration trigger.
+    """
+    await create_tables(db)
+    TABLES[table] = (scope, key)
+
+    async with db.execute(f"PRAGMA foreign_key_list({table})") as c:
+        has_foreign_key = await c.fetchone() is not None
+    if not has_foreign_key:
+        await _rebuild_with_foreign_key(db, table, scope)
+
+    if derived:
+        return
+
+    if scope == "member":
+        registration = (
+            "INSERT OR IGNORE INTO registry_member(guild_id, member_id) "
+            "VALUES (NEW.guild_id, NEW.member_id);"
+        )
+    else:
+        registration = (
+            "INSERT OR IGNORE INTO registry_guild(guild_id) VALUES (NEW.guild_id);"
+        )
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_registry
+        BEFORE INSERT ON {table}
+        BEGIN
+            {registration}
+        END
+        """
+    )
+
+
+async def _rebuild_with_foreign_key(db, table, scope):
+    async with db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :table",
+        dict(table=table),
+    ) as c:
+        (sql,) = await c.fetchone()
+
+    # register the existing rows before they are copied under the foreign key
+    await db.execute(
+        f"INSERT OR IGNORE INTO registry_guild(guild_id) "
+        f"SELECT DISTINCT guild_id FROM {table}"
+    )
+    if scope == "member":
+        await db.execute(
+            f"INSERT OR IGNORE INTO registry_member(guild_id, member_id) "
+            f"SELECT DISTINCT guild_id, member_id FROM {table}"
+        )
+
+    foreign_key = MEMBER_FOREIGN_KEY if scope == "member" else GUILD_FOREIGN_KEY
+    columns_end = sql.rindex(")")
+    sql = f"{sql[:columns_end].rstrip()},\n    {foreign_key}\n{sql[columns_end:]}"
+    sql = re.sub(
+        rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?{table}\"?",
+        f"CREATE TABLE {table}_rebuild",
+        sql,
+        flags=re.IGNORECASE,
+    )
+
+    await db.execute(sql)
+    await db.execute(f"INSERT INTO {table}_rebuild SELECT * FROM {table}")
+    await db.execute(f"DROP TABLE {table}")
+    await db.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
@@ -0,0 +1,33 @@
+"""Registry of the named SQL statements run by the cogs, besides their schema.
+
+The cogs declare these statements at module level with `statement`, and
+`python -m benchmarks.query_plans` checks the query plan and the latency of every
+registered statement against a synthetic database.
+"""
+from typing import NamedTuple
+
+# plan details that mean a statement reads a whole table, or sorts its rows
+FULL_SCAN = "SCAN"
+TEMP_BTREE = "USE TEMP B-TREE"
+
+STATEMENTS = {}
+
+
+class Statement(NamedTuple):
+    name: str
+    sql: str
+    # plan details accepted for this statement, e.g. TEMP_BTREE for a sort by an
+    # aggregate, which no index can provide
+    allow: tuple
+    # latency budget in seconds, on the synthetic database
+    budget: float
+
+
+def statement(name, sql, *, allow=(), budget=0.05):
+    """Register `sql` under `name` and return it, to be used as a constant."""
+
+    if name in STATEMENTS and STATEMENTS[name].sql != sql:
+        raise ValueError(f"Statement {name!r} is already registered")
+
+    STATEMENTS[name] = Statement(name, sql, tuple(allow), budget)
+    return sql
@@ -0,0 +1,370 @@
+from array import array
+from bisect import bisect_left
+
+import numpy as np
+
+_MISSING = object()
+
+
+class MemberStore:
+    """Per-member fields of many guilds, kept in compact columns shared by the
+    cogs, each declaring its fields with `add_column`.
+    Each guild has a sorted array of member IDs, found by binary search, and one
+    array per field aligned with it, with a byte per member telling whether the
+    field is set. A member costs 8 bytes for its ID plus the size of its fields,
+    where a dict keyed by (guild ID, member ID) tuples costs hundreds of bytes of
+    tuples, boxed values and hash table slots. A member is removed once none of
+    its fields is set.
+
+    The columns are `array.array`s, so reading or updating one member stays close
+    to a dict lookup, and queries over a guild, such as `top` and `histogram`, run
+    on NumPy views of its arrays. Inserting a member shifts the arrays of its guild,
+    which is cheap next to the lookups as long as new members are rare, and bulk
+    loads go through `load` and `add_many`.
+    """
+
+    def __init__(self):
+        # field name -> array typecode, such as "q" for int64 or "d" for float64
+        self.typecodes = {}
+        # guild ID -> sorted member IDs, and field name -> values aligned with them
+        self._ids = {}
+        self._columns = {}
+        # guild ID -> field name -> bytearray, 1 where the field is set
+        self._set = {}
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._ids.values())
+
+    def add_column(self, name, typecode):
+        """Declare a field, 0 and unset for every member until set. Declaring it
+        again, e.g. from a reloaded cog, keeps its values.
+        """
+        if name in self.typecodes:
+            if self.typecodes[name] != typecode:
+                raise ValueError(
+                    f"Field {name!r} is already of type {self.typecodes[name]!r}"
+                )
+            return
+
+        self.typecodes[name] = typecode
+        for guild_id, ids in self._ids.items():
+            self._columns[guild_id][name] = array(typecode, [0]) * len(ids)
+            self._set[guild_id][name] = bytearray(len(ids))
+
+    def nbytes(self):
+        """Return the size of the arrays, in bytes."""
+
+        return sum(
+            ids.itemsize * len(ids)
+            + sum(v.itemsize * len(v) for v in self._columns[guild_id].values())
+            + sum(map(len, self._set[guild_id].values()))
+            for guild_id, ids in self._ids.items()
+        )
+
+    def has(self, guild_id, member_id, column):
+        index = self._find(guild_id, member_id)
+        return index is not None and bool(self._set[guild_id][column][index])
+
+    def get(self, guild_id, member_id, column, default=0):
+        """Return a field of the member, or `default` if it is not set."""
+
+        # inlined `_find`, this is the hot path of the cogs
+        ids = self._ids.get(guild_id)
+        if ids is not None:
+            index = bisect_left(ids, member_id)
+            if (
+                index < len(ids)
+                and ids[index] == member_id
+                and self._set[guild_id][column][index]
+            ):
+                return self._columns[guild_id][column][index]
+        return default
+
+    def set(self, guild_id, member_id, **values):
+        index = self._row(guild_id, member_id)
+        columns, is_set = self._columns[guild_id], self._set[guild_id]
+        for name, value in values.items():
+            columns[name][index] = value
+            is_set[name][index] = 1
+
+    def add(self, guild_id, member_id, column, amount):
+        """Add `amount` to a field of the member, and return the new value."""
+
+        ids = self._ids.get(guild_id)
+        index = -1 if ids is None else bisect_left(ids, member_id)
+        if not (0 <= index < len(ids) and ids[index] == member_id):
+            index = self._row(guild_id, member_id)
+        values = self._columns[guild_id][column]
+        values[index] += amount
+        self._set[guild_id][column][index] = 1
+        return values[index]
+
+    def add_many(self, guild_id, member_ids, column, amounts):
+        """Add `amounts` to a field of the members, like `add` for each of them,
+        inserting the missing members at once.
+        """
+        member_ids = np.asarray(member_ids, dtype=np.int64)
+        if not len(member_ids):
+            # e.g. a payroll run paying nobody, in a guild the store never saw
+            return
+
+        ids = self._ids.get(guild_id, array("q"))
+        missing = np.setdiff1d(member_ids, np.frombuffer(ids, dtype=np.int64))
+        if len(missing):
+            self._merge(guild_id, missing)
+
+        ids = np.frombuffer(self._ids[guild_id], dtype=np.int64)
+        dtype = np.dtype(self.typecodes[column])
+        values = np.frombuffer(self._columns[guild_id][column], dtype=dtype)
+        is_set = np.frombuffer(self._set[guild_id][column], dtype=np.uint8)
+        indices = ids.searchsorted(member_ids)
+        # unbuffered, a member listed twice gets both amounts
+        np.add.at(values, indices, amounts)
+        is_set[indices] = 1
+
+    def unset(self, guild_id, member_id, column):
+        """Clear a field of the member, and remove the member if no field is left."""
+
+        index = self._find(guild_id, member_id)
+        if index is None:
+            return
+
+        is_set = self._set[guild_id]
+        is_set[column][index] = 0
+        self._columns[guild_id][column][index] = 0
+        if not any(flags[index] for flags in is_set.values()):
+            del self._ids[guild_id][index]
+            for values in self._columns[guild_id].values():
+                del values[index]
+            for flags in is_set.values():
+                del flags[index]
+
+    def drop_guild(self, guild_id):
+        self._ids.pop(guild_id, None)
+        self._columns.pop(guild_id, None)
+        self._set.pop(guild_id, None)
+
+    def load(self, guild_id, column, member_ids, values):
+        """Replace a field of the guild's members, e.g. with the rows of a query
+        grouped by member: the members of `member_ids` get `values`, the field of
+        the others is cleared.
+        """
+        member_ids = np.asarray(member_ids, dtype=np.int64)
+        order = member_ids.argsort(kind="stable")
+        member_ids = member_ids[order]
+        self.clear(column, [guild_id])
+        self._merge(guild_id, member_ids)
+
+        ids = np.frombuffer(self._ids[guild_id], dtype=np.int64)
+        indices = ids.searchsorted(member_ids)
+        dtype = np.dtype(self.typecodes[column])
+        np.frombuffer(self._columns[guild_id][column], dtype=dtype)[indices] = (
+            np.asarray(values, dtype=dtype)[order]
+        )
+        np.frombuffer(self._set[guild_id][column], dtype=np.uint8)[indices] = 1
+
+    def clear(self, column, guild_ids=None):
+        """Clear a field in the guilds, or in every guild, and remove the members
+        left without any field.
+        """
+        for guild_id in list(self._ids if guild_ids is None else guild_ids):
+            if guild_id not in self._ids:
+                continue
+            is_set = self._set[guild_id]
+            other = [
+                np.frombuffer(flags, dtype=np.uint8)
+                for name, flags in is_set.items()
+                if name != column
+            ]
+            if other:
+                keep = np.logical_or.reduce(other).astype(bool)
+            else:
+                keep = np.zeros(len(self._ids[guild_id]), dtype=bool)
+            del other
+            self._filter(guild_id, keep)
+            count = len(self._ids[guild_id])
+            self._columns[guild_id][column] = array(self.typecodes[column], [0]) * count
+            is_set[column] = bytearray(count)
+
+    def column(self, guild_id, name):
+        """Return a field of the guild's members as a mapping, see StoreColumn."""
+
+        return StoreColumn(self, guild_id, name)
+
+    def items(self, guild_id, column):
+        """Return the (member ID, value) pairs of the guild's members with the
+        field set.
+        """
+        if guild_id not in self._ids:
+            return []
+
+        is_set = self._set[guild_id][column]
+        return [
+            (member_id, value)
+            for member_id, value, flag in zip(
+                self._ids[guild_id], self._columns[guild_id][column], is_set
+            )
+            if flag
+        ]
+
+    def top(self, guild_id, column, limit=10):
+        """Return up to `limit` (member ID, value) pairs of the guild with the
+        largest values of a set field, largest first and ties by member ID, like
+        an SQL `ORDER BY value DESC, member_id`.
+        """
+        if limit <= 0 or guild_id not in self._ids:
+            return []
+
+        ids, values = self._arrays(guild_id, column)
+        if limit < len(values):
+            # the `limit`-th largest value, in linear time, and every member
+            # reaching it, in member ID order as the IDs are sorted
+            cutoff = np.partition(values, len(values) - limit)[len(values) - limit]
+            candidates = np.flatnonzero(values >= cutoff)
+        else:
+            candidates = np.arange(len(values))
+        # sorted by value, ties by descending ID, then reversed
+        candidates = candidates[::-1]
+        best = candidates[values[candidates].argsort(kind="stable")[::-1]][:limit]
+        return [(int(ids[i]), values[i].item()) for i in best]
+
+    def histogram(self, guild_id, column, edges):
+        """Count the members of the guild with a set field per bucket of values,
+        such as levels: bucket `i` counts the values from `edges[i]` up to
+        `edges[i + 1]`, the last bucket is open ended and values below `edges[0]`
+        are not counted.
+        """
+        if guild_id not in self._ids:
+            return np.zeros(len(edges), dtype=np.int64)
+
+        _, values = self._arrays(guild_id, column)
+        buckets = np.searchsorted(edges, values, side="right") - 1
+        return np.bincount(buckets[buckets >= 0], minlength=len(edges))
+
+    def _arrays(self, guild_id, column):
+        """Return copies of the member IDs and values of the guild's members with
+        the field set. The views of the arrays are released, which resizing them
+        requires.
+        """
+        is_set = np.frombuffer(self._set[guild_id][column], dtype=np.uint8) != 0
+        ids = np.frombuffer(self._ids[guild_id], dtype=np.int64)[is_set]
+        values = np.frombuffer(
+            self._columns[guild_id][column],
+            dtype=np.dtype(self.typecodes[column]),
+        )[is_set]
+        return ids, values
+
+    def _find(self, guild_id, member_id):
+        """Return the index of the member in the arrays of its guild, or None."""
+
+        ids = self._ids.get(guild_id)
+        if ids is None:
+            return None
+        index = bisect_left(ids, member_id)
+        if index < len(ids) and ids[index] == member_id:
+            return index
+        return None
+
+    def _row(self, guild_id, member_id):
+        """Return the index of the member in the arrays of its guild, inserting it
+        if needed.
+        """
+        if guild_id not in self._ids:
+            self._merge(guild_id, ())
+
+        ids = self._ids[guild_id]
+        index = bisect_left(ids, member_id)
+        if index < len(ids) and ids[index] == member_id:
+            return index
+
+        ids.insert(index, member_id)
+        for values in self._columns[guild_id].values():
+            values.insert(index, 0)
+        for flags in self._set[guild_id].values():
+            flags.insert(index, 0)
+        return index
+
+    def _merge(self, guild_id, member_ids):
+        """Insert the sorted `member_ids` missing from the guild at once, with
+        every field unset.
+        """
+        if guild_id not in self._ids:
+            self._ids[guild_id] = array("q")
+            self._columns[guild_id] = {
+                name: array(typecode) for name, typecode in self.typecodes.items()
+            }
+            self._set[guild_id] = {name: bytearray() for name in self.typecodes}
+
+        old_ids = np.frombuffer(self._ids[guild_id], dtype=np.int64)
+        ids = np.union1d(old_ids, member_ids)
+        if len(ids) == len(old_ids):
+            return
+        positions = ids.searchsorted(old_ids)
+        del old_ids
+
+        self._ids[guild_id] = array("q", ids.tobytes())
+        columns, is_set = self._columns[guild_id], self._set[guild_id]
+        for name, typecode in self.typecodes.items():
+            dtype = np.dtype(typecode)
+            values = np.zeros(len(ids), dtype=dtype)
+            values[positions] = np.frombuffer(columns[name], dtype=dtype)
+            columns[name] = array(typecode, values.tobytes())
+            flags = np.zeros(len(ids), dtype=np.uint8)
+            flags[positions] = np.frombuffer(is_set[name], dtype=np.uint8)
+            is_set[name] = bytearray(flags.tobytes())
+
+    def _filter(self, guild_id, keep):
+        """Keep the members of the guild where the boolean array `keep` is true."""
+
+        if keep.all():
+            return
+
+        ids = np.frombuffer(self._ids[guild_id], dtype=np.int64)[keep]
+        self._ids[guild_id] = array("q", ids.tobytes())
+        columns, is_set = self._columns[guild_id], self._set[guild_id]
+        for name, typecode in self.typecodes.items():
+            dtype = np.dtype(typecode)
+            values = np.frombuffer(columns[name], dtype=dtype)[keep]
+            columns[name] = array(typecode, values.tobytes())
+            flags = np.frombuffer(is_set[name], dtype=np.uint8)[keep]
+            is_set[name] = bytearray(flags.tobytes())
+
+
+class StoreColumn:
+    """A field of a guild's members in a MemberStore, as a mapping of the member
+    IDs to their value, holding the members with the field set. It can stand in
+    for a dict, such as the scores of a Ranking.
+    """
+
+    def __init__(self, store, guild_id, name):
+        self.store = store
+        self.guild_id = guild_id
+        self.name = name
+
+    def __len__(self):
+        return len(self.items())
+
+    def __contains__(self, member_id):
+        return self.store.has(self.guild_id, member_id, self.name)
+
+    def __getitem__(self, member_id):
+        value = self.get(member_id, _MISSING)
+        if value is _MISSING:
+            raise KeyError(member_id)
+        return value
+
+    def __setitem__(self, member_id, value):
+        self.store.set(self.guild_id, member_id, **{self.name: value})
+
+    def get(self, member_id, default=None):
+        return self.store.get(self.guild_id, member_id, self.name, default)
+
+    def pop(self, member_id, default=None):
+        value = self.get(member_id, _MISSING)
+        if value is _MISSING:
+            return default
+        self.store.unset(self.guild_id, member_id, self.name)
+        return value
+
+    def items(self):
+        return self.store.items(self.guild_id, self.name)
@@ -1,12 +1,93 @@
+import asyncio
+from collections import Counter
+from datetime import timedelta
+import logging
+
 import discord
+from discord.ext import commands
+
+from utils.statements import FULL_SCAN, statement
+
+log = logging.getLogger(__name__)
+
+_DELETE_EXPIRED_SQL = statement(
+    "views.delete_expired",
+    """
+    DELETE FROM view_registry WHERE expires_at <= :now
+    """,
+)
+
+_PERSIST_SQL = statement(
+    "views.persist",
+    """
+    INSERT OR REPLACE INTO view_registry
+    VALUES (:message_id,
+            :guild_id,
+            :user_id,
+            :kind,
+            :custom_id,
+            :payload,
+            :expires_at)
+    """,
+)
+
+_DELETE_SQL = statement(
+    "views.delete",
+    """
+    DELETE FROM view_registry WHERE message_id = :message_id
+    """,
+)
+
+_ALL_VIEWS_SQL = statement(
+    "views.all_views",
+    """
+    SELECT *
+      FROM view_registry
+    """,
+    allow=[FULL_SCAN],
+    budget=1.0,
+)
+
+
+class ViewLimitReached(commands.CommandError):
+    """Exception raised when a guild or user has too many live views."""
+
+
+class ManagedView(discord.ui.View):
+    """View whose lifetime is tracked by the bot's ViewManager.
+    The manager enforces the timeout itself, so the view has no discord.py timeout
+    and can be persistent when all its items have a custom ID.
+    """
+
+    def __init__(self):
+        super().__init__(timeout=None)
+        self._manager = None
+
+    def stop(self):
+        super().stop()
+        if self._manager is not None:
+            self._manager.release(self)
 
 
 # Define a simple View that gives us a confirmation menu
 # taken from https://github.com/Rapptz/discord.py/blob/master/examples/views/confirm.py
-class Confirm(discord.ui.View):
-    def __init__(self):
+class Confirm(ManagedView):
+    def __init__(self, *, author_id=None, custom_id=None):
         super().__init__()
         self.value = None
+        self.author_id = author_id
+        self.custom_id = custom_id
+
+        # persistent custom IDs let the view be restored after a restart
+        if custom_id is not None:
+            self.confirm.custom_id = f"{custom_id}:confirm"
+            self.cancel.custom_id = f"{custom_id}:cancel"
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        return self.author_id is None or interaction.user.id == self.author_id
+
+    async def on_confirm(self, interaction: discord.Interaction):
+        """Called when the confirm button is pressed, before the view stops."""
 
     # When the confirm button is pressed, set the inner value to `True` and
     # stop the View from listening to more input.
@@ -17,6 +98,7 @@ class Confirm(discord.ui.View):
     ):
         await interaction.response.send_message("Confirming", ephemeral=True)
         self.value = True
+        await self.on_confirm(interaction)
         self.stop()
 
     # This one is similar to the confirmation button except sets the inner value
@@ -26,3 +108,197 @@ class Confirm(discord.ui.View):
         await interaction.response.send_message("Cancelling", ephemeral=True)
         self.value = False
         self.stop()
+
+
+class ViewManager:
+    """Registry of the live views of the bot.
+    It caps the number of live views per guild and per user, stops views once
+    their timeout is reached, and stores the views sent with `persist` so that
+    they can be restored after a restart.
+    """
+
+    def __init__(
+        self, bot, *, timeout=300.0, max_per_guild=100, max_per_user=3, interval=15.0
+    ):
+        self.bot = bot
+        self.timeout = timeout
+        self.max_per_guild = max_per_guild
+        self.max_per_user = max_per_user
+        self.interval = interval
+
+        # view -> (guild ID, user ID, expiry time)
+        self._views = {}
+        self._per_guild = Counter()
+        self._per_user = Counter()
+        # view -> message ID, for the views stored in the DB
+        self._persisted = {}
+        # message IDs of finished views, deleted from the DB by the sweeper
+        self._finished = set()
+        # kind -> callable(row) returning the view to restore
+        self._factories = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._views)
+
+    def register_factory(self, kind, factory):
+        """Register how to rebuild the views persisted with `kind`."""
+
+        self._factories[kind] = factory
+
+    def add(self, view: ManagedView, *, guild_id, user_id, timeout=None):
+        """Start tracking the view, raise ViewLimitReached when over the caps."""
+
+        if self._per_user[user_id] >= self.max_per_user:
+            raise ViewLimitReached(
+                "You already have too many pending prompts, answer them first."
+            )
+        if guild_id is not None and self._per_guild[guild_id] >= self.max_per_guild:
+            raise ViewLimitReached("There are too many pending prompts in this server.")
+
+        expires_at = discord.utils.utcnow() + timedelta(seconds=timeout or self.timeout)
+        self._track(view, guild_id, user_id, expires_at)
+        return view
+
+    async def persist(self, view, message: discord.Message, kind, payload=""):
+        """Store a view sent in `message`, so it is restored after a restart.
+        The view must have a `custom_id`, from which its items' IDs derive.
+        """
+        if view not in self._views:  # already answered
+            return
+
+        guild_id, user_id, expires_at = self._views[view]
+        await self.bot.db.execute(
+            _PERSIST_SQL,
+            dict(
+                message_id=message.id,
+                guild_id=guild_id,
+                user_id=user_id,
+                kind=kind,
+                custom_id=view.custom_id,
+                payload=payload,
+                expires_at=expires_at,
+            ),
+        )
+        await self.bot.db.commit()
+        self._persisted[view] = message.id
+
+    def release(self, view):
+        """Stop tracking the view, called when it stops."""
+
+        if view not in self._views:
+            return
+
+        guild_id, user_id, _ = self._views.pop(view)
+        self._per_user[user_id] -= 1
+        if self._per_user[user_id] <= 0:
+            del self._per_user[user_id]
+        if guild_id is not None:
+            self._per_guild[guild_id] -= 1
+            if self._per_guild[guild_id] <= 0:
+                del self._per_guild[guild_id]
+
+        message_id = self._persisted.pop(view, None)
+        if message_id is not None:
+            self._finished.add(message_id)
+
+    def stats(self):
+        return dict(
+            live=len(self._views),
+            persisted=len(self._persisted),
+            guilds=len(self._per_guild),
+            users=len(self._per_user),
+        )
+
+    async def create_tables(self, db):
+        """Create the necessary DB tables if they do not exist."""
+
+        await db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS view_registry(
+                message_id INTEGER   PRIMARY KEY,
+                guild_id   INTEGER,
+                user_id    INTEGER   NOT NULL,
+                kind       TEXT      NOT NULL,
+                custom_id  TEXT      NOT NULL,
+                payload    TEXT      NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+            """
+        )
+        await db.execute(
+            """
+            CREATE INDEX IF NOT EXISTS view_registry_expires_at
+                ON view_registry(expires_at)
+            """
+        )
+
+    async def restore(self):
+        """Re-register the persisted views that did not expire yet."""
+
+        await self._delete_expired()
+
+        restored = 0
+        async with self.bot.db.execute(_ALL_VIEWS_SQL) as c:
+            async for row in c:
+                factory = self._factories.get(row["kind"])
+                if factory is None or (
+                    row["guild_id"] is not None
+                    and not self.bot.owns_guild(row["guild_id"])
+                ):
+                    continue
+
+                view = factory(row)
+                self._track(view, row["guild_id"], row["user_id"], row["expires_at"])
+                self._persisted[view] = row["message_id"]
+                self.bot.add_view(view, message_id=row["message_id"])
+                restored += 1
+
+        log.info("Restored %d views", restored)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._sweep_forever())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _track(self, view, guild_id, user_id, expires_at):
+        view._manager = self
+        self._views[view] = (guild_id, user_id, expires_at)
+        self._per_user[user_id] += 1
+        if guild_id is not None:
+            self._per_guild[guild_id] += 1
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                log.exception("Failed to sweep the views")
+
+    async def sweep(self):
+        """Time out the expired views and forget the finished ones."""
+
+        now = discord.utils.utcnow()
+        expired = [view for view, (*_, at) in self._views.items() if at <= now]
+        for view in expired:
+            view.stop()
+            await view.on_timeout()
+
+        if self._finished:
+            finished, self._finished = self._finished, set()
+            await self.bot.db.executemany(
+                _DELETE_SQL,
+                [dict(message_id=message_id) for message_id in finished],
+            )
+            await self.bot.db.commit()
+
+        await self._delete_expired()
+
+    async def _delete_expired(self):
+        await self.bot.db.execute(_DELETE_EXPIRED_SQL, dict(now=discord.utils.utcnow()))
+        await self.bot.db.commit()